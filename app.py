@@ -1,122 +1,614 @@
 # app.py
 
+import atexit
+import csv
+import hmac
 import logging
-from flask import Flask, render_template, request, redirect, url_for
+import math
+import os
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from flask import Flask, render_template, request, redirect, url_for, abort, session, jsonify, Response
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
 from typing import List # Importar List
 
 # Importar el controlador y las clases necesarias de models
 from controller.controller import PedidoController
-from models.chain import ItemConfiteria, EstadoPedido # Importar ItemConfiteria y EstadoPedido
-from models.iterator import AsientosCollection  # Añadir esta importación
+from controller.sesiones import PoolControladores
+from controller.cadenas import registro_cadenas, construir_cadena_por_defecto
+from controller.lotes import ProcesadorLotes, leer_csv_lote
+from controller.mapa_asientos import CacheMapaAsientos
+from controller.sala_espera import SalaEspera
+from models.chain import ItemConfiteria, EstadoPedido, BaseManejadorPedido, maquina_pedidos # Importar ItemConfiteria y EstadoPedido
+from models.state import EventoPedido, TransicionInvalida
+from models.registro_funciones import RegistroInventarios, DistribucionSala, clave_funcion, distribuciones_desde_texto
+from models.iterator import AsientosCollectionConcurrente
+from models.memento import GestorHistorialDeltas
+from models.almacen_pedidos import AlmacenPedidos, AlmacenPedidosCompacto
+from models.precios import motor_desde_texto
+from models.descuentos import cargar_reglas, devolver_canjes, reglas_canjeadas
+from servicios.persistencia_sqlite import RepositorioSQLite
+from servicios.diario_eventos import DiarioEventos
+from servicios.eventos_asientos import DifusorAsientos
+from servicios.limite_tasa import LimitadorTasa, LimiteConexiones, presupuestos_desde_texto
+from servicios.logs import configurar_logging_desde_entorno
+from servicios.metricas import RegistroMetricas, InstrumentacionCadena
+from servicios.pasarela_pago import PasarelaHTTPAsync
 
-# Configurar logging (para ver los mensajes de los manejadores y el controlador)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configurar logging (para ver los mensajes de los manejadores y el controlador).
+# Niveles por subsistema y escritura asíncrona se controlan con LOG_NIVEL, LOG_NIVELES,
+# LOG_ASINCRONO y LOG_FORMATO (ver servicios/logs.py).
+configurar_logging_desde_entorno()
 logger = logging.getLogger(__name__) # Logger para el módulo app.py
 
 app = Flask(__name__)
-# Nota: Para una aplicación real, el secret_key es necesario para sesiones,
-# pero para este ejemplo académico simple, no usaremos sesiones complejas.
-# app.config['SECRET_KEY'] = 'tu_clave_secreta_aqui'
+# La cookie de sesión solo guarda el ID de sesión; el estado vive en el pool de controladores.
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or os.urandom(32)
+# Detrás de proxies inversos (PROXIES_CONFIABLES = cuántos), la IP del cliente se toma de
+# X-Forwarded-For; sin ellos, request.remote_addr es la del proxy y todos compartirían su límite.
+# No activarlo sin proxy: cualquier cliente podría elegir su IP con esa cabecera.
+if int(os.environ.get('PROXIES_CONFIABLES', 0)) > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ['PROXIES_CONFIABLES']))
 
-# Instancia del controlador. Para este ejemplo académico, mantenemos una instancia global.
-# En una app más compleja, esto se manejaría por usuario o sesión.
-controller = PedidoController()
+# Historial de pedidos completados, compartido por todas las sesiones.
+# Con HISTORIAL_COMPACTO=1 se guarda por columnas (menos memoria por pedido en historiales grandes).
+almacen_pedidos = AlmacenPedidosCompacto() if os.environ.get('HISTORIAL_COMPACTO') == '1' else AlmacenPedidos()
 
-# Reemplazar la lista ALL_SEATS con la colección de asientos
-asientos_collection = AsientosCollection()
-ALL_SEATS = []
-iterator = asientos_collection.crear_iterator_por_fila()
-while iterator.has_next():
-    ALL_SEATS.append(iterator.next())
+# Pasarela de pago: con PASARELA_PAGO_URL se cobra contra ese endpoint HTTP
+# (p. ej. servicios/servidor_pago_stub.py); sin ella se usa la simulación local.
+pasarela_pago = None
+if os.environ.get('PASARELA_PAGO_URL'):
+    pasarela_pago = PasarelaHTTPAsync(
+        os.environ['PASARELA_PAGO_URL'],
+        max_conexiones=int(os.environ.get('PASARELA_MAX_CONEXIONES', 20)),
+        timeout_conexion=float(os.environ.get('PASARELA_TIMEOUT_CONEXION', 2.0)),
+        timeout_total=float(os.environ.get('PASARELA_TIMEOUT_TOTAL', 5.0))
+    )
+
+# Precios por zona e impuestos por categoría, p. ej. PRECIOS_ZONA="preferencial=14000,general=10000",
+# ZONAS_FILA="A=preferencial" e IMPUESTOS_CATEGORIA="boleta=1900,confiteria=800" (puntos básicos)
+motor_precios = motor_desde_texto(os.environ.get('PRECIOS_ZONA'), os.environ.get('ZONAS_FILA'),
+                                  os.environ.get('IMPUESTOS_CATEGORIA'))
+# Cupones y descuentos automáticos (CUPONES_RUTA): archivo JSON o CSV con las reglas
+# (ver models/descuentos.py). Sin él se aplican las reglas por defecto.
+motor_descuentos = cargar_reglas(os.environ['CUPONES_RUTA']) if os.environ.get('CUPONES_RUTA') else None
+registro_cadenas.registrar('por_defecto',
+                           lambda: construir_cadena_por_defecto(pasarela_pago, motor_precios, motor_descuentos))
+
+# Modo de ejecución de la cadena de pedidos: 'plano' (iterativo) o 'recursivo'
+cadena_pedidos = registro_cadenas.obtener_por_modo(os.environ.get('MODO_CADENA', 'plano'))
+
+# Historial de deshacer/rehacer por sesión: acotado y codificado como operaciones
+PROFUNDIDAD_HISTORIAL = int(os.environ.get('PROFUNDIDAD_HISTORIAL', 100))
+
+def _crear_historial():
+    return GestorHistorialDeltas(profundidad_maxima=PROFUNDIDAD_HISTORIAL)
+
+def _crear_controlador():
+    return PedidoController(cadena=cadena_pedidos, fabrica_historial=_crear_historial,
+                            almacen_pedidos=almacen_pedidos)
+
+# Un PedidoController por sesión (selección, deshacer/rehacer y pedido propios).
+# El pool es acotado: expulsa las sesiones menos usadas o inactivas.
+pool_controladores = PoolControladores(
+    fabrica=_crear_controlador,
+    capacidad_maxima=int(os.environ.get('MAX_SESIONES', 1000)),
+    ttl_segundos=float(os.environ.get('TTL_SESION_SEGUNDOS', 1800))
+)
+
+# Métricas del proceso, exportadas en formato Prometheus en /metrics
+registro_metricas = RegistroMetricas()
+if os.environ.get('METRICAS_CADENA', '1') != '0':
+    BaseManejadorPedido.instrumentacion = InstrumentacionCadena(registro_metricas)
+registro_metricas.indicador('cine_sesiones_activas', 'Controladores de sesión en memoria',
+                            lambda: pool_controladores.tamano)
+registro_metricas.indicador('cine_sesiones_tasa_aciertos', 'Tasa de aciertos del pool de sesiones',
+                            lambda: pool_controladores.tasa_aciertos)
+
+# Límite de solicitudes por sesión y por IP en las rutas que cambian la selección, en los lotes
+# y en la apertura de streams de eventos de asientos
+# (LIMITE_TASA: 'endpoint=ráfaga/por segundo,...'; LIMITE_TASA=0 lo desactiva).
+# Cada IP tiene LIMITE_TASA_FACTOR_IP veces el presupuesto de una sesión; la IP es
+# request.remote_addr (la del cliente detrás de proxies si se configura PROXIES_CONFIABLES).
+PRESUPUESTOS_POR_DEFECTO = {
+    'select_seat': (20, 5.0),
+    'deselect_seat': (20, 5.0),
+    'api_seleccion_asiento': (20, 5.0),
+    'undo': (20, 5.0),
+    'redo': (20, 5.0),
+    'procesar_lote': (2, 0.1),
+    # Aperturas de streams SSE (las conexiones abiertas a la vez se acotan aparte por IP)
+    'api_eventos_asientos': (10, 0.5),
+    'estado_sala_espera': (20, 5.0),
+    # No es una ruta: turnos nuevos de la sala de espera por IP (sin multiplicar por el factor)
+    'turno_espera': (20, 1.0),
+}
+FACTOR_IP_LIMITE_TASA = float(os.environ.get('LIMITE_TASA_FACTOR_IP', 10))
+if not FACTOR_IP_LIMITE_TASA > 0:
+    raise ValueError("LIMITE_TASA_FACTOR_IP debe ser positivo")
+limitador_tasa = None
+if os.environ.get('LIMITE_TASA') != '0':
+    limitador_tasa = LimitadorTasa(
+        {**PRESUPUESTOS_POR_DEFECTO, **presupuestos_desde_texto(os.environ.get('LIMITE_TASA'))},
+        capacidad=int(os.environ.get('LIMITE_TASA_CLAVES', 100000)))
+    registro_metricas.indicador('cine_limite_tasa_rechazos', 'Solicitudes rechazadas por límite de tasa',
+                                lambda: limitador_tasa.rechazos)
+
+@app.before_request
+def _limitar_tasa():
+    if limitador_tasa is None or request.endpoint not in limitador_tasa:
+        return None
+    # Sin cookie de sesión solo cuenta la IP (un cliente que la descarta no obtiene buckets nuevos).
+    # Con sesión se verifican ambas juntas: un rechazo de la sesión no gasta el presupuesto de la IP.
+    claves = [('ip:' + (request.remote_addr or ''), FACTOR_IP_LIMITE_TASA)]
+    if 'sid' in session:
+        claves.append(('sesion:' + session['sid'], 1.0))
+    espera = limitador_tasa.permitir_todas(request.endpoint, claves)
+    if not espera:
+        return None
+    logger.debug("Límite de tasa en %s para %s", request.endpoint, request.remote_addr)
+    return _respuesta_limite_tasa(espera)
+
+def _respuesta_limite_tasa(espera: float):
+    respuesta = (jsonify(error="Demasiadas solicitudes") if request.path.startswith('/api/')
+                 else Response("Demasiadas solicitudes, intenta de nuevo en unos segundos", mimetype='text/plain'))
+    respuesta.status_code = 429
+    respuesta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return respuesta
+
+def _sesion_id():
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def _controlador():
+    """Controlador de la sesión actual."""
+    return pool_controladores.obtener(_sesion_id())
+
+# Registro de inventarios de asientos por función (sala, horario).
+# Cada inventario se crea al primer acceso y se expulsa cuando la función termina.
+SALA_POR_DEFECTO = "1"
+# Tiempo que un asiento seleccionado queda reservado para la sesión antes de liberarse
+TTL_RETENCION_SEGUNDOS = float(os.environ.get('TTL_RETENCION_SEGUNDOS', 600))
+
+# Diario de eventos opcional (DIARIO_DIR): cada cambio de estado de un pedido y cada
+# cambio de asientos se anexa como registro binario; al arrancar se reproduce desde
+# la última instantánea, que omite funciones terminadas y pedidos cerrados.
+def _funcion_terminada(funcion):
+    try:
+        fin = registro_inventarios.fin_funcion(funcion[1])
+    except ValueError:
+        return True
+    return fin is not None and fin <= datetime.now()
+
+diario = None
+if os.environ.get('DIARIO_DIR'):
+    diario = DiarioEventos(os.environ['DIARIO_DIR'],
+                           intervalo_snapshot=int(os.environ.get('DIARIO_INTERVALO_SNAPSHOT', 10000)),
+                           funcion_terminada=_funcion_terminada,
+                           numero_pedido=PedidoController.numero_pedido)
+    atexit.register(diario.cerrar)
+    maquina_pedidos.observador = diario.registrar_transicion_pedido
+
+# Eventos de asientos por función para los clientes suscritos (/api/asientos/eventos).
+# Los cambios de una ráfaga se agrupan en un mensaje por intervalo.
+difusor_asientos = DifusorAsientos(intervalo_segundos=float(os.environ.get('SSE_INTERVALO_SEGUNDOS', 0.25)),
+                                   marcos_retenidos=int(os.environ.get('SSE_MARCOS_RETENIDOS', 1000)))
+SSE_KEEPALIVE_SEGUNDOS = float(os.environ.get('SSE_KEEPALIVE_SEGUNDOS', 15))
+# Cada stream ocupa un hilo del servidor: se limita cuántos tiene abiertos a la vez cada IP
+conexiones_sse = LimiteConexiones(int(os.environ.get('SSE_MAX_CONEXIONES_IP', 20)))
+
+def _observar_inventarios(funcion, accion, asientos):
+    if diario is not None:
+        diario.registrar_asientos(funcion, accion, asientos)
+    difusor_asientos.publicar(funcion, accion, asientos)
+
+# Solo se crean inventarios para las salas configuradas (SALAS, separadas por coma)
+SALAS = [sala.strip() for sala in os.environ.get('SALAS', SALA_POR_DEFECTO).split(',') if sala.strip()]
+
+registro_inventarios = RegistroInventarios(DistribucionSala(["A", "B", "C"], 10),
+                                           fabrica_inventario=AsientosCollectionConcurrente,
+                                           observador_inventarios=_observar_inventarios,
+                                           salas=SALAS,
+                                           max_inventarios=int(os.environ.get('MAX_FUNCIONES', 10000)))
+# Filas y asientos por sala, p. ej. DISTRIBUCION_SALAS="1=ABC/10,2=ABCDEF/14" (las demás usan A-C × 10).
+# Una sala con distribución propia queda habilitada aunque no esté en SALAS.
+for sala, distribucion in distribuciones_desde_texto(os.environ.get('DISTRIBUCION_SALAS')).items():
+    registro_inventarios.configurar_sala(sala, distribucion.filas, distribucion.asientos_por_fila)
+
+def _restaurar_asientos_vendidos(vendidos):
+    """Marca como vendidos los asientos recuperados, omitiendo funciones ya terminadas"""
+    for (sala, horario), asientos in vendidos.items():
+        try:
+            fin = registro_inventarios.fin_funcion(horario)
+            if fin is None or fin > datetime.now():
+                registro_inventarios.obtener(sala, horario).confirmar_venta_asientos(list(asientos))
+        except ValueError as e:
+            logger.warning("Asientos vendidos de la función (%s, %s) no restaurados: %s", sala, horario, e)
+
+# Persistencia opcional en SQLite (DB_RUTA): al arrancar se recuperan pedidos y asientos vendidos.
+# Las ventas se confirman en disco antes de responder; las escrituras se agrupan en lotes.
+repositorio = None
+if os.environ.get('DB_RUTA'):
+    repositorio = RepositorioSQLite(os.environ['DB_RUTA'],
+                                    tamano_pool=int(os.environ.get('DB_TAMANO_POOL', 4)))
+    atexit.register(repositorio.cerrar)
+
+# Restaurar el estado al arrancar (sin volver a anexarlo al diario)
+usos_descuento = {}
+with diario.suspendido() if diario else nullcontext():
+    if repositorio is not None:
+        pedidos_guardados = repositorio.cargar_pedidos()
+        for pedido in pedidos_guardados:
+            almacen_pedidos.agregar(pedido)
+        PedidoController.reanudar_secuencia([pedido.id for pedido in pedidos_guardados])
+        _restaurar_asientos_vendidos(repositorio.cargar_asientos_vendidos())
+        usos_descuento = repositorio.cargar_usos_descuento()
+        logger.info("Persistencia SQLite en %s: %d pedidos recuperados", repositorio.ruta, len(pedidos_guardados))
+    if diario is not None:
+        # SQLite y el diario registran las mismas ventas: se toma el mayor conteo de cada regla
+        for regla, usos in diario.estado.usos_descuento.items():
+            usos_descuento[regla] = max(usos, usos_descuento.get(regla, 0))
+        _restaurar_asientos_vendidos(diario.estado.asientos_vendidos)
+        PedidoController.reanudar_secuencia(diario.estado.pedidos_conocidos() + [pedido.id for pedido in almacen_pedidos])
+        for pedido in almacen_pedidos:
+            estado = diario.estado.estados_pedidos.get(pedido.id)
+            if estado is not None and estado != pedido.estado.value:
+                pedido.estado = EstadoPedido(estado)
+                almacen_pedidos.actualizar(pedido)
+# Los topes de los cupones cuentan los usos de las ventas ya hechas
+if motor_descuentos is not None:
+    motor_descuentos.restaurar_usos(usos_descuento)
+
+def _funcion_actual():
+    """Obtiene la función (sala, horario) indicada en la petición o la función por defecto.
+    El horario se normaliza: es la clave del inventario, SQLite, el diario, los eventos
+    y la caché del mapa (400 si no es una fecha válida)."""
+    try:
+        return clave_funcion(request.values.get('sala') or SALA_POR_DEFECTO, request.values.get('horario'))
+    except ValueError as e:
+        logger.warning("Petición con horario inválido: %s", e)
+        abort(400, description="Función inválida")
+
+def _args_funcion(funcion=None):
+    """Parámetros de URL que identifican la función (vacío para la función por defecto)."""
+    sala, horario = funcion or _funcion_actual()
+    args = {}
+    if sala != SALA_POR_DEFECTO:
+        args['sala'] = sala
+    if horario:
+        args['horario'] = horario
+    return args
+
+def _url_funcion(endpoint, funcion=None, **values):
+    """url_for que conserva la función seleccionada en la redirección."""
+    values.update(_args_funcion(funcion))
+    return url_for(endpoint, **values)
+
+def _renderizar_asiento(funcion, asiento_id, estado):
+    boton_asiento = app.jinja_env.get_template('_mapa_asientos.html').module.boton_asiento
+    return str(boton_asiento(asiento_id, estado, _args_funcion(funcion)))
+
+# HTML del mapa de asientos por función, renderizado una vez por cada cambio del inventario
+cache_mapa_asientos = CacheMapaAsientos(_renderizar_asiento,
+                                        capacidad=int(os.environ.get('CACHE_MAPA_FUNCIONES', 256)))
+registro_metricas.indicador('cine_mapa_asientos_aciertos', 'Mapas de asientos servidos desde la caché',
+                            lambda: cache_mapa_asientos.aciertos)
+
+# Sala de espera opcional (SALA_ESPERA_TASA = sesiones admitidas por segundo): antes de
+# retener asientos cada sesión toma un turno y espera a que la admitan.
+sala_espera = None
+if os.environ.get('SALA_ESPERA_TASA'):
+    sala_espera = SalaEspera(app.config['SECRET_KEY'],
+                             tasa_admision=float(os.environ['SALA_ESPERA_TASA']),
+                             max_retenciones=int(os.environ.get('SALA_ESPERA_MAX_RETENCIONES', 500)),
+                             retenciones_activas=registro_inventarios.retenciones_activas)
+    registro_metricas.indicador('cine_sala_espera_en_cola', 'Turnos esperando admisión',
+                                lambda: sala_espera.en_cola)
+
+def _turno_espera():
+    """Turno de la sesión en la sala de espera (se entrega uno nuevo si no tiene o no es válido).
+    Los turnos nuevos cuentan en el presupuesto 'turno_espera' de la IP: un cliente que
+    descarta la cookie no puede alargar la cola sin límite (429 si lo supera)."""
+    turno = sala_espera.turno_de(session.get('turno_espera'), _sesion_id())
+    if turno is None:
+        if limitador_tasa is not None and 'turno_espera' in limitador_tasa:
+            espera = limitador_tasa.permitir('turno_espera', 'ip:' + (request.remote_addr or ''))
+            if espera:
+                logger.debug("Límite de turnos de la sala de espera para %s", request.remote_addr)
+                abort(_respuesta_limite_tasa(espera))
+        session['turno_espera'] = sala_espera.emitir(_sesion_id())
+        turno = sala_espera.turno_de(session['turno_espera'], _sesion_id())
+    return turno
+
+def _estado_espera():
+    """Estado de la sesión en la sala de espera o None si puede seleccionar asientos"""
+    if sala_espera is None:
+        return None
+    estado = sala_espera.estado(_turno_espera())
+    return None if estado['admitido'] else estado
+
+def _inventario_actual():
+    """Inventario de asientos de la función de la petición (400 si el horario es inválido)."""
+    try:
+        return registro_inventarios.obtener(*_funcion_actual())
+    except ValueError as e:
+        logger.warning("Petición con función inválida: %s", e)
+        abort(400, description="Función inválida")
+
+TAMANO_PAGINA_HISTORIAL = 20
 
 @app.route('/historial')
 def ver_historial():
-    """Muestra el historial de compras"""
-    historial_pedidos = getattr(controller, 'historial_pedidos', [])
+    """Muestra una página del historial de compras, opcionalmente filtrada por estado o método de pago"""
+    try:
+        estado = EstadoPedido(request.args['estado']) if request.args.get('estado') else None
+        cursor = request.args.get('cursor', type=int)
+        limite = min(max(request.args.get('limite', TAMANO_PAGINA_HISTORIAL, type=int), 1), 100)
+    except ValueError:
+        abort(400, description="Filtro de historial inválido")
+    metodo_pago = request.args.get('metodo_pago') or None
+    pedidos, siguiente_cursor = almacen_pedidos.pagina(limite, cursor, estado, metodo_pago)
     return render_template(
         'historial.html',
-        historial_pedidos=historial_pedidos,
-        EstadoPedido=EstadoPedido
+        historial_pedidos=pedidos,
+        siguiente_cursor=siguiente_cursor,
+        estado_filtro=estado,
+        metodo_pago_filtro=metodo_pago,
+        metodos_pago=almacen_pedidos.metodos_pago(),
+        total_pedidos=almacen_pedidos.contar(estado, metodo_pago),
+        EstadoPedido=EstadoPedido,
+        error=request.args.get('error'),
+        message=request.args.get('message')
     )
 
 @app.route('/finish_process')
 def finish_process():
     """Ruta para terminar el proceso y volver al inicio"""
-    if controller.pedido_actual and controller.pedido_actual.estado == EstadoPedido.COMPLETADO:
-        if not hasattr(controller, 'historial_pedidos'):
-            controller.historial_pedidos = []
-        controller.historial_pedidos.append(controller.pedido_actual)
+    controller = _controlador()
+    if controller.pago_en_curso:
+        return redirect(_url_funcion('index', active_section='confirmacion',
+                                     error="Espera a que termine el pago para terminar el proceso"))
+    controller.archivar_pedido_actual()
     
     try:
         controller.reiniciar()
     except Exception as e:
-        logger.error(f"Error al reiniciar el controlador: {e}")
+        logger.error("Error al reiniciar el controlador: %s", e)
+    # La selección quedó vacía: los asientos que la sesión aún retenía vuelven a estar disponibles
+    registro_inventarios.liberar_retenciones_de(_sesion_id())
     
-    return redirect(url_for('index'))
+    return redirect(_url_funcion('index'))
 
 @app.route('/')
 def index():
     """Renderiza la página principal siempre comenzando en selección de asientos"""
+    controller = _controlador()
     # Siempre empezamos en selección a menos que se especifique otra sección
     active_section = request.args.get('active_section', 'seleccion')
     
     estado_asientos = controller.obtener_estado_asientos()
     asientos_seleccionados_ids = estado_asientos.get("asientos", [])
     
-    # Obtener historial solo para saber si mostramos el botón
-    historial_pedidos = getattr(controller, 'historial_pedidos', [])
+    inventario = _inventario_actual()
+    retenciones = inventario.retenciones_de(_sesion_id())
     
     return render_template(
         'index.html',
-        all_seats=ALL_SEATS,
+        # Retenidos por otros, vendidos y disponibles salen de la caché; los propios se muestran como seleccionados
+        seat_map_html=Markup(cache_mapa_asientos.html(_funcion_actual(), inventario, asientos_seleccionados_ids)),
         selected_seats=asientos_seleccionados_ids,
-        sold_seats=asientos_collection.asientos_vendidos,
-        historial_pedidos=historial_pedidos,  # Solo para mostrar/ocultar botón
+        hold_seconds=int(min(retenciones.values())) if retenciones else None,
+        funcion_args=_args_funcion(),
+        historial_pedidos=almacen_pedidos,  # Solo para mostrar/ocultar botón
         active_section=active_section,
         pedido_info=controller.pedido_actual if controller.pedido_actual else None,
+        pago_en_curso=controller.pago_en_curso,
         error_message=request.args.get('error', None),
         success_message=request.args.get('message', None)  # Añadido para mensajes de éxito
     )
 
-@app.route('/select/<string:asiento_id>')
-def select_seat(asiento_id):
-    """Ruta para seleccionar un asiento."""
+def _alinear_funcion(controller):
+    """Asocia la selección a la función de la petición. Si la selección era de otra función
+    se vacía y se liberan sus retenciones. Retorna el error o None"""
+    funcion = _funcion_actual()
+    if controller.funcion_seleccion not in (None, funcion) and controller.pago_en_curso:
+        return "Espera a que termine el pago para cambiar de función"
+    if controller.cambiar_funcion(funcion):
+        registro_inventarios.liberar_retenciones_de(_sesion_id())
+    return None
+
+def _seleccionar_asiento(controller, inventario, asiento_id):
+    """Retiene el asiento para la sesión y lo agrega a su selección. Retorna el error o None"""
+    error = _alinear_funcion(controller)
+    if error is not None:
+        return error
     # Verificar si el asiento ya está vendido
-    if asientos_collection.esta_vendido(asiento_id):
-        return redirect(url_for('index', error="Este asiento ya está vendido", active_section='seleccion'))
+    if inventario.esta_vendido(asiento_id):
+        return "Este asiento ya está vendido"
     
     estado_actual = controller.obtener_estado_asientos()
     asientos_seleccionados = estado_actual.get("asientos", [])
     
     if len(asientos_seleccionados) >= 10 and asiento_id not in asientos_seleccionados:
-        return redirect(url_for('index', error="No puedes seleccionar más de 10 asientos"))
+        return "No puedes seleccionar más de 10 asientos"
     
-    asientos_collection.marcar_asiento_ocupado(asiento_id)
+    if not inventario.retener_asiento(asiento_id, _sesion_id(), TTL_RETENCION_SEGUNDOS):
+        return "Este asiento está reservado por otro cliente"
     controller.seleccionar_asiento(asiento_id)
-    return redirect(url_for('index', active_section='seleccion'))
+    return None
+
+def _deseleccionar_asiento(controller, inventario, asiento_id):
+    if _alinear_funcion(controller) is not None:
+        return
+    inventario.liberar_asiento(asiento_id, _sesion_id())  # Liberar la reserva de esta sesión
+    controller.deseleccionar_asiento(asiento_id)
+
+@app.route('/select/<string:asiento_id>')
+def select_seat(asiento_id):
+    """Ruta para seleccionar un asiento."""
+    espera = _estado_espera()
+    if espera is not None:
+        return redirect(_url_funcion('index', active_section='seleccion',
+                                     error=f"Estás en la sala de espera: posición {espera['posicion']}, "
+                                           f"unos {int(espera['espera_segundos'])} segundos"))
+    error = _seleccionar_asiento(_controlador(), _inventario_actual(), asiento_id)
+    if error is not None:
+        return redirect(_url_funcion('index', error=error, active_section='seleccion'))
+    return redirect(_url_funcion('index', active_section='seleccion'))
 
 @app.route('/deselect/<string:asiento_id>')
 def deselect_seat(asiento_id):
     """Ruta para deseleccionar un asiento."""
-    asientos_collection.desmarcar_asiento_ocupado(asiento_id)  # Desmarcar como ocupado
-    controller.deseleccionar_asiento(asiento_id)
-    return redirect(url_for('index')) # Redirige de vuelta a la página principal
+    _deseleccionar_asiento(_controlador(), _inventario_actual(), asiento_id)
+    return redirect(_url_funcion('index')) # Redirige de vuelta a la página principal
+
+# --- API JSON del mapa de asientos ---
+# Las respuestas llevan la versión del inventario y un ETag (versión + selección de la
+# sesión): un cliente que consulta con If-None-Match recibe 304 sin cuerpo si nada cambió.
+
+def _etag_asientos(version, seleccion):
+    return f"v{version}-s{zlib.crc32(','.join(seleccion).encode()):08x}"
+
+def _respuesta_asientos(controller, inventario, status=200, error=None):
+    seleccion = controller.obtener_estado_asientos().get("asientos", [])
+    version = inventario.version  # Se lee antes que los asientos (ver AsientosCollection.version)
+    etag = _etag_asientos(version, seleccion)
+    if status == 200 and request.method == 'GET' and request.if_none_match.contains(etag):
+        respuesta = Response(status=304)
+    else:
+        retenciones = inventario.retenciones_de(_sesion_id())
+        seleccionados = set(seleccion)
+        sala, horario = _funcion_actual()
+        datos = dict(
+            sala=sala,
+            horario=horario,
+            version=version,
+            filas=inventario.filas,
+            asientos_por_fila=inventario.asientos_por_fila,
+            vendidos=inventario.asientos_vendidos,
+            # Retenidos por otros clientes (los propios se muestran como seleccionados)
+            retenidos=[asiento for asiento in inventario.asientos_ocupados if asiento not in seleccionados],
+            seleccionados=seleccion,
+            retencion_segundos=int(min(retenciones.values())) if retenciones else None,
+        )
+        if error is not None:
+            datos['error'] = error
+        respuesta = jsonify(datos)
+        respuesta.status_code = status
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache'  # Revalidar siempre con If-None-Match
+    return respuesta
+
+@app.route('/api/asientos')
+def api_asientos():
+    """Mapa de asientos de la función y selección de la sesión (304 si no cambió)"""
+    return _respuesta_asientos(_controlador(), _inventario_actual())
+
+@app.route('/api/asientos/<string:asiento_id>', methods=['POST', 'DELETE'])
+def api_seleccion_asiento(asiento_id):
+    """Selecciona (POST) o deselecciona (DELETE) un asiento y responde el nuevo estado"""
+    controller = _controlador()
+    inventario = _inventario_actual()
+    if request.method == 'DELETE':
+        _deseleccionar_asiento(controller, inventario, asiento_id)
+        return _respuesta_asientos(controller, inventario)
+    espera = _estado_espera()
+    if espera is not None:
+        respuesta = jsonify(espera)
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = str(max(1, int(espera['espera_segundos'])))
+        return respuesta
+    error = _seleccionar_asiento(controller, inventario, asiento_id)
+    return _respuesta_asientos(controller, inventario, status=409 if error else 200, error=error)
+
+@app.route('/api/asientos/eventos')
+def api_eventos_asientos():
+    """Cambios de asientos de la función como Server-Sent Events.
+
+    El primer mensaje es el estado completo (o, con Last-Event-ID, los cambios
+    desde ese mensaje) y luego llegan mensajes 'asientos' con {estado: [asientos]}.
+    Los retenidos incluyen los de la propia sesión; su selección la da /api/asientos.
+    """
+    funcion = _funcion_actual()
+    inventario = _inventario_actual()
+    # "<época>-<número>": un id de otra época del canal recibe el estado completo
+    ultimo_id = request.headers.get('Last-Event-ID', request.args.get('ultimo_id')) or None
+
+    def estado_actual():
+        return dict(version=inventario.version, vendidos=inventario.asientos_vendidos,
+                    retenidos=inventario.asientos_ocupados)
+
+    clave_ip = 'ip:' + (request.remote_addr or '')
+    if not conexiones_sse.adquirir(clave_ip):
+        logger.debug("Tope de streams SSE para %s", request.remote_addr)
+        return _respuesta_limite_tasa(SSE_KEEPALIVE_SEGUNDOS)
+    eventos = difusor_asientos.escuchar(funcion, ultimo_id, estado_actual,
+                                        keepalive_segundos=SSE_KEEPALIVE_SEGUNDOS,
+                                        revisar=inventario.liberar_retenciones_expiradas)
+    respuesta = Response(eventos, mimetype='text/event-stream',
+                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Se libera al cerrar la respuesta, aunque el cliente se vaya antes del primer mensaje
+    respuesta.call_on_close(lambda: conexiones_sse.liberar(clave_ip))
+    return respuesta
+
+@app.route('/sala_espera')
+def estado_sala_espera():
+    """Posición de la sesión en la sala de espera (toma un turno si no tiene)"""
+    if sala_espera is None:
+        return jsonify(admitido=True, posicion=0)
+    respuesta = jsonify(sala_espera.estado(_turno_espera()))
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+def _sincronizar_retenciones(controller, inventario, seleccion_anterior):
+    """Ajusta las retenciones a la selección después de deshacer/rehacer: libera los asientos
+    que salieron y retiene los que volvieron. Los que ya no se pueden retener (vendidos o
+    tomados por otro cliente) se quitan de la selección. Retorna el mensaje de error o None"""
+    sesion_id = _sesion_id()
+    seleccion = list(controller.obtener_estado_asientos().get("asientos", []))
+    for asiento_id in set(seleccion_anterior).difference(seleccion):
+        inventario.liberar_asiento(asiento_id, sesion_id)
+    anteriores = set(seleccion_anterior)
+    perdidos = [asiento_id for asiento_id in seleccion if asiento_id not in anteriores
+                and not inventario.retener_asiento(asiento_id, sesion_id, TTL_RETENCION_SEGUNDOS)]
+    for asiento_id in perdidos:
+        controller.deseleccionar_asiento(asiento_id)
+    if perdidos:
+        return f"Los asientos {', '.join(perdidos)} ya no están disponibles"
+    return None
+
+def _cambiar_historial(accion):
+    controller = _controlador()
+    inventario = _inventario_actual()
+    error = _alinear_funcion(controller)
+    if error is not None:
+        return redirect(_url_funcion('index', error=error))
+    seleccion_anterior = list(controller.obtener_estado_asientos().get("asientos", []))
+    accion(controller)
+    error = _sincronizar_retenciones(controller, inventario, seleccion_anterior)
+    if error is not None:
+        return redirect(_url_funcion('index', error=error))
+    return redirect(_url_funcion('index'))
 
 @app.route('/undo')
 def undo():
     """Ruta para deshacer la última acción de selección/deselección."""
-    controller.deshacer()
-    return redirect(url_for('index'))
+    return _cambiar_historial(PedidoController.deshacer)
 
 @app.route('/redo')
 def redo():
     """Ruta para rehacer la última acción deshecha."""
-    controller.rehacer()
-    return redirect(url_for('index'))
+    return _cambiar_historial(PedidoController.rehacer)
 
 @app.route('/process_order', methods=['POST'])
 def process_order():
     """Ruta para iniciar el procesamiento del pedido a través de la cadena."""
+    controller = _controlador()
     metodo_pago = request.form.get('metodo_pago', 'efectivo')
     cupon = request.form.get('cupon')
     add_confiteria = request.form.get('add_confiteria') == 'yes' # Check if checkbox is checked
@@ -129,34 +621,123 @@ def process_order():
         logger.info("Añadiendo items de confitería de ejemplo.")
 
 
-    logger.info(f"Recibida solicitud para procesar pedido con método {metodo_pago}, cupón {cupon}, confitería: {add_confiteria}")
+    logger.info("Recibida solicitud para procesar pedido con método %s, cupón %s, confitería: %s", metodo_pago, cupon, add_confiteria)
+    if controller.pago_en_curso:
+        return redirect(_url_funcion('index', active_section='confirmacion',
+                                     error="Ya hay un pago en curso para este pedido"))
 
-    # Iniciar el proceso de pedido usando el controlador (que llama a la cadena)
-    processed_pedido = controller.iniciar_proceso_pedido(
-        metodo_pago=metodo_pago,
-        items_confiteria=items_confiteria,
-        cupon=cupon
-    )
+    # La selección se retuvo en su función: no se reservan ni venden esos asientos en otra
+    seleccion = list(controller.obtener_estado_asientos().get("asientos", []))
+    if seleccion and controller.funcion_seleccion not in (None, _funcion_actual()):
+        return redirect(_url_funcion('index', controller.funcion_seleccion, active_section='seleccion',
+                                     error="Tu selección es de esta función: confírmala aquí o elige asientos en la otra"))
+
+    # Renovar las reservas de toda la selección en una sola operación atómica: si alguna
+    # expiró y otro cliente tomó el asiento (o ya se vendió), no se procesa el pedido.
+    inventario = _inventario_actual()
+    sesion_id = _sesion_id()
+    if not inventario.reservar_asientos(seleccion, sesion_id, TTL_RETENCION_SEGUNDOS):
+        no_disponibles = [asiento for asiento in seleccion
+                          if inventario.esta_vendido(asiento) or inventario.retenido_por(asiento) != sesion_id]
+        return redirect(_url_funcion('index', active_section='seleccion',
+                                     error=f"Los asientos {', '.join(no_disponibles)} ya no están disponibles"))
+
+    if pasarela_pago is not None:
+        # El pago no ocupa este hilo: la cadena espera a la pasarela en su event loop y la
+        # venta se cierra en finalizador_pedidos. La confirmación se recarga hasta que termine.
+        pedido = controller.crear_pedido(metodo_pago=metodo_pago, items_confiteria=items_confiteria,
+                                         cupon=cupon, funcion=_funcion_actual())
+        if pedido is not None:
+            futuro = pasarela_pago.programar(controller.procesar_pedido_async(pedido))
+            futuro.add_done_callback(lambda futuro: finalizador_pedidos.submit(
+                _cerrar_venta_diferida, futuro, pedido, inventario, sesion_id))
+        return redirect(_url_funcion('index', active_section='confirmacion'))
 
-    # Marcar los asientos como vendidos después de procesar el pedido exitosamente
-    if processed_pedido and processed_pedido.estado == EstadoPedido.COMPLETADO:
-        estado_actual = controller.obtener_estado_asientos()
-        asientos_seleccionados = estado_actual.get("asientos", [])
-        asientos_collection.confirmar_venta_asientos(asientos_seleccionados)
+    # Iniciar el proceso de pedido usando el controlador (que llama a la cadena)
+    try:
+        processed_pedido = controller.iniciar_proceso_pedido(
+            metodo_pago=metodo_pago,
+            items_confiteria=items_confiteria,
+            cupon=cupon,
+            funcion=_funcion_actual()
+        )
+    except TransicionInvalida as e:
+        # Un manejador intentó un cambio de estado no permitido: falla el pedido, no la solicitud
+        logger.exception("Transición inválida al procesar el pedido")
+        processed_pedido = controller.pedido_actual
+        _marcar_fallido(processed_pedido, e)
+    error = _cerrar_venta(processed_pedido, inventario, sesion_id)
+    if error is not None:
+        return redirect(_url_funcion('index', active_section='seleccion', error=error))
     
     # El resultado del procesamiento ya está en controller.pedido_actual
     # Redirigimos a la página principal mostrando la sección de confirmación
-    return redirect(url_for('index', active_section='confirmacion'))
+    return redirect(_url_funcion('index', active_section='confirmacion'))
+
+def _cerrar_venta(pedido, inventario, sesion_id):
+    """Marca como vendidos los asientos de un pedido COMPLETADO y lo guarda. Retorna el error o None"""
+    # La venta solo se confirma si la sesión sigue reteniendo todos los asientos.
+    if not pedido or pedido.estado != EstadoPedido.COMPLETADO:
+        return None
+    asientos_pedido = [item.asiento_id for item in pedido.items_boletas]
+    if not inventario.confirmar_venta_retenidos(asientos_pedido, sesion_id):
+        logger.error("Pedido %s: la reserva de los asientos se perdió durante el pago; se reembolsa.", pedido.id)
+        pedido.solicitar_reembolso()
+        devolver_canjes(pedido)  # La compra no ocurrió: el cupón vuelve a estar disponible
+        return "Tu reserva expiró durante el pago. El cobro fue reembolsado."
+    if diario is not None:
+        diario.registrar_canjes(pedido.id, reglas_canjeadas(pedido))
+    if repositorio is not None:
+        # Durable antes de responder: espera a que el lote con esta venta esté en disco.
+        # Si falla, la venta ya ocurrió (asientos vendidos y cobro hecho): se registra para conciliar.
+        try:
+            repositorio.registrar_venta(pedido)
+        except Exception:
+            logger.exception("CONCILIAR: pedido %s vendido y cobrado (%s, asientos %s, total %.2f) "
+                             "pero no se pudo guardar en SQLite", pedido.id, pedido.funcion,
+                             ",".join(asientos_pedido), pedido.total_final)
+    return None
+
+def _cerrar_venta_diferida(futuro, pedido, inventario, sesion_id):
+    """Cierre de un pedido procesado en el event loop de la pasarela (ver process_order)"""
+    try:
+        futuro.result()
+    except Exception as e:
+        logger.exception("Error al procesar el pedido %s", pedido.id)
+        _marcar_fallido(pedido, e)
+    error = _cerrar_venta(pedido, inventario, sesion_id)
+    if error is not None:
+        pedido.mensaje_error = error
+
+def _marcar_fallido(pedido, error):
+    """Deja FALLIDO un pedido cuya cadena se interrumpió con una excepción (si su estado lo permite)"""
+    if pedido is None:
+        return
+    mensaje = f"Error inesperado al procesar el pedido: {error}"
+    if pedido.maquina.permite(pedido.estado, EventoPedido.FALLAR):
+        pedido.set_error(mensaje)
+    else:
+        pedido.mensaje_error = mensaje
+
+# Hilos que cierran las ventas pagadas por la pasarela HTTP (confirmar asientos y guardar)
+finalizador_pedidos = ThreadPoolExecutor(max_workers=int(os.environ.get('HILOS_CIERRE_PEDIDOS', 4)),
+                                         thread_name_prefix="cierre-pedidos")
 
 @app.route('/cancel_order', methods=['POST'])
 def cancel_order():
     """Ruta para cancelar el pedido actual."""
-    controller.cancelar_pedido()
-    return redirect(url_for('index'))
+    controller = _controlador()
+    if not controller.cancelar_pedido() and controller.pedido_actual:
+        return redirect(_url_funcion('index', error="El pedido ya no se puede cancelar en su estado actual"))
+    # La compra se abandona: se vacía la selección y se liberan todas las retenciones de la sesión
+    controller.limpiar_seleccion()
+    registro_inventarios.liberar_retenciones_de(_sesion_id())
+    return redirect(_url_funcion('index'))
 
 @app.route('/refund_order', methods=['POST'])
 def refund_order():
     """Ruta para solicitar reembolso para el pedido actual o desde historial"""
+    controller = _controlador()
     try:
         pedido_id = request.form.get('pedido_id')  # Obtener ID del pedido si viene del historial
         
@@ -164,38 +745,109 @@ def refund_order():
             # Si el reembolso fue exitoso, liberar los asientos
             if controller.pedido_actual.items_boletas:  # Verificar si hay asientos para liberar
                 asientos_a_liberar = [item.asiento_id for item in controller.pedido_actual.items_boletas]
-                asientos_collection.desmarcar_asientos_vendidos(asientos_a_liberar)
+                # Liberar en la función del pedido (si ya terminó, su inventario fue expulsado)
+                inventario = registro_inventarios.buscar(*(controller.pedido_actual.funcion or _funcion_actual()))
+                if inventario is not None:
+                    inventario.desmarcar_asientos_vendidos(asientos_a_liberar)
+            if repositorio is not None:
+                repositorio.registrar_reembolso(controller.pedido_actual)
             
             if pedido_id:
                 return redirect(url_for('ver_historial', message="Reembolso procesado exitosamente"))
-            return redirect(url_for('index', message="Reembolso procesado exitosamente"))
+            return redirect(_url_funcion('index', message="Reembolso procesado exitosamente"))
         else:
+            if repositorio is not None and controller.pedido_actual and controller.pedido_actual.id in almacen_pedidos:
+                repositorio.actualizar_estado(controller.pedido_actual)
             error_msg = (controller.pedido_actual.mensaje_error 
                         if controller.pedido_actual 
                         else "No se pudo procesar el reembolso")
             if pedido_id:
                 return redirect(url_for('ver_historial', error=error_msg))
-            return redirect(url_for('index', error=error_msg))
+            return redirect(_url_funcion('index', error=error_msg))
     except Exception as e:
-        logger.error(f"Error al procesar reembolso: {str(e)}")
+        logger.error("Error al procesar reembolso: %s", str(e))
         if pedido_id:
             return redirect(url_for('ver_historial', error="Error inesperado al procesar el reembolso"))
-        return redirect(url_for('index', error="Error inesperado al procesar el reembolso"))
+        return redirect(_url_funcion('index', error="Error inesperado al procesar el reembolso"))
 
 @app.route('/next_section/<string:section>')
 def next_section(section):
     """Ruta para cambiar entre secciones"""
+    controller = _controlador()
     estado_actual = controller.obtener_estado_asientos()
     asientos_seleccionados = estado_actual.get("asientos", [])
     
     if section == 'pago' and not asientos_seleccionados:
-        return redirect(url_for('index', error="Debes seleccionar al menos un asiento", active_section='seleccion'))
+        return redirect(_url_funcion('index', error="Debes seleccionar al menos un asiento", active_section='seleccion'))
     
     # Validar que no se pueda ir a confirmación directamente
     if section == 'confirmacion':
-        return redirect(url_for('index', active_section='pago'))
+        return redirect(_url_funcion('index', active_section='pago'))
     
-    return redirect(url_for('index', active_section=section))
+    return redirect(_url_funcion('index', active_section=section))
+
+# Pedidos en lote (reservas grupales/corporativas): CSV con referencia, asientos, metodo_pago, cupon.
+# No pasa por la sala de espera: sus reservas se confirman o liberan dentro de la misma
+# solicitud, acotadas por MAX_PEDIDOS_LOTE x MAX_ASIENTOS_PEDIDO_LOTE, y la ruta tiene
+# su propio presupuesto en el límite de tasa ('procesar_lote'). Es una ruta de administración:
+# exige la cabecera 'Authorization: Bearer <LOTES_TOKEN>' y sin LOTES_TOKEN queda deshabilitada.
+LOTES_TOKEN = os.environ.get('LOTES_TOKEN')
+MAX_PEDIDOS_LOTE = int(os.environ.get('MAX_PEDIDOS_LOTE', 500))
+MAX_ASIENTOS_PEDIDO_LOTE = int(os.environ.get('MAX_ASIENTOS_PEDIDO_LOTE', 20))
+
+@app.route('/lotes', methods=['POST'])
+def procesar_lote():
+    """Procesa un lote de pedidos en CSV (cuerpo o archivo 'archivo') y responde el resultado de cada uno"""
+    if not LOTES_TOKEN:
+        return jsonify(error="El procesamiento de lotes está deshabilitado"), 403
+    autorizacion = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(autorizacion.encode(), f"Bearer {LOTES_TOKEN}".encode()):
+        return jsonify(error="No autorizado"), 401
+    archivo = request.files.get('archivo')
+    texto = archivo.read().decode('utf-8-sig') if archivo else request.get_data(as_text=True)
+    try:
+        especificaciones = leer_csv_lote(texto)
+    except (ValueError, csv.Error) as e:
+        return jsonify(error=str(e)), 400
+    if not especificaciones:
+        return jsonify(error="El lote está vacío"), 400
+    if len(especificaciones) > MAX_PEDIDOS_LOTE:
+        return jsonify(error=f"El lote supera el máximo de {MAX_PEDIDOS_LOTE} pedidos"), 413
+
+    funcion = _funcion_actual()
+    procesador = ProcesadorLotes(registro_cadenas.obtener_plano(),
+                                 max_pagos_concurrentes=int(os.environ.get('LOTE_PAGOS_CONCURRENTES', 16)),
+                                 ttl_reserva_segundos=TTL_RETENCION_SEGUNDOS,
+                                 max_asientos_pedido=MAX_ASIENTOS_PEDIDO_LOTE,
+                                 pasarela_pago=pasarela_pago)
+    resultados = procesador.procesar(especificaciones, _inventario_actual(), funcion)
+
+    completados = [resultado.pedido for resultado in resultados if resultado.exitoso]
+    for pedido in completados:
+        almacen_pedidos.agregar(pedido)
+        if diario is not None:
+            diario.registrar_canjes(pedido.id, reglas_canjeadas(pedido))
+    if repositorio is not None:
+        # El escritor confirma en orden: esperar la última venta garantiza las anteriores
+        for posicion, pedido in enumerate(completados, start=1):
+            repositorio.registrar_venta(pedido, esperar=posicion == len(completados))
+
+    return jsonify(
+        total=len(resultados),
+        completados=len(completados),
+        fallidos=len(resultados) - len(completados),
+        resultados=[resultado.a_dict() for resultado in resultados],
+    )
+
+@app.route('/sesiones/estadisticas')
+def estadisticas_sesiones():
+    """Tamaño y tasa de aciertos del pool de controladores por sesión"""
+    return jsonify(pool_controladores.estadisticas())
+
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(registro_metricas.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+# controller/cadenas.py
+
+import logging
+import threading
+from typing import Callable, Dict
+
+from models.chain import (
+    EjecutorCadenaPlano,
+    ManejadorPedido,
+    ManejadorValidacionStock,
+    ManejadorCalculoPreciosYImpuestos,
+    ManejadorAplicacionDescuentos,
+    ManejadorProcesamientoPago,
+    ManejadorGeneracionEntradas,
+    ManejadorActualizacionInventario,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Registro de Cadenas Compiladas ---
+# Los manejadores no guardan estado del pedido (solo el enlace al siguiente), así que
+# una misma cadena puede compartirse entre todos los controladores e hilos.
+# Cada configuración se construye y enlaza una sola vez, en el primer uso.
+
+def construir_cadena_por_defecto(pasarela_pago=None, motor_precios=None, motor_descuentos=None) -> ManejadorPedido:
+    """Construye y enlaza la cadena estándar de procesamiento de pedidos."""
+    primer_manejador = ManejadorValidacionStock()
+    primer_manejador.establecer_siguiente(ManejadorCalculoPreciosYImpuestos(motor_precios))\
+                    .establecer_siguiente(ManejadorAplicacionDescuentos(motor_descuentos, motor_precios))\
+                    .establecer_siguiente(ManejadorProcesamientoPago(pasarela_pago))\
+                    .establecer_siguiente(ManejadorGeneracionEntradas())\
+                    .establecer_siguiente(ManejadorActualizacionInventario())
+    return primer_manejador
+
+
+class RegistroCadenas:
+    """Registro de configuraciones de cadena. Compila cada una una sola vez y la comparte."""
+
+    def __init__(self):
+        self._fabricas: Dict[str, Callable[[], ManejadorPedido]] = {"por_defecto": construir_cadena_por_defecto}
+        self._cadenas: Dict[str, ManejadorPedido] = {}
+        self._ejecutores_planos: Dict[str, EjecutorCadenaPlano] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nombre: str, fabrica: Callable[[], ManejadorPedido]):
+        """Registra (o reemplaza) una configuración. Se compilará en el próximo obtener()."""
+        with self._lock:
+            self._fabricas[nombre] = fabrica
+            self._cadenas.pop(nombre, None)
+            self._ejecutores_planos.pop(nombre, None)
+
+    def obtener(self, nombre: str = "por_defecto") -> ManejadorPedido:
+        """Retorna el primer manejador de la cadena compilada para la configuración."""
+        cadena = self._cadenas.get(nombre)
+        if cadena is None:
+            with self._lock:
+                cadena = self._cadenas.get(nombre)
+                if cadena is None:
+                    if nombre not in self._fabricas:
+                        raise KeyError(f"No hay una cadena registrada con el nombre '{nombre}'")
+                    cadena = self._fabricas[nombre]()
+                    self._cadenas[nombre] = cadena
+                    logger.info("Cadena '%s' compilada.", nombre)
+        return cadena
+
+    def obtener_plano(self, nombre: str = "por_defecto") -> EjecutorCadenaPlano:
+        """Retorna la misma cadena aplanada en un pipeline iterativo (modo 'plano')."""
+        ejecutor = self._ejecutores_planos.get(nombre)
+        if ejecutor is None:
+            cadena = self.obtener(nombre)
+            with self._lock:
+                ejecutor = self._ejecutores_planos.get(nombre)
+                if ejecutor is None:
+                    ejecutor = EjecutorCadenaPlano(cadena)
+                    self._ejecutores_planos[nombre] = ejecutor
+        return ejecutor
+
+    def obtener_por_modo(self, modo: str = "recursivo", nombre: str = "por_defecto"):
+        """Retorna la cadena en modo 'recursivo' (manejadores enlazados) o 'plano'."""
+        if modo == "plano":
+            return self.obtener_plano(nombre)
+        if modo == "recursivo":
+            return self.obtener(nombre)
+        raise ValueError(f"Modo de cadena desconocido: '{modo}'")
+
+
+# Registro compartido por todo el proceso
+registro_cadenas = RegistroCadenas()
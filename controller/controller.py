@@ -1,34 +1,49 @@
 # controller/controller.py
 
 # Importamos las clases Memento (existentes)
-from models.memento import SeleccionAsientos, GestorHistorialSeleccion
+from models.memento import SeleccionAsientos, GestorHistorialSeleccion, GestorHistorialDeltas
+
+# Historial de pedidos indexado
+from models.almacen_pedidos import AlmacenPedidos
+
+# Registro de cadenas compiladas (compartidas entre controladores)
+from controller.cadenas import registro_cadenas
 
 # Importamos las clases Chain of Responsibility (y las nuevas clases Item)
 from models.chain import (
     Pedido as ChainPedido, # Renombramos para evitar conflicto si había otro Pedido
     EstadoPedido,
-    ManejadorValidacionStock,
-    ManejadorCalculoPreciosYImpuestos,
-    ManejadorAplicacionDescuentos,
-    ManejadorProcesamientoPago,
-    ManejadorGeneracionEntradas,
-    ManejadorActualizacionInventario,
+    ManejadorPedido,
+    BaseManejadorPedido,
+    EjecutorCadenaPlano,
     ItemBoleta,      # Importamos las nuevas clases Item
     ItemConfiteria
 )
 
+from models.state import ESTADOS_EN_CURSO
+
+import itertools
 import logging
-from typing import List # Importar List si no está
+import time
+from typing import Callable, List # Importar List si no está
 
 logger = logging.getLogger(__name__)
 
 class PedidoController:
-    def __init__(self):
+    # Contador de IDs compartido: con un controlador por sesión los IDs no deben repetirse
+    _secuencia_pedidos = itertools.count(1)
+
+    def __init__(self, cadena: ManejadorPedido | EjecutorCadenaPlano = None,
+                 fabrica_historial: Callable[[], GestorHistorialSeleccion | GestorHistorialDeltas] = GestorHistorialSeleccion,
+                 almacen_pedidos: AlmacenPedidos = None):
         # --- Memento Pattern (Existente) ---
+        self._fabrica_historial = fabrica_historial
         self.seleccionador = SeleccionAsientos()
-        self.historial = GestorHistorialSeleccion()
+        self.historial = fabrica_historial()
         # Guardamos el primer estado vacío
         self.historial.guardar(self.seleccionador.crear_memento())
+        # Función (sala, horario) a la que pertenece la selección (ver cambiar_funcion)
+        self.funcion_seleccion: tuple = None
 
         # --- Chain of Responsibility Pattern ---
         # Atributo para guardar el pedido de la cadena de responsabilidad
@@ -37,35 +52,45 @@ class PedidoController:
         # >> Contador simple para IDs de pedidos - Solución al AttributeError <<
         self.pedido_counter = 0 # Inicializamos el contador para generar IDs secuenciales
 
-        # Construir la cadena de manejadores
-        self.primer_manejador = ManejadorValidacionStock()
-        manejador_precios = ManejadorCalculoPreciosYImpuestos()
-        manejador_descuentos = ManejadorAplicacionDescuentos()
-        manejador_pago = ManejadorProcesamientoPago()
-        manejador_entradas = ManejadorGeneracionEntradas()
-        manejador_inventario = ManejadorActualizacionInventario()
-
-        # Enlazar los manejadores en el orden deseado
-        self.primer_manejador.establecer_siguiente(manejador_precios)\
-                             .establecer_siguiente(manejador_descuentos)\
-                             .establecer_siguiente(manejador_pago)\
-                             .establecer_siguiente(manejador_entradas)\
-                             .establecer_siguiente(manejador_inventario) # El último manejador
+        # Historial de pedidos completados (puede compartirse entre controladores)
+        self.almacen_pedidos = almacen_pedidos if almacen_pedidos is not None else AlmacenPedidos()
 
+        # La cadena de manejadores se compila una sola vez y se comparte entre controladores
+        self.primer_manejador = cadena or registro_cadenas.obtener()
 
         logger.info("PedidoController inicializado con Chain of Responsibility.")
 
+    @classmethod
+    def reanudar_secuencia(cls, pedidos_ids):
+        """Continúa la numeración de IDs después de pedidos ya existentes (p. ej. cargados de disco)"""
+        numeros = [numero for numero in map(cls.numero_pedido, pedidos_ids) if numero is not None]
+        cls._secuencia_pedidos = itertools.count(max(numeros, default=0) + 1)
+
+    @classmethod
+    def siguiente_id(cls, asientos_ids):
+        """Nuevo ID de pedido "PED-<n>-<hash de los asientos>" con la secuencia compartida"""
+        numero = next(cls._secuencia_pedidos)
+        return f"PED-{numero}-{abs(hash(''.join(asientos_ids or '')) % 1000)}"
+
+    @staticmethod
+    def numero_pedido(pedido_id):
+        """Número de secuencia de un ID "PED-<n>-..." o None si no tiene ese formato"""
+        partes = pedido_id.split("-")
+        if len(partes) > 1 and partes[0] == "PED" and partes[1].isdigit():
+            return int(partes[1])
+        return None
+
 
     # --- Métodos de Selección y Deshacer/Rehacer (Memento Pattern - Existente) ---
     def seleccionar_asiento(self, asiento_id):
         self.seleccionador.seleccionar_asiento(asiento_id)
         self.historial.guardar(self.seleccionador.crear_memento())
-        logger.info(f"Asiento {asiento_id} seleccionado.")
+        logger.info("Asiento %s seleccionado.", asiento_id)
 
     def deseleccionar_asiento(self, asiento_id):
         self.seleccionador.deseleccionar_asiento(asiento_id)
         self.historial.guardar(self.seleccionador.crear_memento())
-        logger.info(f"Asiento {asiento_id} deseleccionado.")
+        logger.info("Asiento %s deseleccionado.", asiento_id)
 
     def deshacer(self):
         memento = self.historial.deshacer()
@@ -84,12 +109,46 @@ class PedidoController:
         else:
             logger.warning("No hay más acciones para rehacer.")
 
+    def cambiar_funcion(self, funcion: tuple) -> List[str]:
+        """Asocia la selección a la función (sala, horario). Si era de otra función, la vacía
+        (con su historial) y retorna los asientos que tenía para que se liberen sus retenciones"""
+        if self.funcion_seleccion is None or self.funcion_seleccion == funcion:
+            self.funcion_seleccion = funcion
+            return []
+        asientos = list(self.obtener_estado_asientos().get("asientos", []))
+        logger.info("Cambio de función %s -> %s: se descarta la selección %s.", self.funcion_seleccion, funcion, asientos)
+        self.limpiar_seleccion()
+        self.funcion_seleccion = funcion
+        return asientos
+
     # --- Método para iniciar el Proceso with Chain of Responsibility ---
-    def iniciar_proceso_pedido(self, metodo_pago="efectivo", items_confiteria: List[ItemConfiteria] = None, cupon: str = None):
+    def iniciar_proceso_pedido(self, metodo_pago="efectivo", items_confiteria: List[ItemConfiteria] = None, cupon: str = None, funcion: tuple = None):
         """
         Recopila la selección actual, crea un objeto Pedido (de chain.py)
         y lo pasa al inicio de la cadena de responsabilidad para su procesamiento.
         """
+        if self.crear_pedido(metodo_pago, items_confiteria, cupon, funcion) is None:
+            return None # No se crea el pedido si está vacío
+
+        # Iniciar el procesamiento pasando el pedido al primer manejador de la cadena
+        logger.info("Iniciando cadena de procesamiento para pedido %s...", self.pedido_actual.id)
+        inicio = time.perf_counter()
+        self.primer_manejador.procesar_pedido(self.pedido_actual)
+        return self._registrar_resultado(self.pedido_actual, inicio)
+
+    async def procesar_pedido_async(self, pedido: ChainPedido) -> ChainPedido:
+        """Procesa un pedido ya creado (crear_pedido) sin bloquear mientras se espera la
+        pasarela de pago. Debe ejecutarse en el event loop de la pasarela (PasarelaPago.programar)."""
+        ejecutor = self.primer_manejador
+        if not isinstance(ejecutor, EjecutorCadenaPlano):
+            ejecutor = EjecutorCadenaPlano(ejecutor)
+        logger.info("Iniciando cadena de procesamiento asíncrona para pedido %s...", pedido.id)
+        inicio = time.perf_counter()
+        await ejecutor.procesar_pedido_async(pedido)
+        return self._registrar_resultado(pedido, inicio)
+
+    def crear_pedido(self, metodo_pago="efectivo", items_confiteria: List[ItemConfiteria] = None, cupon: str = None, funcion: tuple = None):
+        """Crea el pedido actual con la selección (sin procesarlo). Retorna None si está vacío."""
         estado_seleccion = self.seleccionador.obtener_estado_actual()
         asientos_seleccionados_ids = estado_seleccion.get("asientos", [])
 
@@ -97,37 +156,49 @@ class PedidoController:
         if not asientos_seleccionados_ids and (items_confiteria is None or len(items_confiteria) == 0):
             logger.warning("No hay asientos seleccionados ni items de confitería. No se crea el pedido.")
             self.pedido_actual = None
-            return None # No se crea el pedido si está vacío
+            return None
+
+        # Los asientos se retuvieron en la función de la selección: no se venden en otra
+        if asientos_seleccionados_ids and self.funcion_seleccion is not None and funcion != self.funcion_seleccion:
+            raise ValueError(f"La selección es de la función {self.funcion_seleccion}, no de {funcion}")
 
         # Convertir IDs de asientos a objetos ItemBoleta
         items_boletas = [ItemBoleta(asiento_id=asiento_id) for asiento_id in asientos_seleccionados_ids]
 
-        # >> Incrementar el contador de pedidos para el nuevo ID <<
-        self.pedido_counter += 1
+        # >> Tomar el siguiente ID de la secuencia compartida <<
+        pedido_id = PedidoController.siguiente_id(asientos_seleccionados_ids)
+        self.pedido_counter = PedidoController.numero_pedido(pedido_id)
 
         # Crear la instancia del Pedido usando la clase de models.chain
         # Proporcionamos una lista vacía para items_confiteria si no se pasa nada
-        # Usamos el contador para generar un ID único
         self.pedido_actual = ChainPedido(
-            # id=f"PED-{len(self.historial._historial) + 1}-{abs(hash(''.join(asientos_seleccionados_ids)) % 1000)}", # Línea anterior con error
-            id=f"PED-{self.pedido_counter}-{abs(hash(''.join(asientos_seleccionados_ids or '')) % 1000)}", # >> LÍNEA CORREGIDA <<
+            id=pedido_id,
             items_boletas=items_boletas,
             items_confiteria=items_confiteria if items_confiteria is not None else [],
             metodo_pago=metodo_pago,
-            cupon_aplicado=cupon
+            cupon_aplicado=cupon,
+            funcion=funcion
         )
 
-        logger.info(f"Pedido Chain creado: {self.pedido_actual}")
+        logger.info("Pedido Chain creado: %s", self.pedido_actual)
+        return self.pedido_actual
 
-        # Iniciar el procesamiento pasando el pedido al primer manejador de la cadena
-        logger.info(f"Iniciando cadena de procesamiento para pedido {self.pedido_actual.id}...")
-        self.primer_manejador.procesar_pedido(self.pedido_actual)
-        logger.info(f"Cadena de procesamiento finalizada para pedido {self.pedido_actual.id}.")
+    @property
+    def pago_en_curso(self) -> bool:
+        """True si el pedido actual todavía está recorriendo la cadena (p. ej. esperando a la pasarela)"""
+        return self.pedido_actual is not None and self.pedido_actual.estado in ESTADOS_EN_CURSO
+
+    @staticmethod
+    def _registrar_resultado(pedido: ChainPedido, inicio: float) -> ChainPedido:
+        instrumentacion = BaseManejadorPedido.instrumentacion
+        if instrumentacion is not None:
+            instrumentacion.registrar_pedido(pedido, time.perf_counter() - inicio)
+        logger.info("Cadena de procesamiento finalizada para pedido %s.", pedido.id)
 
         # --- Reaccionar al resultado del procesamiento de la cadena ---
         # El controlador verifica el estado final del pedido después de que la cadena ha terminado
-        if self.pedido_actual.estado == EstadoPedido.COMPLETADO:
-            logger.info(f"Pedido {self.pedido_actual.id} procesado exitosamente (COMPLETADO).")
+        if pedido.estado == EstadoPedido.COMPLETADO:
+            logger.info("Pedido %s procesado exitosamente (COMPLETADO).", pedido.id)
             # Opcional: Aquí podrías agregar lógica para limpiar la selección actual
             # en self.seleccionador si quieres que una vez completado el pedido,
             # la UI de selección se reinicie para una nueva compra.
@@ -135,46 +206,51 @@ class PedidoController:
             #          self.historial.guardar(self.seleccionador.crear_memento()) # Guardar estado vacío después de limpiar
             # Esto depende del flujo de usuario deseado.
 
-        elif self.pedido_actual.estado == EstadoPedido.FALLIDO:
-            logger.error(f"Pedido {self.pedido_actual.id} falló durante el procesamiento. Razón: {self.pedido_actual.mensaje_error}")
+        elif pedido.estado == EstadoPedido.FALLIDO:
+            logger.error("Pedido %s falló durante el procesamiento. Razón: %s", pedido.id, pedido.mensaje_error)
             # El controlador puede informar al usuario del fallo y el motivo (ya se hace en la UI).
             # La selección en el Seleccionador (Memento) permanece para que el usuario pueda corregir.
 
         else:
-             logger.warning(f"Pedido {self.pedido_actual.id} terminó con estado inesperado: {self.pedido_actual.estado.value}")
+             logger.warning("Pedido %s terminó con estado inesperado: %s", pedido.id, pedido.estado.value)
 
 
-        return self.pedido_actual # Retornar el objeto Pedido con su estado final (con el resultado del proceso)
+        return pedido # Retornar el objeto Pedido con su estado final (con el resultado del proceso)
 
     # --- Métodos para Cancelar/Reembolsar (ahora interactúan con el objeto ChainPedido) ---
     # Nota: Estos métodos no usan la cadena principal, actúan directamente sobre el estado del Pedido
     # podrías implementar cadenas separadas para cancelar/reembolsar si la lógica fuera compleja.
 
-    def cancelar_pedido(self):
-        """Cancela el pedido actual si es posible."""
+    def cancelar_pedido(self) -> bool:
+        """Cancela el pedido actual si su estado lo permite. Retorna True si se canceló."""
         if self.pedido_actual:
             # Llama al método cancelar que añadimos a la clase ChainPedido
-            self.pedido_actual.cancelar()
-            logger.info(f"Solicitud de cancelación para pedido {self.pedido_actual.id} procesada.")
-        else:
-            logger.warning("No hay pedido actual para cancelar.")
+            cancelado = self.pedido_actual.cancelar()
+            logger.info("Solicitud de cancelación para pedido %s procesada.", self.pedido_actual.id)
+            return cancelado
+        logger.warning("No hay pedido actual para cancelar.")
+        return False
 
 
     def cargar_pedido_desde_historial(self, pedido_id):
         """Carga un pedido desde el historial para procesarlo"""
-        if hasattr(self, 'historial_pedidos'):
-            for pedido in self.historial_pedidos:
-                if pedido.id == pedido_id:
-                    self.pedido_actual = pedido
-                    return True
-        return False
+        pedido = self.almacen_pedidos.obtener(pedido_id)
+        if pedido is None:
+            return False
+        self.pedido_actual = pedido
+        return True
+
+    def archivar_pedido_actual(self):
+        """Agrega el pedido actual al historial si quedó COMPLETADO"""
+        if self.pedido_actual and self.pedido_actual.estado == EstadoPedido.COMPLETADO:
+            self.almacen_pedidos.agregar(self.pedido_actual)
 
     def solicitar_reembolso(self, pedido_id=None):
         """Solicita reembolso para un pedido específico o el actual"""
         if pedido_id and self.pedido_actual is None:
             # Si se proporciona un ID y no hay pedido actual, intentar cargar desde historial
             if not self.cargar_pedido_desde_historial(pedido_id):
-                logger.warning(f"No se encontró el pedido {pedido_id} en el historial")
+                logger.warning("No se encontró el pedido %s en el historial", pedido_id)
                 return False
 
         if not self.pedido_actual:
@@ -182,17 +258,18 @@ class PedidoController:
             return False
 
         if self.pedido_actual.estado != EstadoPedido.COMPLETADO:
-            logger.warning(f"El pedido {self.pedido_actual.id} no está en estado COMPLETADO")
+            logger.warning("El pedido %s no está en estado COMPLETADO", self.pedido_actual.id)
             return False
 
         # Procesar el reembolso
         resultado = self.pedido_actual.solicitar_reembolso()
+        self.almacen_pedidos.actualizar(self.pedido_actual)  # El estado cambió: reindexar
         
         if resultado:
-            logger.info(f"Reembolso procesado exitosamente para pedido {self.pedido_actual.id}")
+            logger.info("Reembolso procesado exitosamente para pedido %s", self.pedido_actual.id)
             return True
         else:
-            logger.error(f"Error en el reembolso del pedido {self.pedido_actual.id}: {self.pedido_actual.mensaje_error}")
+            logger.error("Error en el reembolso del pedido %s: %s", self.pedido_actual.id, self.pedido_actual.mensaje_error)
             return False
 
     # --- Métodos que ya no son llamados directamente para el flujo principal ---
@@ -225,9 +302,15 @@ class PedidoController:
         """Devuelve el estado actual de la selección de asientos desde el Memento."""
         return self.seleccionador.obtener_estado_actual()
 
+    def limpiar_seleccion(self):
+        """Vacía la selección y su historial de deshacer/rehacer"""
+        self.seleccionador = SeleccionAsientos()
+        self.historial = self._fabrica_historial()
+        self.historial.guardar(self.seleccionador.crear_memento())
+        self.funcion_seleccion = None
+
     def reiniciar(self):
         """Reinicia el estado del controlador para un nuevo pedido"""
         self.pedido_actual = None
-        self.seleccionador = SeleccionAsientos()
-        self.historial = GestorHistorialSeleccion()
+        self.limpiar_seleccion()
         logger.info("Controlador reiniciado para nuevo pedido")
\ No newline at end of file
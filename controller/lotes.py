@@ -0,0 +1,272 @@
+# controller/lotes.py
+
+import asyncio
+import csv
+import io
+import logging
+import time
+import uuid
+from typing import Dict, List
+
+from controller.controller import PedidoController
+from models.chain import (
+    BaseManejadorPedido,
+    EjecutorCadenaPlano,
+    EstadoPedido,
+    ItemBoleta,
+    ItemConfiteria,
+    ManejadorProcesamientoPago,
+    Pedido,
+)
+from models.state import EventoPedido
+from models.descuentos import devolver_canjes
+from models.iterator import AsientosCollection
+
+logger = logging.getLogger(__name__)
+
+
+class EspecificacionPedido:
+    """Un pedido dentro de un lote (p. ej. una fila del CSV de una reserva grupal)"""
+
+    def __init__(self, referencia: str, asientos: List[str], metodo_pago: str,
+                 cupon: str = None, items_confiteria: List[ItemConfiteria] = None):
+        self.referencia = referencia
+        self.asientos = list(asientos)
+        self.metodo_pago = metodo_pago
+        self.cupon = cupon or None
+        self.items_confiteria = items_confiteria or []
+
+
+class ResultadoPedidoLote:
+    """Resultado de un pedido del lote: el pedido procesado o el motivo del rechazo"""
+
+    def __init__(self, referencia: str, pedido: Pedido = None, mensaje_error: str = None):
+        self.referencia = referencia
+        self.pedido = pedido
+        self.mensaje_error = mensaje_error or (pedido.mensaje_error if pedido else None)
+
+    @property
+    def exitoso(self) -> bool:
+        return self.pedido is not None and self.pedido.estado == EstadoPedido.COMPLETADO
+
+    def a_dict(self) -> dict:
+        return {
+            "referencia": self.referencia,
+            "pedido_id": self.pedido.id if self.pedido else None,
+            "estado": self.pedido.estado.value if self.pedido else EstadoPedido.FALLIDO.value,
+            "asientos": [item.asiento_id for item in self.pedido.items_boletas] if self.pedido else [],
+            "total_final": self.pedido.total_final if self.pedido else 0.0,
+            "error": None if self.exitoso else self.mensaje_error,
+        }
+
+
+def leer_csv_lote(texto: str) -> List[EspecificacionPedido]:
+    """Lee un lote en CSV con columnas referencia, asientos, metodo_pago y cupon (opcional).
+
+    Los asientos de una fila se separan con espacios o ';' (p. ej. "A1;A2;A3").
+    Lanza ValueError si falta una columna obligatoria.
+    """
+    lector = csv.DictReader(io.StringIO(texto))
+    faltantes = {"asientos", "metodo_pago"} - set(lector.fieldnames or [])
+    if faltantes:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(sorted(faltantes))}")
+    especificaciones = []
+    for numero, fila in enumerate(lector, start=1):
+        asientos = [asiento for asiento in (fila["asientos"] or "").replace(";", " ").split() if asiento]
+        especificaciones.append(EspecificacionPedido(
+            referencia=(fila.get("referencia") or "").strip() or f"fila-{numero}",
+            asientos=asientos,
+            metodo_pago=(fila["metodo_pago"] or "").strip(),
+            cupon=(fila.get("cupon") or "").strip(),
+        ))
+    return especificaciones
+
+
+class ProcesadorLotes:
+    """Procesa N pedidos juntos con la misma cadena que el flujo web.
+
+    1. Valida en una sola pasada los asientos de todo el lote (repetidos dentro del
+       lote, inexistentes o no disponibles) y reserva los de cada pedido de forma atómica.
+    2. Ejecuta las etapas previas al pago etapa por etapa sobre todos los pedidos
+       (las que ofrecen ejecutar_etapa_lote, como el cálculo de precios, en una sola llamada).
+    3. Envía los pagos concurrentemente con asyncio.gather (hasta `max_pagos_concurrentes`),
+       en el event loop de `pasarela_pago` si se indica.
+    4. Termina la cadena y confirma la venta de cada pedido pagado.
+    Cada pedido tiene su propio resultado: un fallo (o una excepción en una etapa)
+    marca solo ese pedido como FALLIDO, y las reservas se confirman o liberan siempre.
+    """
+
+    def __init__(self, ejecutor: EjecutorCadenaPlano, max_pagos_concurrentes: int = 16,
+                 ttl_reserva_segundos: float = 600.0, max_asientos_pedido: int = 20,
+                 pasarela_pago=None):
+        manejadores = ejecutor.manejadores
+        indice_pago = next((i for i, m in enumerate(manejadores) if isinstance(m, ManejadorProcesamientoPago)),
+                           len(manejadores))
+        self._antes_del_pago = manejadores[:indice_pago]
+        self._pago = manejadores[indice_pago] if indice_pago < len(manejadores) else None
+        self._despues_del_pago = manejadores[indice_pago + 1:]
+        self._maquina = ejecutor.maquina  # Transiciones según el orden de etapas de la cadena
+        self._max_pagos_concurrentes = max_pagos_concurrentes
+        self._ttl_reserva_segundos = ttl_reserva_segundos
+        self._max_asientos_pedido = max_asientos_pedido
+        self._pasarela_pago = pasarela_pago
+
+    def procesar(self, especificaciones: List[EspecificacionPedido], inventario: AsientosCollection,
+                 funcion: tuple = None) -> List[ResultadoPedidoLote]:
+        lote_id = uuid.uuid4().hex[:8]
+        resultados: List[ResultadoPedidoLote] = [None] * len(especificaciones)
+        sesiones: Dict[int, str] = {}
+        pedidos: Dict[int, Pedido] = {}
+
+        # 1. Validación y reserva en una pasada
+        asignados: Dict[str, str] = {}
+        for indice, especificacion in enumerate(especificaciones):
+            error = self._validar(especificacion, inventario, asignados)
+            if error is None:
+                sesion = f"lote-{lote_id}-{indice}"
+                if inventario.reservar_asientos(especificacion.asientos, sesion, self._ttl_reserva_segundos):
+                    sesiones[indice] = sesion
+                else:
+                    error = "Asientos no disponibles"
+            if error is not None:
+                resultados[indice] = ResultadoPedidoLote(especificacion.referencia, mensaje_error=error)
+                continue
+            for asiento in especificacion.asientos:
+                asignados[asiento] = especificacion.referencia
+            pedidos[indice] = self._crear_pedido(especificacion, funcion)
+            pedidos[indice].maquina = self._maquina
+
+        try:
+            self._ejecutar_etapas(list(pedidos.values()))
+        finally:
+            # Confirmar la venta de los completados y liberar las reservas del resto,
+            # aunque algo inesperado haya interrumpido las etapas
+            for indice, pedido in pedidos.items():
+                self._cerrar_reserva(lote_id, pedido, especificaciones[indice].asientos, sesiones[indice], inventario)
+                resultados[indice] = ResultadoPedidoLote(especificaciones[indice].referencia, pedido)
+
+        completados = sum(1 for resultado in resultados if resultado.exitoso)
+        logger.info("Lote %s procesado: %d de %d pedidos completados.", lote_id, completados, len(resultados))
+        return resultados
+
+    def _ejecutar_etapas(self, activos: List[Pedido]):
+        # 2. Etapas previas al pago, cada una sobre todo el lote
+        for manejador in self._antes_del_pago:
+            if hasattr(manejador, "ejecutar_etapa_lote") and activos:
+                continuar = self._ejecutar_etapa_lote(manejador, activos)
+            else:
+                continuar = [self._ejecutar_etapa(manejador, pedido) for pedido in activos]
+            activos = [pedido for pedido, sigue in zip(activos, continuar)
+                       if sigue and pedido.estado != EstadoPedido.FALLIDO]
+
+        # 3. Pagos concurrentes
+        if self._pago is not None and activos:
+            if self._pasarela_pago is not None:
+                continuar = self._pasarela_pago.programar(self._pagar(activos)).result()
+            else:
+                continuar = asyncio.run(self._pagar(activos))
+            activos = [pedido for pedido, sigue in zip(activos, continuar)
+                       if sigue and pedido.estado != EstadoPedido.FALLIDO]
+
+        # 4. Resto de la cadena
+        for pedido in activos:
+            for manejador in self._despues_del_pago:
+                if pedido.estado == EstadoPedido.FALLIDO or not self._ejecutar_etapa(manejador, pedido):
+                    break
+
+    async def _pagar(self, activos: List[Pedido]) -> List[bool]:
+        limite = asyncio.Semaphore(self._max_pagos_concurrentes)
+
+        async def pagar(pedido: Pedido) -> bool:
+            async with limite:
+                return await self._ejecutar_etapa_async(self._pago, pedido)
+
+        return await asyncio.gather(*(pagar(pedido) for pedido in activos))
+
+    def _ejecutar_etapa_lote(self, manejador: BaseManejadorPedido, activos: List[Pedido]) -> List[bool]:
+        inicio = time.perf_counter()
+        try:
+            continuar = manejador.ejecutar_etapa_lote(activos)
+        except Exception:
+            # No se sabe qué pedido la hizo fallar: se repite la etapa pedido por pedido
+            # (ejecutar_etapa_lote cambia los estados solo si la parte en bloque terminó)
+            logger.exception("Lote: %s falló sobre el lote; se repite pedido por pedido.",
+                             manejador.__class__.__name__)
+            return [self._ejecutar_etapa(manejador, pedido) for pedido in activos]
+        instrumentacion = BaseManejadorPedido.instrumentacion
+        if instrumentacion is not None:
+            # Se reparte el tiempo de la etapa en bloque entre los pedidos del lote
+            por_pedido = (time.perf_counter() - inicio) / len(activos)
+            for pedido in activos:
+                instrumentacion.registrar_etapa(manejador.__class__.__name__, pedido, por_pedido)
+        return continuar
+
+    @staticmethod
+    def _ejecutar_etapa(manejador: BaseManejadorPedido, pedido: Pedido) -> bool:
+        """Una etapa sobre un pedido: si lanza una excepción, solo ese pedido queda FALLIDO"""
+        try:
+            return manejador._ejecutar_etapa_medida(pedido)
+        except Exception as e:
+            return ProcesadorLotes._marcar_fallido(manejador, pedido, e)
+
+    @staticmethod
+    async def _ejecutar_etapa_async(manejador: BaseManejadorPedido, pedido: Pedido) -> bool:
+        try:
+            return await manejador._ejecutar_etapa_medida_async(pedido)
+        except Exception as e:
+            return ProcesadorLotes._marcar_fallido(manejador, pedido, e)
+
+    @staticmethod
+    def _marcar_fallido(manejador: BaseManejadorPedido, pedido: Pedido, error: Exception) -> bool:
+        logger.error("Lote: error en %s con el pedido %s.", manejador.__class__.__name__, pedido.id,
+                     exc_info=error)
+        mensaje = f"Error inesperado al procesar el pedido: {error}"
+        if pedido.maquina.permite(pedido.estado, EventoPedido.FALLAR):
+            pedido.set_error(mensaje)
+        else:
+            pedido.mensaje_error = mensaje
+        return False
+
+    @staticmethod
+    def _cerrar_reserva(lote_id: str, pedido: Pedido, asientos: List[str], sesion: str,
+                        inventario: AsientosCollection):
+        try:
+            if pedido.estado == EstadoPedido.COMPLETADO:
+                if not inventario.confirmar_venta_retenidos(asientos, sesion):
+                    logger.error("Lote %s: la reserva del pedido %s se perdió; se reembolsa.", lote_id, pedido.id)
+                    pedido.solicitar_reembolso()
+                    devolver_canjes(pedido)
+                    pedido.mensaje_error = "La reserva de los asientos expiró durante el pago. El cobro fue reembolsado."
+                return
+        except Exception:
+            logger.exception("Lote %s: no se pudo confirmar la venta del pedido %s.", lote_id, pedido.id)
+        for asiento in asientos:
+            inventario.liberar_asiento(asiento, sesion)
+
+    def _validar(self, especificacion: EspecificacionPedido, inventario: AsientosCollection,
+                 asignados: Dict[str, str]):
+        if not especificacion.asientos and not especificacion.items_confiteria:
+            return "El pedido no tiene asientos ni confitería"
+        if len(especificacion.asientos) > self._max_asientos_pedido:
+            return f"El pedido supera el máximo de {self._max_asientos_pedido} asientos"
+        if not especificacion.metodo_pago:
+            return "Falta el método de pago"
+        if len(set(especificacion.asientos)) != len(especificacion.asientos):
+            return "Asientos repetidos en el pedido"
+        for asiento in especificacion.asientos:
+            if asiento in asignados:
+                return f"El asiento {asiento} ya está en el pedido {asignados[asiento]} del lote"
+            if inventario.esta_vendido(asiento):
+                return f"El asiento {asiento} ya está vendido"
+        return None
+
+    @staticmethod
+    def _crear_pedido(especificacion: EspecificacionPedido, funcion: tuple) -> Pedido:
+        return Pedido(
+            id=PedidoController.siguiente_id(especificacion.asientos),
+            items_boletas=[ItemBoleta(asiento_id=asiento) for asiento in especificacion.asientos],
+            items_confiteria=list(especificacion.items_confiteria),
+            metodo_pago=especificacion.metodo_pago,
+            cupon_aplicado=especificacion.cupon,
+            funcion=funcion,
+        )
@@ -0,0 +1,91 @@
+# controller/mapa_asientos.py
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from models.iterator import AsientosCollection
+
+# Estados de un asiento en el mapa
+DISPONIBLE = "disponible"
+VENDIDO = "vendido"
+RETENIDO = "retenido"  # Retenido por otra sesión
+SELECCIONADO = "seleccionado"
+SELECCIONADO_VENDIDO = "seleccionado_vendido"  # Seleccionado por la sesión pero ya vendido: se muestra deshabilitado
+
+
+class _MapaFuncion:
+    __slots__ = ("version", "asientos", "vendidos", "base", "html_base", "seleccionados")
+
+    def __init__(self, version: int, asientos: List[str], vendidos: Set[str], base: List[str],
+                 seleccionados: Dict[Tuple[str, str], str]):
+        self.version = version
+        self.asientos = asientos
+        self.vendidos = vendidos
+        self.base = base  # HTML de cada asiento como vendido, retenido o disponible
+        self.html_base = "".join(base)
+        # (asiento, estado) -> HTML del asiento seleccionado (no depende de la versión)
+        self.seleccionados = seleccionados
+
+
+class CacheMapaAsientos:
+    """Caché del HTML del mapa de asientos por función.
+
+    El mapa vendido/retenido/disponible se renderiza una vez por versión del
+    inventario (AsientosCollection.version) y se comparte entre todas las
+    sesiones. Cada petición solo superpone los asientos seleccionados por su
+    sesión, con fragmentos que también se renderizan una sola vez.
+    `renderizar(funcion, asiento_id, estado)` produce el HTML de un asiento.
+    Guarda hasta `capacidad` funciones y expulsa la menos usada.
+    """
+
+    def __init__(self, renderizar: Callable[[tuple, str, str], str], capacidad: int = 256):
+        self._renderizar = renderizar
+        self._capacidad = capacidad
+        self._mapas: "OrderedDict[tuple, _MapaFuncion]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def html(self, funcion: tuple, inventario: AsientosCollection, seleccionados: Iterable[str]) -> str:
+        """HTML del mapa de la función con la selección de una sesión superpuesta"""
+        mapa = self._mapa(funcion, inventario)
+        seleccionados = set(seleccionados)
+        if not seleccionados:
+            return mapa.html_base
+        partes = []
+        for asiento_id, html in zip(mapa.asientos, mapa.base):
+            if asiento_id in seleccionados:
+                clave = (asiento_id, SELECCIONADO_VENDIDO if asiento_id in mapa.vendidos else SELECCIONADO)
+                html = mapa.seleccionados.get(clave)
+                if html is None:
+                    html = mapa.seleccionados[clave] = self._renderizar(funcion, *clave)
+            partes.append(html)
+        return "".join(partes)
+
+    def _mapa(self, funcion: tuple, inventario: AsientosCollection) -> _MapaFuncion:
+        # La versión se lee antes que los asientos: si cambian mientras se renderiza,
+        # la entrada queda con una versión vieja y se vuelve a renderizar en la siguiente petición
+        version = inventario.version
+        with self._lock:
+            mapa = self._mapas.get(funcion)
+            if mapa is not None:
+                self._mapas.move_to_end(funcion)
+                if mapa.version == version:
+                    self.aciertos += 1
+                    return mapa
+            self.fallos += 1
+
+        asientos = inventario.listar_asientos()
+        vendidos = set(inventario.asientos_vendidos)
+        retenidos = set(inventario.asientos_ocupados)
+        base = [self._renderizar(funcion, asiento_id,
+                                 VENDIDO if asiento_id in vendidos else RETENIDO if asiento_id in retenidos else DISPONIBLE)
+                for asiento_id in asientos]
+        nuevo = _MapaFuncion(version, asientos, vendidos, base, mapa.seleccionados if mapa is not None else {})
+        with self._lock:
+            self._mapas[funcion] = nuevo
+            self._mapas.move_to_end(funcion)
+            while len(self._mapas) > self._capacidad:
+                self._mapas.popitem(last=False)
+        return nuevo
@@ -0,0 +1,110 @@
+# controller/sala_espera.py
+
+import hashlib
+import hmac
+import threading
+import time
+from typing import Callable, Optional
+
+
+class SalaEspera:
+    """Sala de espera virtual para la selección de asientos.
+
+    Cada sesión recibe un turno numerado y firmado con HMAC ("<turno>.<firma>",
+    ligado al id de sesión): validarlo es O(1) y no requiere almacenamiento
+    compartido, porque el único estado es el último turno emitido y la frontera
+    de admisión (los turnos <= frontera están admitidos).
+    La frontera avanza a `tasa_admision` turnos por segundo (sin cola se acumulan
+    hasta `rafaga` admisiones inmediatas) y solo mientras las retenciones activas
+    (retenciones_activas()) sean menos que `max_retenciones`: si los compradores
+    admitidos aún no liberan o compran sus asientos, la cola espera en lugar de
+    saturar la selección. Contar las retenciones recorre todos los inventarios, así
+    que se hace fuera del lock y como mucho una vez cada `intervalo_retenciones`.
+    """
+
+    def __init__(self, secreto, tasa_admision: float = 5.0, max_retenciones: int = 500,
+                 retenciones_activas: Callable[[], int] = None, rafaga: int = None,
+                 intervalo_retenciones: float = 1.0, reloj: Callable[[], float] = time.monotonic):
+        if tasa_admision <= 0:
+            raise ValueError("La tasa de admisión debe ser positiva")
+        self._secreto = secreto.encode() if isinstance(secreto, str) else secreto
+        self._tasa = tasa_admision
+        self._max_retenciones = max_retenciones
+        self._retenciones_activas = retenciones_activas or (lambda: 0)
+        self._rafaga = rafaga if rafaga is not None else max(1, int(tasa_admision))
+        self._reloj = reloj
+        self._emitidos = 0
+        self._frontera = 0
+        self._credito = float(self._rafaga)
+        self._ultimo_avance = reloj()
+        self._lock = threading.Lock()
+        self._intervalo_retenciones = intervalo_retenciones
+        self._saturada = False
+        self._proxima_muestra = float("-inf")
+        self._lock_muestra = threading.Lock()
+
+    @property
+    def en_cola(self) -> int:
+        return self._emitidos - self._frontera
+
+    def _firmar(self, turno: int, sesion_id: str) -> str:
+        return hmac.new(self._secreto, f"{turno}:{sesion_id}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def emitir(self, sesion_id: str) -> str:
+        """Entrega un turno nuevo al final de la cola"""
+        ahora = self._reloj()
+        with self._lock:
+            if self._frontera == self._emitidos:
+                # Cola vacía hasta ahora: el tiempo sin turnos esperando solo acumula una ráfaga
+                self._credito = min(self._credito + (ahora - self._ultimo_avance) * self._tasa, float(self._rafaga))
+                self._ultimo_avance = ahora
+            self._emitidos += 1
+            turno = self._emitidos
+        return f"{turno}.{self._firmar(turno, sesion_id)}"
+
+    def turno_de(self, token: str, sesion_id: str) -> Optional[int]:
+        """Número de turno del token o None si no es válido para la sesión"""
+        turno, _, firma = (token or "").partition(".")
+        if not turno.isdigit() or not hmac.compare_digest(firma, self._firmar(int(turno), sesion_id)):
+            return None
+        return int(turno)
+
+    def _saturada_en(self, ahora: float) -> bool:
+        """Si las retenciones activas llegaron al máximo, según la última muestra. Solo un
+        hilo toma la muestra nueva; los demás usan la anterior en lugar de esperarlo"""
+        if ahora >= self._proxima_muestra and self._lock_muestra.acquire(blocking=False):
+            try:
+                self._saturada = self._retenciones_activas() >= self._max_retenciones
+                self._proxima_muestra = ahora + self._intervalo_retenciones
+            finally:
+                self._lock_muestra.release()
+        return self._saturada
+
+    def _avanzar(self):
+        ahora = self._reloj()
+        # Las retenciones solo se cuentan si hay turnos esperando
+        saturada = self._frontera < self._emitidos and self._saturada_en(ahora)
+        with self._lock:
+            transcurrido, self._ultimo_avance = ahora - self._ultimo_avance, ahora
+            if saturada:
+                return
+            self._credito += transcurrido * self._tasa
+            admitidos = min(int(self._credito), self._emitidos - self._frontera)
+            if admitidos > 0:
+                self._frontera += admitidos
+                self._credito -= admitidos
+            # Sin turnos esperando, el crédito acumulado solo alcanza para una ráfaga
+            if self._frontera == self._emitidos:
+                self._credito = min(self._credito, float(self._rafaga))
+
+    def admitido(self, turno: int) -> bool:
+        if turno <= self._frontera:
+            return True
+        self._avanzar()
+        return turno <= self._frontera
+
+    def estado(self, turno: int) -> dict:
+        """Posición en la cola (0 si ya fue admitido) y espera estimada en segundos"""
+        posicion = 0 if self.admitido(turno) else turno - self._frontera
+        return dict(turno=turno, admitido=posicion == 0, posicion=posicion,
+                    espera_segundos=round(posicion / self._tasa, 1))
@@ -0,0 +1,104 @@
+# controller/sesiones.py
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from controller.controller import PedidoController
+
+logger = logging.getLogger(__name__)
+
+
+class PoolControladores:
+    """Pool de PedidoController por sesión con expulsión LRU/TTL.
+
+    Cada sesión obtiene su propio controlador (selección, historial de
+    deshacer/rehacer y pedido actual). Los controladores se guardan en orden
+    de último acceso: al superar la capacidad se expulsa el menos usado y los
+    que llevan más de `ttl_segundos` inactivos se expulsan al siguiente acceso.
+    """
+
+    def __init__(self, fabrica: Callable[[], PedidoController] = PedidoController,
+                 capacidad_maxima: int = 1000, ttl_segundos: float = 1800.0,
+                 reloj: Callable[[], float] = time.monotonic):
+        self._fabrica = fabrica
+        self._capacidad_maxima = capacidad_maxima
+        self._ttl_segundos = ttl_segundos
+        self._reloj = reloj
+        # sesion_id -> (controlador, último acceso), ordenado del menos al más reciente
+        self._controladores: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._aciertos = 0
+        self._fallos = 0
+        self._expulsados = 0
+
+    def obtener(self, sesion_id: str) -> PedidoController:
+        """Retorna el controlador de la sesión, creándolo si no existe"""
+        ahora = self._reloj()
+        with self._lock:
+            self._expulsar_inactivos(ahora)
+            entrada = self._controladores.get(sesion_id)
+            if entrada is not None:
+                self._aciertos += 1
+                controlador = entrada[0]
+                self._controladores[sesion_id] = (controlador, ahora)
+                self._controladores.move_to_end(sesion_id)
+                return controlador
+
+            self._fallos += 1
+            controlador = self._fabrica()
+            self._controladores[sesion_id] = (controlador, ahora)
+            while len(self._controladores) > self._capacidad_maxima:
+                sesion_expulsada, _ = self._controladores.popitem(last=False)
+                self._expulsados += 1
+                logger.info("Sesión %s expulsada del pool por capacidad.", sesion_expulsada)
+            return controlador
+
+    def descartar(self, sesion_id: str):
+        """Elimina el controlador de una sesión (p. ej. al cerrar sesión)"""
+        with self._lock:
+            self._controladores.pop(sesion_id, None)
+
+    def expulsar_inactivos(self) -> int:
+        """Expulsa las sesiones que superaron el TTL. Retorna cuántas se expulsaron"""
+        with self._lock:
+            return self._expulsar_inactivos(self._reloj())
+
+    def _expulsar_inactivos(self, ahora: float) -> int:
+        # Las entradas están ordenadas por último acceso: basta revisar el inicio
+        expulsadas = 0
+        while self._controladores:
+            sesion_id, (_, ultimo_acceso) = next(iter(self._controladores.items()))
+            if ahora - ultimo_acceso < self._ttl_segundos:
+                break
+            self._controladores.popitem(last=False)
+            expulsadas += 1
+        self._expulsados += expulsadas
+        return expulsadas
+
+    @property
+    def tamano(self) -> int:
+        return len(self._controladores)
+
+    @property
+    def tasa_aciertos(self) -> float:
+        total = self._aciertos + self._fallos
+        return self._aciertos / total if total else 0.0
+
+    def estadisticas(self) -> dict:
+        return {
+            "tamano": self.tamano,
+            "capacidad_maxima": self._capacidad_maxima,
+            "aciertos": self._aciertos,
+            "fallos": self._fallos,
+            "expulsados": self._expulsados,
+            "tasa_aciertos": self.tasa_aciertos,
+        }
+
+    def __contains__(self, sesion_id: str) -> bool:
+        return sesion_id in self._controladores
+
+    def __len__(self) -> int:
+        return self.tamano
@@ -0,0 +1,50 @@
+# test_controller.py
+
+import os
+import sys
+
+# Permite ejecutarlo como script desde controller/ o desde la raíz del proyecto. Se reemplaza
+# la carpeta del script: si no, controller/controller.py taparía el paquete controller
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from controller.controller import PedidoController
+from models.registro_funciones import RegistroInventarios
+
+FUNCION_X = ("1", "2030-01-01T19:30")
+FUNCION_Y = ("2", "2030-01-01T19:30")
+
+
+def probar_seleccion_de_otra_funcion():
+    registro = RegistroInventarios()
+    controlador = PedidoController()
+    # Se selecciona A1 en la función X (como _seleccionar_asiento en app.py)
+    assert controlador.cambiar_funcion(FUNCION_X) == []
+    assert registro.obtener(*FUNCION_X).retener_asiento("A1", "sesion", 60)
+    controlador.seleccionar_asiento("A1")
+
+    # Procesar en la función Y no vende los asientos retenidos en X
+    try:
+        controlador.crear_pedido("Tarjeta", funcion=FUNCION_Y)
+        raise AssertionError("Se creó un pedido de Y con la selección de X")
+    except ValueError:
+        pass
+    assert controlador.pedido_actual is None
+    assert registro.obtener(*FUNCION_Y).retenido_por("A1") is None
+    assert controlador.crear_pedido("Tarjeta", funcion=FUNCION_X).funcion == FUNCION_X
+
+    # Seleccionar en Y vacía la selección de X (sin historial que la devuelva) y libera sus retenciones
+    assert controlador.cambiar_funcion(FUNCION_Y) == ["A1"]
+    assert registro.liberar_retenciones_de("sesion") == 1
+    assert registro.obtener(*FUNCION_X).retenido_por("A1") is None
+    controlador.deshacer()
+    assert controlador.obtener_estado_asientos().get("asientos", []) == []
+    assert controlador.funcion_seleccion == FUNCION_Y
+    print("Selección ligada a su función: OK")
+
+
+def main():
+    probar_seleccion_de_otra_funcion()
+
+
+if __name__ == "__main__":
+    main()
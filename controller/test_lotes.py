@@ -0,0 +1,173 @@
+# test_lotes.py
+
+import asyncio
+import logging
+import os
+import sys
+
+# Permite ejecutarlo como script desde controller/ o desde la raíz del proyecto. Se reemplaza
+# la carpeta del script: si no, controller/controller.py taparía el paquete controller
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from controller.lotes import EspecificacionPedido, ProcesadorLotes
+from models.chain import (
+    EjecutorCadenaPlano,
+    ManejadorActualizacionInventario,
+    ManejadorAplicacionDescuentos,
+    ManejadorCalculoPreciosYImpuestos,
+    ManejadorGeneracionEntradas,
+    ManejadorProcesamientoPago,
+    ManejadorValidacionStock,
+)
+from models.descuentos import MotorDescuentos
+from models.iterator import AsientosCollection
+from models.precios import MotorPrecios
+from models.state import EstadoPedido
+from servicios.pasarela_pago import PasarelaPago, ResultadoPago
+
+
+class MotorPreciosFallido(MotorPrecios):
+    """La cotización en bloque siempre falla; la individual solo con el asiento C1"""
+
+    def cotizar_lote(self, pedidos):
+        raise RuntimeError("falla la cotización en bloque")
+
+    def cotizar(self, pedido):
+        if any(item.asiento_id == "C1" for item in pedido.items_boletas):
+            raise ValueError("sin precio para C1")
+        return super().cotizar(pedido)
+
+
+class EntradasFallidas(ManejadorGeneracionEntradas):
+    """Después del pago: falla con el método 'explota' y, con 'pierde-reserva',
+    simula que la reserva del pedido venció y otra sesión tomó los asientos"""
+
+    def __init__(self, inventario: AsientosCollection = None):
+        self._inventario = inventario
+
+    def ejecutar_etapa(self, pedido):
+        if pedido.metodo_pago == "explota":
+            raise RuntimeError("impresora de entradas caída")
+        if pedido.metodo_pago == "pierde-reserva":
+            for item in pedido.items_boletas:
+                self._inventario.liberar_asiento(item.asiento_id, self._inventario.retenido_por(item.asiento_id))
+                self._inventario.retener_asiento(item.asiento_id, "otra-sesion", 60)
+        return super().ejecutar_etapa(pedido)
+
+
+class PasarelaLenta(PasarelaPago):
+    """Tarda en responder y anota cuántos cobros esperaban a la vez"""
+
+    def __init__(self):
+        super().__init__()
+        self.en_curso = 0
+        self.maximo_en_curso = 0
+
+    async def procesar_async(self, metodo_pago, monto, referencia=None, clave_idempotencia=None):
+        self.en_curso += 1
+        self.maximo_en_curso = max(self.maximo_en_curso, self.en_curso)
+        await asyncio.sleep(0.05)
+        self.en_curso -= 1
+        return ResultadoPago(metodo_pago != "Tarjeta rechazada", "Rechazada", referencia=referencia)
+
+
+def construir_procesador(max_asientos_pedido: int = 3, inventario: AsientosCollection = None,
+                         motor_descuentos: MotorDescuentos = None, pasarela: PasarelaPago = None) -> ProcesadorLotes:
+    motor_precios = MotorPreciosFallido()
+    primero = ManejadorValidacionStock()
+    primero.establecer_siguiente(ManejadorCalculoPreciosYImpuestos(motor_precios))\
+           .establecer_siguiente(ManejadorAplicacionDescuentos(motor_descuentos, motor_precios))\
+           .establecer_siguiente(ManejadorProcesamientoPago(pasarela))\
+           .establecer_siguiente(EntradasFallidas(inventario))\
+           .establecer_siguiente(ManejadorActualizacionInventario())
+    return ProcesadorLotes(EjecutorCadenaPlano(primero), max_pagos_concurrentes=2,
+                           max_asientos_pedido=max_asientos_pedido, pasarela_pago=pasarela)
+
+
+def probar_fallos_parciales():
+    inventario = AsientosCollection(["A", "B", "C", "D"], 5)
+    resultados = construir_procesador().procesar([
+        EspecificacionPedido("ok", ["A1", "A2"], "efectivo"),
+        EspecificacionPedido("sin-precio", ["C1"], "efectivo"),
+        EspecificacionPedido("rechazada", ["B1"], "Tarjeta rechazada"),
+        EspecificacionPedido("post-pago", ["B2", "B3"], "explota"),
+        EspecificacionPedido("grande", ["D1", "D2", "D3", "D4"], "efectivo"),
+        EspecificacionPedido("ok-2", ["A3"], "efectivo"),
+    ], inventario)
+    por_referencia = {resultado.referencia: resultado for resultado in resultados}
+
+    assert [r.referencia for r in resultados if r.exitoso] == ["ok", "ok-2"]
+    for referencia in ("sin-precio", "rechazada", "post-pago"):
+        assert por_referencia[referencia].pedido.estado == EstadoPedido.FALLIDO, referencia
+    assert "sin precio para C1" in por_referencia["sin-precio"].mensaje_error
+    assert "impresora" in por_referencia["post-pago"].mensaje_error
+    assert por_referencia["grande"].pedido is None and "máximo de 3" in por_referencia["grande"].mensaje_error
+
+    # Los completados quedan vendidos y todas las demás reservas se liberan
+    assert inventario.asientos_vendidos == ["A1", "A2", "A3"]
+    assert inventario.numero_retenciones == 0 and sorted(inventario.asientos_ocupados) == []
+    print("Fallos parciales en el lote: OK")
+
+
+def probar_reserva_perdida():
+    inventario = AsientosCollection(["A"], 5)
+    motor_descuentos = MotorDescuentos.desde_definiciones([
+        {"codigo": "GRUPO", "tipo": "porcentaje", "valor": 10, "usos_maximos": 1}])
+    contador = motor_descuentos.reglas[0].contador
+    resultado, = construir_procesador(inventario=inventario, motor_descuentos=motor_descuentos).procesar(
+        [EspecificacionPedido("tarde", ["A1"], "pierde-reserva", cupon="GRUPO")], inventario)
+
+    # Se reembolsa, los asientos siguen con quien los tomó y el cupón vuelve a estar disponible
+    assert resultado.pedido.estado == EstadoPedido.REEMBOLSO_PROCESADO and "reembolsado" in resultado.mensaje_error
+    assert inventario.retenido_por("A1") == "otra-sesion" and inventario.asientos_vendidos == []
+    assert contador.usados == 0
+    print("Reembolso por reserva perdida: OK")
+
+
+def probar_excepcion_inesperada():
+    inventario = AsientosCollection(["A"], 5)
+    procesador = construir_procesador()
+
+    def falla(activos):
+        raise MemoryError("sin memoria")
+
+    procesador._ejecutar_etapas = falla
+    try:
+        procesador.procesar([EspecificacionPedido("uno", ["A1", "A2"], "efectivo")], inventario)
+    except MemoryError:
+        pass
+    else:
+        raise AssertionError("Se esperaba MemoryError")
+    # Aunque el lote se interrumpa, las reservas no quedan retenidas hasta el TTL
+    assert inventario.numero_retenciones == 0 and inventario.asientos_vendidos == []
+    print("Reservas liberadas tras una excepción: OK")
+
+
+def probar_pagos_concurrentes():
+    inventario = AsientosCollection(["A", "B"], 5)
+    pasarela = PasarelaLenta()
+    try:
+        resultados = construir_procesador(pasarela=pasarela).procesar(
+            [EspecificacionPedido(f"p{numero}", [f"A{numero}"], "efectivo") for numero in range(1, 5)]
+            + [EspecificacionPedido("rechazada", ["B1"], "Tarjeta rechazada")], inventario)
+    finally:
+        pasarela.cerrar()
+
+    # Los cobros esperan juntos en el event loop de la pasarela, sin pasar del máximo
+    assert pasarela.maximo_en_curso == 2
+    assert [r.referencia for r in resultados if r.exitoso] == ["p1", "p2", "p3", "p4"]
+    assert not resultados[-1].exitoso and "Rechazada" in resultados[-1].mensaje_error
+    assert inventario.asientos_vendidos == ["A1", "A2", "A3", "A4"]
+    print("Pagos concurrentes en el event loop de la pasarela: OK")
+
+
+def main():
+    logging.disable(logging.CRITICAL)  # Los fallos provocados registran excepciones
+    probar_fallos_parciales()
+    probar_pagos_concurrentes()
+    probar_reserva_perdida()
+    probar_excepcion_inesperada()
+
+
+if __name__ == "__main__":
+    main()
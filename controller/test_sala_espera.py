@@ -0,0 +1,111 @@
+# test_sala_espera.py
+
+import os
+import sys
+
+# Permite ejecutarlo como script desde controller/ o desde la raíz del proyecto. Se reemplaza
+# la carpeta del script: si no, controller/controller.py taparía el paquete controller
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from controller.sala_espera import SalaEspera
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+
+class Retenciones:
+    """retenciones_activas() que cuenta cuántas veces se consulta"""
+
+    def __init__(self):
+        self.activas = 0
+        self.consultas = 0
+
+    def __call__(self) -> int:
+        self.consultas += 1
+        return self.activas
+
+
+def probar_turnos():
+    sala = SalaEspera("secreto", tasa_admision=2.0, reloj=Reloj())
+    token = sala.emitir("sesion-1")
+    assert sala.turno_de(token, "sesion-1") == 1
+    # El turno está ligado a la sesión y firmado
+    assert sala.turno_de(token, "sesion-2") is None
+    assert sala.turno_de("1." + "0" * 32, "sesion-1") is None
+    assert sala.turno_de("", "sesion-1") is None and sala.turno_de(None, "sesion-1") is None
+    assert sala.turno_de("-1." + token.split(".")[1], "sesion-1") is None
+    assert SalaEspera("otro", reloj=Reloj()).turno_de(token, "sesion-1") is None
+    print("Turnos firmados: OK")
+
+
+def probar_admision():
+    reloj = Reloj()
+    sala = SalaEspera("secreto", tasa_admision=2.0, rafaga=3, reloj=reloj)
+    turnos = [sala.turno_de(sala.emitir(f"s{numero}"), f"s{numero}") for numero in range(10)]
+
+    # La ráfaga inicial admite 3 turnos de inmediato; después, 2 por segundo
+    assert [sala.admitido(turno) for turno in turnos[:4]] == [True, True, True, False]
+    assert sala.estado(turnos[9]) == dict(turno=10, admitido=False, posicion=7, espera_segundos=3.5)
+    reloj.ahora = 1.0
+    assert sala.admitido(turnos[4]) and not sala.admitido(turnos[5])
+    reloj.ahora = 3.5
+    assert sala.admitido(turnos[9]) and sala.en_cola == 0
+
+    # Sin cola el crédito no pasa de la ráfaga, aunque pase mucho tiempo
+    reloj.ahora = 1000.0
+    nuevos = [sala.turno_de(sala.emitir(f"n{numero}"), f"n{numero}") for numero in range(5)]
+    assert [sala.admitido(turno) for turno in nuevos] == [True, True, True, False, False]
+    print("Admisión por tasa y ráfaga: OK")
+
+
+def probar_retenciones():
+    reloj = Reloj()
+    retenciones = Retenciones()
+    sala = SalaEspera("secreto", tasa_admision=10.0, max_retenciones=5, rafaga=1,
+                      retenciones_activas=retenciones, intervalo_retenciones=1.0, reloj=reloj)
+    turnos = [sala.turno_de(sala.emitir(f"s{numero}"), f"s{numero}") for numero in range(30)]
+    assert sala.admitido(turnos[0]) and retenciones.consultas == 1
+
+    # Con las retenciones al máximo la frontera no avanza
+    retenciones.activas = 5
+    reloj.ahora = 1.0
+    assert not sala.admitido(turnos[5])
+    # Las consultas dentro del intervalo usan la muestra anterior, sin recorrer los inventarios
+    for _ in range(100):
+        reloj.ahora += 0.001
+        assert not sala.admitido(turnos[1])
+    assert retenciones.consultas == 2
+
+    # Al liberarse retenciones se admite de nuevo (tras la siguiente muestra)
+    retenciones.activas = 0
+    reloj.ahora = 1.5
+    assert not sala.admitido(turnos[1])
+    reloj.ahora = 2.1
+    assert sala.admitido(turnos[1]) and retenciones.consultas == 3
+    assert sala.estado(turnos[6])["admitido"] and sala.estado(turnos[7])["posicion"] == 1  # 0.6 s x 10/s
+    reloj.ahora = 3.1
+    assert sala.admitido(turnos[16]) and not sala.admitido(turnos[17])
+
+    # Sin turnos esperando no se consultan las retenciones
+    reloj.ahora = 10.0
+    assert sala.admitido(turnos[29]) and sala.en_cola == 0
+    consultas = retenciones.consultas
+    reloj.ahora = 20.0
+    assert not sala.admitido(turnos[29] + 1)  # Turno aún no emitido: avanza sin contar retenciones
+    assert retenciones.consultas == consultas
+    print("Tope de retenciones muestreado: OK")
+
+
+def main():
+    probar_turnos()
+    probar_admision()
+    probar_retenciones()
+
+
+if __name__ == "__main__":
+    main()
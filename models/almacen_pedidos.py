@@ -0,0 +1,229 @@
+# models/almacen_pedidos.py
+
+import bisect
+import threading
+from array import array
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+from models.chain import EstadoPedido, ItemBoleta, ItemConfiteria, Pedido
+from models.precios import a_centavos, a_monto
+
+
+class AlmacenPedidos:
+    """Historial de pedidos con índices por ID, estado y método de pago.
+
+    Cada pedido recibe un número de secuencia al agregarse. Los índices
+    secundarios (por estado, por método de pago y por ambos juntos) guardan listas
+    ordenadas de secuencias, así que buscar por ID y contar son O(1) y una página
+    (del más reciente al más antiguo) cuesta O(tamaño de página) con cualquier filtro.
+    El cursor de una página es la secuencia del último pedido entregado.
+    El estado de un pedido cambia fuera del almacén: después de modificarlo hay
+    que llamar a `actualizar` para mantener el índice por estado al día.
+    """
+
+    def __init__(self):
+        self._pedidos: Dict[str, Pedido] = {}
+        self._estados: List[EstadoPedido] = []  # secuencia -> estado indexado
+        self._secuencias: Dict[str, int] = {}
+        self._orden: List[str] = []  # secuencia -> ID del pedido
+        self._por_estado: Dict[EstadoPedido, List[int]] = {}
+        self._por_metodo_pago: Dict[str, List[int]] = {}
+        self._por_estado_metodo: Dict[Tuple[EstadoPedido, str], List[int]] = {}
+        self._lock = threading.Lock()
+
+    def agregar(self, pedido: Pedido):
+        """Agrega el pedido al historial (si ya estaba, solo actualiza sus índices)"""
+        with self._lock:
+            secuencia = self._secuencias.get(pedido.id)
+            if secuencia is not None:
+                self._reindexar_estado(secuencia, pedido)
+                return
+            secuencia = len(self._orden)
+            self._guardar(pedido)
+            self._orden.append(pedido.id)
+            self._secuencias[pedido.id] = secuencia
+            # Las secuencias crecen: agregar al final mantiene las listas ordenadas
+            self._por_estado.setdefault(pedido.estado, []).append(secuencia)
+            self._por_metodo_pago.setdefault(pedido.metodo_pago, []).append(secuencia)
+            self._por_estado_metodo.setdefault((pedido.estado, pedido.metodo_pago), []).append(secuencia)
+
+    def actualizar(self, pedido: Pedido):
+        """Reindexa el pedido tras un cambio de estado (p. ej. un reembolso)"""
+        with self._lock:
+            secuencia = self._secuencias.get(pedido.id)
+            if secuencia is not None:
+                self._reindexar_estado(secuencia, pedido)
+
+    def _reindexar_estado(self, secuencia: int, pedido: Pedido):
+        anterior = self._estado_de(secuencia)
+        if anterior is not pedido.estado:
+            metodo_pago = self._metodo_pago_de(secuencia)
+            for indice, clave_anterior, clave_nueva in (
+                    (self._por_estado, anterior, pedido.estado),
+                    (self._por_estado_metodo, (anterior, metodo_pago), (pedido.estado, metodo_pago))):
+                secuencias = indice[clave_anterior]
+                del secuencias[bisect.bisect_left(secuencias, secuencia)]
+                bisect.insort(indice.setdefault(clave_nueva, []), secuencia)
+        self._fijar_estado(secuencia, pedido)
+
+    # --- Almacenamiento (AlmacenPedidosCompacto lo reemplaza por columnas) ---
+
+    def _guardar(self, pedido: Pedido):
+        self._pedidos[pedido.id] = pedido
+        self._estados.append(pedido.estado)
+
+    def _leer(self, secuencia: int) -> Pedido:
+        return self._pedidos[self._orden[secuencia]]
+
+    def _metodo_pago_de(self, secuencia: int) -> str:
+        return self._pedidos[self._orden[secuencia]].metodo_pago
+
+    def _estado_de(self, secuencia: int) -> EstadoPedido:
+        return self._estados[secuencia]
+
+    def _fijar_estado(self, secuencia: int, pedido: Pedido):
+        self._estados[secuencia] = pedido.estado
+
+    def obtener(self, pedido_id: str) -> Optional[Pedido]:
+        secuencia = self._secuencias.get(pedido_id)
+        return self._leer(secuencia) if secuencia is not None else None
+
+    def pagina(self, limite: int = 20, cursor: int = None, estado: EstadoPedido = None,
+               metodo_pago: str = None) -> Tuple[List[Pedido], Optional[int]]:
+        """Retorna (pedidos, cursor siguiente) del más reciente al más antiguo.
+
+        `cursor` es el valor retornado por la página anterior; el cursor
+        siguiente es None cuando no quedan más pedidos.
+        """
+        with self._lock:
+            secuencias = self._secuencias_filtradas(estado, metodo_pago)
+            fin = len(secuencias) if cursor is None else bisect.bisect_left(secuencias, cursor)
+            inicio = max(fin - limite, 0)
+            pedidos = [self._leer(secuencias[posicion]) for posicion in range(fin - 1, inicio - 1, -1)]
+            siguiente = secuencias[inicio] if inicio > 0 else None
+            return pedidos, siguiente
+
+    def _secuencias_filtradas(self, estado: Optional[EstadoPedido], metodo_pago: Optional[str]) -> Sequence[int]:
+        if estado is not None and metodo_pago is not None:
+            return self._por_estado_metodo.get((estado, metodo_pago), [])
+        if estado is not None:
+            return self._por_estado.get(estado, [])
+        if metodo_pago is not None:
+            return self._por_metodo_pago.get(metodo_pago, [])
+        return range(len(self._orden))
+
+    def contar(self, estado: EstadoPedido = None, metodo_pago: str = None) -> int:
+        """Cantidad de pedidos con ese estado y/o método de pago"""
+        return len(self._secuencias_filtradas(estado, metodo_pago))
+
+    def metodos_pago(self) -> List[str]:
+        return sorted(self._por_metodo_pago)
+
+    def __contains__(self, pedido_id: str) -> bool:
+        return pedido_id in self._secuencias
+
+    def __iter__(self) -> Iterator[Pedido]:
+        return (self._leer(secuencia) for secuencia in range(len(self._orden)))
+
+    def __len__(self) -> int:
+        return len(self._orden)
+
+
+class _TablaTextos:
+    """Valores repetidos (asientos, métodos de pago, cupones...) guardados una sola vez;
+    las columnas guardan solo su código"""
+
+    __slots__ = ("_codigos", "_valores")
+
+    def __init__(self):
+        self._codigos: Dict[Hashable, int] = {}
+        self._valores: List[Hashable] = []
+
+    def codigo(self, valor: Hashable) -> int:
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            codigo = len(self._valores)
+            self._codigos[valor] = codigo
+            self._valores.append(valor)
+        return codigo
+
+    def valor(self, codigo: int) -> Hashable:
+        return self._valores[codigo]
+
+
+_ESTADOS = tuple(EstadoPedido)
+_CODIGO_ESTADO = {estado: codigo for codigo, estado in enumerate(_ESTADOS)}
+
+
+class AlmacenPedidosCompacto(AlmacenPedidos):
+    """Mismo historial e índices que AlmacenPedidos, guardado por columnas.
+
+    En lugar de un Pedido con sus items por pedido, cada campo es un arreglo
+    compacto (array) indexado por secuencia. Los textos repetidos se guardan una
+    vez en una tabla y los montos en centavos enteros. obtener(), pagina() e
+    iterar reconstruyen un Pedido nuevo en cada lectura: los cambios sobre él
+    (p. ej. un reembolso) solo se guardan al llamar a `actualizar`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._textos = _TablaTextos()
+        self._metodo_pago = array("I")
+        self._cupon = array("I")
+        self._funcion = array("I")
+        self._mensaje_error = array("I")
+        self._estado = array("B")
+        self._montos = array("q")  # subtotal, descuento, impuestos y total por pedido
+        # Items de todos los pedidos, uno tras otro; los del pedido i van de inicio[i] a inicio[i + 1]
+        self._inicio_boletas = array("I", [0])
+        self._asiento = array("I")
+        self._precio_boleta = array("q")
+        self._inicio_confiteria = array("I", [0])
+        self._producto = array("I")
+        self._cantidad = array("I")
+        self._precio_unitario = array("q")
+
+    def _guardar(self, pedido: Pedido):
+        codigo = self._textos.codigo
+        for item in pedido.items_boletas:
+            self._asiento.append(codigo(item.asiento_id))
+            self._precio_boleta.append(a_centavos(item.precio))
+        for item in pedido.items_confiteria:
+            self._producto.append(codigo(item.nombre))
+            self._cantidad.append(item.cantidad)
+            self._precio_unitario.append(a_centavos(item.precio_unitario))
+        self._inicio_boletas.append(len(self._asiento))
+        self._inicio_confiteria.append(len(self._producto))
+        self._metodo_pago.append(codigo(pedido.metodo_pago))
+        self._cupon.append(codigo(pedido.cupon_aplicado))
+        self._funcion.append(codigo(pedido.funcion))
+        self._mensaje_error.append(codigo(pedido.mensaje_error))
+        self._estado.append(_CODIGO_ESTADO[pedido.estado])
+        self._montos.extend((a_centavos(pedido.subtotal), a_centavos(pedido.descuento_aplicado),
+                             a_centavos(pedido.impuestos), a_centavos(pedido.total_final)))
+
+    def _leer(self, secuencia: int) -> Pedido:
+        valor = self._textos.valor
+        boletas = [ItemBoleta(valor(self._asiento[i]), a_monto(self._precio_boleta[i]))
+                   for i in range(self._inicio_boletas[secuencia], self._inicio_boletas[secuencia + 1])]
+        confiteria = [ItemConfiteria(valor(self._producto[i]), self._cantidad[i], a_monto(self._precio_unitario[i]))
+                      for i in range(self._inicio_confiteria[secuencia], self._inicio_confiteria[secuencia + 1])]
+        pedido = Pedido(self._orden[secuencia], boletas, confiteria, valor(self._metodo_pago[secuencia]),
+                        valor(self._cupon[secuencia]), valor(self._funcion[secuencia]))
+        subtotal, descuento, impuestos, total = self._montos[4 * secuencia:4 * secuencia + 4]
+        pedido.subtotal, pedido.descuento_aplicado = a_monto(subtotal), a_monto(descuento)
+        pedido.impuestos, pedido.total_final = a_monto(impuestos), a_monto(total)
+        pedido.estado = _ESTADOS[self._estado[secuencia]]
+        pedido.mensaje_error = valor(self._mensaje_error[secuencia])
+        pedido._asientos_reembolsados = pedido.estado is EstadoPedido.REEMBOLSO_PROCESADO
+        return pedido
+
+    def _metodo_pago_de(self, secuencia: int) -> str:
+        return self._textos.valor(self._metodo_pago[secuencia])
+
+    def _estado_de(self, secuencia: int) -> EstadoPedido:
+        return _ESTADOS[self._estado[secuencia]]
+
+    def _fijar_estado(self, secuencia: int, pedido: Pedido):
+        self._estado[secuencia] = _CODIGO_ESTADO[pedido.estado]
+        self._mensaje_error[secuencia] = self._textos.codigo(pedido.mensaje_error)
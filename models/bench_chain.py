@@ -0,0 +1,84 @@
+# bench_chain.py
+# Micro-benchmark: cadena recursiva (procesar_pedido) vs. pipeline plano (EjecutorCadenaPlano).
+# Uso: python bench_chain.py [numero_de_pedidos]
+
+import os
+import sys
+import timeit
+
+# Permite ejecutarlo como script desde models/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.chain import (
+    Pedido,
+    EstadoPedido,
+    ItemBoleta,
+    ItemConfiteria,
+    EjecutorCadenaPlano,
+    ManejadorValidacionStock,
+    ManejadorCalculoPreciosYImpuestos,
+    ManejadorAplicacionDescuentos,
+    ManejadorProcesamientoPago,
+    ManejadorGeneracionEntradas,
+    ManejadorActualizacionInventario
+)
+
+
+def construir_cadena():
+    primer_manejador = ManejadorValidacionStock()
+    primer_manejador.establecer_siguiente(ManejadorCalculoPreciosYImpuestos())\
+                    .establecer_siguiente(ManejadorAplicacionDescuentos())\
+                    .establecer_siguiente(ManejadorProcesamientoPago())\
+                    .establecer_siguiente(ManejadorGeneracionEntradas())\
+                    .establecer_siguiente(ManejadorActualizacionInventario())
+    return primer_manejador
+
+
+def crear_pedido(metodo_pago="Tarjeta", cupon="CINE20"):
+    return Pedido(
+        id="BENCH",
+        items_boletas=[ItemBoleta("A1"), ItemBoleta("A2"), ItemBoleta("A3")],
+        items_confiteria=[ItemConfiteria("Palomitas Grandes", 2, 5.00)],
+        metodo_pago=metodo_pago,
+        cupon_aplicado=cupon
+    )
+
+
+def resumen(pedido):
+    return (pedido.estado, pedido.subtotal, pedido.descuento_aplicado, pedido.impuestos,
+            pedido.total_final, pedido.mensaje_error)
+
+
+def verificar_equivalencia(recursiva, plana):
+    """Ambos modos deben dejar el Pedido en el mismo estado final."""
+    for metodo_pago, cupon in [("Tarjeta", "CINE20"), ("Tarjeta rechazada", None), ("efectivo", None)]:
+        pedido_recursivo = crear_pedido(metodo_pago, cupon)
+        pedido_plano = crear_pedido(metodo_pago, cupon)
+        recursiva.procesar_pedido(pedido_recursivo)
+        plana.procesar_pedido(pedido_plano)
+        assert resumen(pedido_recursivo) == resumen(pedido_plano), (metodo_pago, resumen(pedido_recursivo), resumen(pedido_plano))
+        print(f"  {metodo_pago:<18} -> {pedido_plano.estado.value}")
+
+
+def main():
+    numero_pedidos = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    recursiva = construir_cadena()
+    plana = EjecutorCadenaPlano(recursiva)
+
+    print("Estados finales (recursivo == plano):")
+    verificar_equivalencia(recursiva, plana)
+
+    pedidos_recursivos = [crear_pedido() for _ in range(numero_pedidos)]
+    pedidos_planos = [crear_pedido() for _ in range(numero_pedidos)]
+    tiempo_recursivo = timeit.timeit(lambda: [recursiva.procesar_pedido(p) for p in pedidos_recursivos], number=1)
+    tiempo_plano = timeit.timeit(lambda: [plana.procesar_pedido(p) for p in pedidos_planos], number=1)
+    assert all(p.estado == EstadoPedido.COMPLETADO for p in pedidos_planos)
+
+    print(f"\nPedidos procesados: {numero_pedidos}")
+    print(f"  recursivo: {tiempo_recursivo / numero_pedidos * 1e6:8.2f} µs/pedido")
+    print(f"  plano:     {tiempo_plano / numero_pedidos * 1e6:8.2f} µs/pedido")
+    print(f"  aceleración: {tiempo_recursivo / tiempo_plano:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# models/bitset_asientos.py
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class MapaBitsAsientos:
+    """Almacén compacto de un estado binario (ocupado, vendido...) por asiento.
+
+    Cada asiento se asigna a una posición fija (fila, columna). Cada fila guarda
+    su estado en un entero usado como bitset, así que consultar o marcar un
+    asiento es O(1) y las operaciones en bloque se reducen a una máscara por fila.
+    Los IDs que no pertenecen a la distribución de la sala se ignoran.
+    """
+
+    def __init__(self, filas: List[str], asientos_por_fila: int):
+        self._filas = list(filas)
+        self._asientos_por_fila = asientos_por_fila
+        # asiento_id -> (índice de fila, máscara de la columna)
+        self._posiciones: Dict[str, Tuple[int, int]] = {}
+        for indice_fila, fila in enumerate(self._filas):
+            for columna in range(asientos_por_fila):
+                self._posiciones[f"{fila}{columna + 1}"] = (indice_fila, 1 << columna)
+        self._bits: List[int] = [0] * len(self._filas)
+
+    def posicion(self, asiento_id: str) -> Optional[Tuple[int, int]]:
+        """Retorna (índice de fila, máscara) del asiento o None si no existe"""
+        return self._posiciones.get(asiento_id)
+
+    def contiene(self, asiento_id: str) -> bool:
+        posicion = self._posiciones.get(asiento_id)
+        if posicion is None:
+            return False
+        indice_fila, mascara = posicion
+        return bool(self._bits[indice_fila] & mascara)
+
+    def marcar(self, asiento_id: str) -> bool:
+        """Marca el asiento. Retorna True si el estado cambió"""
+        posicion = self._posiciones.get(asiento_id)
+        if posicion is None:
+            return False
+        indice_fila, mascara = posicion
+        if self._bits[indice_fila] & mascara:
+            return False
+        self._bits[indice_fila] |= mascara
+        return True
+
+    def desmarcar(self, asiento_id: str) -> bool:
+        """Desmarca el asiento. Retorna True si el estado cambió"""
+        posicion = self._posiciones.get(asiento_id)
+        if posicion is None:
+            return False
+        indice_fila, mascara = posicion
+        if not self._bits[indice_fila] & mascara:
+            return False
+        self._bits[indice_fila] &= ~mascara
+        return True
+
+    def mascaras_de(self, asientos: Iterable[str]) -> List[int]:
+        """Agrupa varios asientos en una máscara por fila"""
+        mascaras = [0] * len(self._filas)
+        for asiento_id in asientos:
+            posicion = self._posiciones.get(asiento_id)
+            if posicion is not None:
+                mascaras[posicion[0]] |= posicion[1]
+        return mascaras
+
+    def aplicar_mascaras(self, mascaras: List[int]):
+        """Marca en bloque todos los asientos de las máscaras"""
+        for indice_fila, mascara in enumerate(mascaras):
+            if mascara:
+                self._bits[indice_fila] |= mascara
+
+    def limpiar_mascaras(self, mascaras: List[int]):
+        """Desmarca en bloque todos los asientos de las máscaras"""
+        for indice_fila, mascara in enumerate(mascaras):
+            if mascara:
+                self._bits[indice_fila] &= ~mascara
+
+    def marcados_en(self, mascaras: List[int]) -> List[int]:
+        """Parte de las máscaras que ya está marcada"""
+        return [mascara & bits for mascara, bits in zip(mascaras, self._bits)]
+
+    def sin_marcar_en(self, mascaras: List[int]) -> List[int]:
+        """Parte de las máscaras que aún no está marcada"""
+        return [mascara & ~bits for mascara, bits in zip(mascaras, self._bits)]
+
+    def listar(self) -> List[str]:
+        """Lista los asientos marcados en orden de fila y columna"""
+        return self.asientos_de(self._bits)
+
+    def asientos_de(self, mascaras: List[int]) -> List[str]:
+        """Lista los asientos de las máscaras en orden de fila y columna"""
+        asientos = []
+        for indice_fila, bits in enumerate(mascaras):
+            fila = self._filas[indice_fila]
+            while bits:
+                mascara = bits & -bits
+                asientos.append(f"{fila}{mascara.bit_length()}")
+                bits ^= mascara
+        return asientos
+
+    def __len__(self) -> int:
+        return sum(bits.bit_count() for bits in self._bits)
+
+    def __contains__(self, asiento_id: str) -> bool:
+        return self.contiene(asiento_id)
@@ -1,9 +1,15 @@
 # models/chain.py (Inicio del archivo)
 
 import abc
+import functools
 import logging
-from enum import Enum
-from typing import List, Any # Usamos Any para simplificar ItemBoleta/Confiteria en este ejemplo
+import time
+from typing import List, Any, Optional # Usamos Any para simplificar ItemBoleta/Confiteria en este ejemplo
+
+from models.descuentos import REGLAS_POR_DEFECTO, MotorDescuentos, devolver_canjes
+from models.precios import Cotizacion, MotorPrecios, a_centavos, a_monto
+from models.state import (ETAPAS_PREPARACION, EstadoPedido, EventoPedido, MaquinaEstados, TRANSICIONES_PEDIDO,
+                          TransicionInvalida, transiciones_pedido)
 
 # Configuramos un logger para este módulo.
 logger = logging.getLogger(__name__)
@@ -11,20 +17,10 @@ logger = logging.getLogger(__name__)
 # --- Clases Placeholder para Items del Pedido ---
 # Estas clases representan los elementos que componen un pedido (boletas, confitería).
 # Son usadas por la clase Pedido y los manejadores.
-class EstadoPedido(Enum):
-    PENDIENTE = "PENDIENTE"
-    VALIDANDO = "VALIDANDO"
-    CALCULANDO_PRECIOS = "CALCULANDO_PRECIOS"
-    APLICANDO_DESCUENTOS = "APLICANDO_DESCUENTOS"
-    PROCESANDO_PAGO = "PROCESANDO_PAGO"
-    PAGADO = "PAGADO"
-    COMPLETADO = "COMPLETADO"
-    FALLIDO = "FALLIDO"
-    CANCELADO = "CANCELADO"
-    REEMBOLSO_SOLICITADO = "REEMBOLSO_SOLICITADO"
-    REEMBOLSO_PROCESADO = "REEMBOLSO_PROCESADO"
-    REEMBOLSO_RECHAZADO = "REEMBOLSO_RECHAZADO"
 class ItemBoleta:
+    # Sin __dict__: el historial puede guardar cientos de miles de items
+    __slots__ = ("asiento_id", "precio")
+
     def __init__(self, asiento_id: str, precio: float = 10000.0): # Precio por defecto para ejemplo
         self.asiento_id = asiento_id
         self.precio = precio # Precio individual de la boleta
@@ -33,6 +29,8 @@ class ItemBoleta:
         return f"Boleta(Asiento: {self.asiento_id}, Precio: {self.precio:.2f})"
 
 class ItemConfiteria:
+    __slots__ = ("nombre", "cantidad", "precio_unitario", "precio")
+
     def __init__(self, nombre: str, cantidad: int, precio_unitario: float):
         self.nombre = nombre
         self.cantidad = cantidad
@@ -47,13 +45,19 @@ class ItemConfiteria:
 # ... (el resto de tu clase Pedido existente) ...
 
 class Pedido:
-    def __init__(self, id: str, items_boletas: List[ItemBoleta], items_confiteria: List[ItemConfiteria], metodo_pago: str, cupon_aplicado: str = None):
+    # Atributos fijos y sin __dict__ (ver también AlmacenPedidosCompacto para historiales grandes)
+    __slots__ = ("id", "items_boletas", "items_confiteria", "metodo_pago", "cupon_aplicado", "funcion",
+                 "subtotal", "descuento_aplicado", "impuestos", "total_final", "estado", "mensaje_error",
+                 "canjes_descuento", "_asientos_reembolsados", "maquina")
+
+    def __init__(self, id: str, items_boletas: List[ItemBoleta], items_confiteria: List[ItemConfiteria], metodo_pago: str, cupon_aplicado: str = None, funcion: tuple = None):
         # ... (tu código __init__ existente) ...
         self.id = id
         self.items_boletas = items_boletas # Datos de las boletas (lista de ItemBoleta)
         self.items_confiteria = items_confiteria # Datos de la confitería (lista de ItemConfiteria)
         self.metodo_pago = metodo_pago
         self.cupon_aplicado = cupon_aplicado
+        self.funcion = funcion # (sala, horario) de la función a la que pertenecen las boletas
 
         # Atributos que serán llenados por los manejadores
         self.subtotal = 0.0
@@ -63,52 +67,105 @@ class Pedido:
 
         self.estado = EstadoPedido.PENDIENTE
         self.mensaje_error = None
+        self.canjes_descuento = ()  # Usos de cupones con tope tomados por este pedido
         self._asientos_reembolsados = False  # Nuevo flag para controlar reembolso
-
-    def set_estado(self, estado: EstadoPedido):
-        logger.info(f"Pedido {self.id}: Cambiando estado a {estado.value}")
-        self.estado = estado
+        # Tabla de transiciones de la cadena que lo procesa (ver maquina_de_cadena)
+        self.maquina = maquina_pedidos
+
+    def disparar(self, evento: EventoPedido) -> EstadoPedido:
+        """Cambia de estado según la tabla de transiciones (ver models/state.py).
+        Lanza TransicionInvalida si el evento no está permitido en el estado actual."""
+        estado = self.maquina.disparar(self, evento)
+        logger.info("Pedido %s: Cambiando estado a %s", self.id, estado.value)
+        return estado
+
+    def set_estado(self, estado: EstadoPedido) -> EstadoPedido:
+        """Lleva el pedido a `estado` con el evento de la tabla que lo alcanza desde el actual.
+        Lanza TransicionInvalida si no hay ninguno (p. ej. de COMPLETADO a PENDIENTE)."""
+        estado = self.maquina.llevar_a(self, estado)
+        logger.info("Pedido %s: Cambiando estado a %s", self.id, estado.value)
+        return estado
 
     def set_error(self, mensaje: str):
-        logger.error(f"Pedido {self.id}: !! ERROR: {mensaje} !!")
+        logger.error("Pedido %s: !! ERROR: %s !!", self.id, mensaje)
         self.mensaje_error = mensaje
-        self.set_estado(EstadoPedido.FALLIDO)
-
-    # --- Añadimos métodos básicos para Cancelar/Solicitar Reembolso ---
-    # Estos simplemente cambian el estado del pedido
-    def cancelar(self):
-        if self.estado in [EstadoPedido.PENDIENTE, EstadoPedido.VALIDANDO, EstadoPedido.CALCULANDO_PRECIOS, EstadoPedido.APLICANDO_DESCUENTOS, EstadoPedido.PROCESANDO_PAGO]:
-             logger.info(f"Pedido {self.id}: Cancelando pedido desde estado {self.estado.value}")
-             self.set_estado(EstadoPedido.CANCELADO)
-        else:
-             logger.warning(f"Pedido {self.id}: No se puede cancelar el pedido en estado {self.estado.value}")
+        self.disparar(EventoPedido.FALLAR)
+
+    # --- Cancelar/Solicitar Reembolso ---
+    # Validan el estado actual con la misma tabla de transiciones que la cadena
+    def cancelar(self) -> bool:
+        # Sin consultar antes con permite(): la cadena de pago puede cambiar el estado entre
+        # la consulta y el disparo, y disparar ya valida y transiciona de forma atómica
+        origen = self.estado
+        try:
+            self.disparar(EventoPedido.CANCELAR)
+        except TransicionInvalida as e:
+            logger.warning("Pedido %s: No se puede cancelar el pedido en estado %s", self.id, e.estado.value)
+            return False
+        logger.info("Pedido %s: Pedido cancelado desde estado %s", self.id, origen.value)
+        return True
 
     def solicitar_reembolso(self) -> bool:
         """Procesa la solicitud de reembolso del pedido"""
-        if self.estado != EstadoPedido.COMPLETADO:
+        if not self.maquina.permite(self.estado, EventoPedido.REEMBOLSAR):
             self.mensaje_error = "Solo se pueden reembolsar pedidos completados"
             return False
 
         try:
             # Procesamos el reembolso independientemente del método de pago
-            logger.info(f"Procesando reembolso para pedido {self.id} con método {self.metodo_pago}")
+            logger.info("Procesando reembolso para pedido %s con método %s", self.id, self.metodo_pago)
             
             # Aquí podrías agregar lógica específica para cada método de pago
             # Por ahora, simplemente aprobamos todos los reembolsos
             
-            self.estado = EstadoPedido.REEMBOLSO_PROCESADO
-            self._asientos_reembolsados = True
+            # La transición marca los asientos como reembolsados (acción "marcar_reembolsado")
+            self.disparar(EventoPedido.REEMBOLSAR)
             return True
 
         except Exception as e:
             self.mensaje_error = f"Error en el reembolso: {str(e)}"
-            self.estado = EstadoPedido.REEMBOLSO_RECHAZADO
+            if self.maquina.permite(self.estado, EventoPedido.RECHAZAR_REEMBOLSO):
+                self.disparar(EventoPedido.RECHAZAR_REEMBOLSO)
             return False
 
     @property
     def asientos_reembolsados(self) -> bool:
         return self._asientos_reembolsados
 
+
+def _marcar_reembolsado(pedido: Pedido):
+    pedido._asientos_reembolsados = True
+
+
+# Máquina de estados compartida por todos los pedidos. Si maquina_pedidos.observador no es
+# None, recibe cada transición (p. ej. servicios.diario_eventos.DiarioEventos.registrar_transicion_pedido).
+# Un pedido que falla o se cancela devuelve los usos de sus cupones (acción "liberar_pedido").
+maquina_pedidos = MaquinaEstados(EstadoPedido, EventoPedido, TRANSICIONES_PEDIDO, acciones={
+    "liberar_pedido": devolver_canjes,
+    "marcar_reembolsado": _marcar_reembolsado,
+})
+
+
+def maquina_de_cadena(primer_manejador) -> MaquinaEstados:
+    """Máquina cuyas etapas previas al pago siguen el orden de la cadena (ver transiciones_pedido).
+    Con el orden por defecto es maquina_pedidos; las demás comparten su observador y acciones."""
+    etapas = []
+    manejador = primer_manejador
+    while manejador is not None:
+        etapa = getattr(manejador, "etapa_preparacion", None)
+        if etapa is not None:
+            etapas.append(etapa)
+        manejador = getattr(manejador, "_siguiente_manejador", None)
+    return _maquina_para_etapas(tuple(etapas))
+
+
+@functools.lru_cache(maxsize=None)
+def _maquina_para_etapas(etapas: tuple) -> MaquinaEstados:
+    if etapas == ETAPAS_PREPARACION:
+        return maquina_pedidos
+    return maquina_pedidos.derivar(transiciones_pedido(etapas))
+
+
     # --- Interfaz del Manejador ---
     # Define la interfaz que todos los manejadores deben seguir.
 
@@ -129,6 +186,15 @@ class ManejadorPedido(abc.ABC):
 class BaseManejadorPedido(ManejadorPedido, abc.ABC):
     _siguiente_manejador: ManejadorPedido = None
 
+    # Hook de instrumentación compartido por todos los manejadores. Si no es None, debe
+    # ofrecer registrar_etapa(nombre_manejador, pedido, segundos) y se le informa el
+    # tiempo de cada etapa ejecutada (en ambos modos de ejecución).
+    instrumentacion = None
+
+    # Evento que dispara la etapa si es previa al pago (VALIDAR, CALCULAR_PRECIOS,
+    # APLICAR_DESCUENTOS). Con ellos se arma la tabla de transiciones de la cadena.
+    etapa_preparacion: EventoPedido = None
+
     def establecer_siguiente(self, siguiente_manejador: ManejadorPedido):
         self._siguiente_manejador = siguiente_manejador
         return siguiente_manejador
@@ -137,30 +203,106 @@ class BaseManejadorPedido(ManejadorPedido, abc.ABC):
         """Pasa la solicitud al siguiente manejador si existe."""
         # Solo pasamos si el pedido no ha fallado en un manejador anterior
         if pedido.estado != EstadoPedido.FALLIDO and self._siguiente_manejador:
-            logger.debug(f"  {self.__class__.__name__} pasa el pedido {pedido.id} al siguiente manejador ({self._siguiente_manejador.__class__.__name__}).")
+            logger.debug("  %s pasa el pedido %s al siguiente manejador (%s).", self.__class__.__name__, pedido.id, self._siguiente_manejador.__class__.__name__)
             self._siguiente_manejador.procesar_pedido(pedido)
         elif pedido.estado != EstadoPedido.FALLIDO and not self._siguiente_manejador:
-             logger.info(f"  {self.__class__.__name__} es el último manejador en la cadena para el pedido {pedido.id}. Procesamiento finalizado.")
+             logger.info("  %s es el último manejador en la cadena para el pedido %s. Procesamiento finalizado.", self.__class__.__name__, pedido.id)
              # El último manejador exitoso debería marcar como completado si no hubo fallo
              # Esto lo moveremos al ManejadorActualizacionInventario.
         else:
-             logger.debug(f"  Pedido {pedido.id} ya falló. Deteniendo la cadena en {self.__class__.__name__}.")
+             logger.debug("  Pedido %s ya falló. Deteniendo la cadena en %s.", pedido.id, self.__class__.__name__)
 
+    def procesar_pedido(self, pedido: Pedido):
+        """Modo recursivo: ejecuta la etapa de este manejador y pasa el pedido al siguiente."""
+        if pedido.estado == EstadoPedido.FALLIDO:
+            logger.warning("%s: Saltando procesamiento para pedido %s (ya falló).", self.__class__.__name__, pedido.id)
+            return
+        if pedido.estado is EstadoPedido.PENDIENTE:
+            pedido.maquina = maquina_de_cadena(self)  # Comienzo de la cadena
+        if self._ejecutar_etapa_medida(pedido):
+            self._pasar_al_siguiente(pedido)
+
+    def _ejecutar_etapa_medida(self, pedido: Pedido) -> bool:
+        instrumentacion = BaseManejadorPedido.instrumentacion
+        if instrumentacion is None:
+            return self.ejecutar_etapa(pedido)
+        inicio = time.perf_counter()
+        try:
+            return self.ejecutar_etapa(pedido)
+        finally:
+            instrumentacion.registrar_etapa(self.__class__.__name__, pedido, time.perf_counter() - inicio)
 
-    # El método procesar_pedido(self, pedido: Pedido) es abstracto y debe ser implementado
-    # por las subclases concretas.
+    @abc.abstractmethod
+    def ejecutar_etapa(self, pedido: Pedido) -> bool:
+        """Lógica de negocio del manejador. Retorna True si el pedido debe continuar en la cadena."""
+        pass
+
+    async def ejecutar_etapa_async(self, pedido: Pedido) -> bool:
+        """Etapa para EjecutorCadenaPlano.procesar_pedido_async. Las etapas que esperan E/S
+        (el pago) la redefinen para no bloquear; el resto ejecuta la versión síncrona."""
+        return self.ejecutar_etapa(pedido)
+
+    async def _ejecutar_etapa_medida_async(self, pedido: Pedido) -> bool:
+        instrumentacion = BaseManejadorPedido.instrumentacion
+        if instrumentacion is None:
+            return await self.ejecutar_etapa_async(pedido)
+        inicio = time.perf_counter()
+        try:
+            return await self.ejecutar_etapa_async(pedido)
+        finally:
+            instrumentacion.registrar_etapa(self.__class__.__name__, pedido, time.perf_counter() - inicio)
+
+    # Las subclases concretas implementan ejecutar_etapa(); el recorrido de la cadena
+    # lo hace procesar_pedido() (recursivo) o EjecutorCadenaPlano (iterativo).
+
+
+# --- Ejecución Plana (Iterativa) de la Cadena ---
+# Recorre los manejadores ya enlazados una sola vez y los guarda como una tupla de
+# etapas. Procesar un pedido es un bucle con una sola verificación de fallo por etapa,
+# sin la pila de llamadas recursivas. Los estados finales del Pedido son los mismos
+# que con procesar_pedido() recursivo.
+
+class EjecutorCadenaPlano:
+    def __init__(self, primer_manejador: BaseManejadorPedido):
+        manejadores = []
+        manejador = primer_manejador
+        while manejador is not None:
+            manejadores.append(manejador)
+            manejador = manejador._siguiente_manejador
+        self.manejadores = tuple(manejadores)
+        self._etapas = tuple(m.ejecutar_etapa for m in manejadores)
+        self.maquina = maquina_de_cadena(primer_manejador)
+
+    def procesar_pedido(self, pedido: Pedido):
+        pedido.maquina = self.maquina
+        fallido = EstadoPedido.FALLIDO
+        if BaseManejadorPedido.instrumentacion is None:
+            for etapa in self._etapas:
+                if pedido.estado is fallido or not etapa(pedido):
+                    break
+        else:
+            for manejador in self.manejadores:
+                if pedido.estado is fallido or not manejador._ejecutar_etapa_medida(pedido):
+                    break
+
+    async def procesar_pedido_async(self, pedido: Pedido):
+        """Mismo recorrido, esperando sin bloquear las etapas asíncronas (el pago). Se ejecuta
+        en el event loop de la pasarela: el hilo que hizo la solicitud queda libre."""
+        pedido.maquina = self.maquina
+        fallido = EstadoPedido.FALLIDO
+        for manejador in self.manejadores:
+            if pedido.estado is fallido or not await manejador._ejecutar_etapa_medida_async(pedido):
+                break
 
 
 # --- Manejadores Concretos (Lógica de Negocio) ---
 
 class ManejadorValidacionStock(BaseManejadorPedido):
-    def procesar_pedido(self, pedido: Pedido):
-        if pedido.estado == EstadoPedido.FALLIDO:
-            logger.warning(f"ManejadorValidacionStock: Saltando procesamiento para pedido {pedido.id} (ya falló).")
-            return
+    etapa_preparacion = EventoPedido.VALIDAR
 
-        pedido.set_estado(EstadoPedido.VALIDANDO)
-        logger.info(f"ManejadorValidacionStock: Validando stock y asientos para pedido {pedido.id}")
+    def ejecutar_etapa(self, pedido: Pedido) -> bool:
+        pedido.disparar(EventoPedido.VALIDAR)
+        logger.info("ManejadorValidacionStock: Validando stock y asientos para pedido %s", pedido.id)
 
         # --- Lógica de validación real ---
         stock_suficiente = True # <<-- Aquí va la lógica real de consulta a BD/inventario
@@ -168,153 +310,179 @@ class ManejadorValidacionStock(BaseManejadorPedido):
         # --- Fin Lógica ---
 
         if stock_suficiente:
-            logger.info(f"ManejadorValidacionStock: Validación de stock/asientos exitosa para pedido {pedido.id}")
+            logger.info("ManejadorValidacionStock: Validación de stock/asientos exitosa para pedido %s", pedido.id)
             # Pasa al siguiente solo si es exitoso
-            self._pasar_al_siguiente(pedido)
-        else:
-            pedido.set_error("Stock o asientos insuficientes.")
-            # No llama a _pasar_al_siguiente(), la cadena se detiene aquí
+            return True
+        pedido.set_error("Stock o asientos insuficientes.")
+        # La cadena se detiene aquí
+        return False
 
 
 class ManejadorCalculoPreciosYImpuestos(BaseManejadorPedido):
-     def procesar_pedido(self, pedido: Pedido):
-        if pedido.estado == EstadoPedido.FALLIDO:
-            logger.warning(f"ManejadorCalculoPreciosYImpuestos: Saltando procesamiento para pedido {pedido.id} (ya falló).")
-            return
-
-        pedido.set_estado(EstadoPedido.CALCULANDO_PRECIOS) # Nuevo estado
-        logger.info(f"ManejadorCalculoPreciosYImpuestos: Calculando precios base e impuestos para pedido {pedido.id}")
-
-        # --- Lógica de cálculo de precios e impuestos ---
-        # Calcular subtotal base (antes de descuentos)
-        subtotal_boletas = sum(item.precio for item in pedido.items_boletas) if pedido.items_boletas else 0.0 # Asume que ItemBoleta tiene atributo precio
-        subtotal_confiteria = sum(item.precio * item.cantidad for item in pedido.items_confiteria) if pedido.items_confiteria else 0.0 # Asume que ItemConfiteria tiene precio y cantidad
-
-        pedido.subtotal = subtotal_boletas + subtotal_confiteria
-
-        # Calcular impuestos sobre el subtotal (o sobre subtotal - descuentos, dependiendo de la regla)
-        # Si los impuestos se aplican después de descuentos, esta lógica podría ir en un manejador posterior.
-        # Para este ejemplo, calculamos impuestos sobre el subtotal inicial.
-        porcentaje_impuestos = 0.19 # Ejemplo: 19%
-        pedido.impuestos = pedido.subtotal * porcentaje_impuestos
-
+     etapa_preparacion = EventoPedido.CALCULAR_PRECIOS
+
+     def __init__(self, motor_precios: MotorPrecios = None):
+        # Precios por zona e impuestos por categoría, en centavos enteros (ver models/precios.py)
+        self._motor_precios = motor_precios or MotorPrecios()
+
+     def ejecutar_etapa(self, pedido: Pedido) -> bool:
+        pedido.disparar(EventoPedido.CALCULAR_PRECIOS) # Nuevo estado
+        logger.info("ManejadorCalculoPreciosYImpuestos: Calculando precios base e impuestos para pedido %s", pedido.id)
+        self._aplicar_cotizacion(pedido, self._motor_precios.cotizar(pedido))
+        return True # Siempre pasa al siguiente
+
+     def ejecutar_etapa_lote(self, pedidos: List[Pedido]) -> List[bool]:
+        """Misma etapa para muchos pedidos, cotizados juntos (ver MotorPrecios.cotizar_lote).
+        Se cotiza antes de cambiar de estado: si la cotización falla, ningún pedido avanzó
+        y la etapa se puede repetir pedido por pedido (ver ProcesadorLotes)."""
+        cotizaciones = self._motor_precios.cotizar_lote(pedidos)
+        for pedido, cotizacion in zip(pedidos, cotizaciones):
+            pedido.disparar(EventoPedido.CALCULAR_PRECIOS)
+            self._aplicar_cotizacion(pedido, cotizacion)
+        return [True] * len(pedidos)
+
+     @staticmethod
+     def _aplicar_cotizacion(pedido: Pedido, cotizacion: Cotizacion):
+        # Los montos se calculan en centavos y se convierten una sola vez al final.
+        # Los impuestos se calculan sobre el subtotal inicial (antes de descuentos).
+        # Cada boleta guarda su precio cobrado, para que el pedido y su historial lo muestren
+        for item, precio in zip(pedido.items_boletas, cotizacion.precios_boletas):
+            item.precio = a_monto(precio)
+        pedido.subtotal = a_monto(cotizacion.subtotal)
+        pedido.impuestos = a_monto(cotizacion.impuestos)
         # El total inicial antes de descuentos aplicados por el siguiente manejador
-        pedido.total_final = pedido.subtotal + pedido.impuestos
-
-        logger.info(f"  Subtotal calculado: {pedido.subtotal:.2f}, Impuestos: {pedido.impuestos:.2f}. Total inicial: {pedido.total_final:.2f}")
-        # --- Fin Lógica ---
-
-        self._pasar_al_siguiente(pedido) # Siempre pasa al siguiente
+        pedido.total_final = a_monto(cotizacion.total)
+        logger.info("  Subtotal calculado: %.2f, Impuestos: %.2f. Total inicial: %.2f", pedido.subtotal, pedido.impuestos, pedido.total_final)
 
 
 class ManejadorAplicacionDescuentos(BaseManejadorPedido): # Colocado DESPUES del cálculo base de precios
-     def procesar_pedido(self, pedido: Pedido):
-        if pedido.estado == EstadoPedido.FALLIDO:
-            logger.warning(f"ManejadorAplicacionDescuentos: Saltando procesamiento para pedido {pedido.id} (ya falló).")
-            return
+     etapa_preparacion = EventoPedido.APLICAR_DESCUENTOS
 
-        pedido.set_estado(EstadoPedido.APLICANDO_DESCUENTOS) # Nuevo estado
-        logger.info(f"ManejadorAplicacionDescuentos: Aplicando descuentos para pedido {pedido.id}")
+     def __init__(self, motor_descuentos: MotorDescuentos = None, motor_precios: MotorPrecios = None):
+        # Cupones y descuentos automáticos definidos como datos (ver models/descuentos.py).
+        # Sin motor se usan REGLAS_POR_DEFECTO (cupón CINE20 y descuento por confitería).
+        self._motor_descuentos = motor_descuentos or MotorDescuentos.desde_definiciones(REGLAS_POR_DEFECTO)
+        # El mismo motor de precios que la etapa anterior, para descontar sobre precios por línea
+        self._motor_precios = motor_precios or MotorPrecios()
 
-        # --- Lógica de descuento real ---
-        descuento_calculado = 0.0
+     def ejecutar_etapa(self, pedido: Pedido) -> bool:
+        pedido.disparar(EventoPedido.APLICAR_DESCUENTOS) # Nuevo estado
+        logger.info("ManejadorAplicacionDescuentos: Aplicando descuentos para pedido %s", pedido.id)
 
-        if pedido.cupon_aplicado == "CINE20":
-            # Aplicar 20% sobre el subtotal ANTES de impuestos (si esa es la regla)
-            descuento_cupon = pedido.subtotal * 0.20
-            descuento_calculado += descuento_cupon
-            logger.info(f"  Aplicado cupón 'CINE20': {descuento_cupon:.2f} de descuento.")
+        descuento = self._motor_descuentos.aplicar(pedido, self._motor_precios.lineas(pedido))
 
-        # --- Otras reglas de descuento ---
-        # Ejemplo: descuento fijo si compra confitería
-        if len(pedido.items_confiteria) > 0:
-             descuento_confiteria = 2.0
-             descuento_calculado += descuento_confiteria
-             logger.info(f"  Aplicado descuento por confitería: {descuento_confiteria:.2f}.")
-        # --- Fin Lógica ---
+        pedido.descuento_aplicado = a_monto(descuento)
+        pedido.total_final = a_monto(a_centavos(pedido.total_final) - descuento) # Restar el descuento del total
 
-        pedido.descuento_aplicado = descuento_calculado
-        pedido.total_final -= descuento_calculado # Restar el descuento del total
-
-        if descuento_calculado > 0:
-             logger.info(f"  Total de descuentos aplicados: {pedido.descuento_aplicado:.2f}. Nuevo Total Final: {pedido.total_final:.2f}")
+        if descuento > 0:
+             logger.info("  Total de descuentos aplicados: %.2f. Nuevo Total Final: %.2f", pedido.descuento_aplicado, pedido.total_final)
         else:
-             logger.info(f"  No se aplicaron descuentos al pedido {pedido.id}. Total Final sin cambios: {pedido.total_final:.2f}")
+             logger.info("  No se aplicaron descuentos al pedido %s. Total Final sin cambios: %.2f", pedido.id, pedido.total_final)
 
 
-        self._pasar_al_siguiente(pedido) # Siempre pasa al siguiente
+        return True # Siempre pasa al siguiente
 
 
 class ManejadorProcesamientoPago(BaseManejadorPedido):
-    def procesar_pedido(self, pedido: Pedido):
-        if pedido.estado == EstadoPedido.FALLIDO:
-            logger.warning(f"ManejadorProcesamientoPago: Saltando procesamiento para pedido {pedido.id} (ya falló).")
-            return
+    def __init__(self, pasarela_pago: Any = None):
+        # Pasarela con procesar(metodo_pago, monto, referencia) y procesar_async(...) ->
+        # resultado con es_exitoso()/mensaje_error() (ver servicios/pasarela_pago.py).
+        # Sin pasarela se usa la simulación local ("Tarjeta rechazada" falla).
+        self._pasarela_pago = pasarela_pago
+
+    def ejecutar_etapa(self, pedido: Pedido) -> bool:
+        if not self._iniciar_pago(pedido):
+            return True
+        if self._pasarela_pago is None:
+            return self._simular_pago(pedido)
+        # Llamada a la pasarela de pago externa
+        try:
+            resultado_pago = self._pasarela_pago.procesar(pedido.metodo_pago, pedido.total_final, pedido.id)
+        except Exception as e:
+            return self._registrar_pago(pedido, False, f"Error de comunicación con pasarela: {e}")
+        registrado = self._registrar_pago(pedido, resultado_pago.es_exitoso(), resultado_pago.mensaje_error())
+        if registrado is None:
+            if resultado_pago.es_exitoso():
+                self._pasarela_pago.anular(resultado_pago.clave_idempotencia, pedido.id)
+            return False
+        return registrado
+
+    async def ejecutar_etapa_async(self, pedido: Pedido) -> bool:
+        """Igual que ejecutar_etapa, pero espera a la pasarela sin ocupar un hilo (procesar_async)"""
+        if not self._iniciar_pago(pedido):
+            return True
+        if self._pasarela_pago is None:
+            return self._simular_pago(pedido)
+        try:
+            resultado_pago = await self._pasarela_pago.procesar_async(pedido.metodo_pago, pedido.total_final, pedido.id)
+        except Exception as e:
+            return self._registrar_pago(pedido, False, f"Error de comunicación con pasarela: {e}")
+        registrado = self._registrar_pago(pedido, resultado_pago.es_exitoso(), resultado_pago.mensaje_error())
+        if registrado is None:
+            # Se canceló mientras se esperaba a la pasarela: el cobro aprobado se anula
+            if resultado_pago.es_exitoso():
+                await self._pasarela_pago.anular_o_conciliar(resultado_pago.clave_idempotencia, pedido.id)
+            return False
+        return registrado
 
+    @staticmethod
+    def _iniciar_pago(pedido: Pedido) -> bool:
+        """Pasa el pedido a PROCESANDO_PAGO. Retorna False si no hay nada que cobrar (ya quedó PAGADO)"""
         # Asegurarse de que el total final esté calculado ANTES de intentar pagar
         # Asumimos que ManejadorCalculoPreciosYImpuestos y ManejadorAplicacionDescuentos
         # ya se ejecutaron y actualizaron pedido.total_final.
 
         if pedido.total_final <= 0:
-             logger.warning(f"ManejadorProcesamientoPago: Pedido {pedido.id} tiene total_final <= 0 ({pedido.total_final:.2f}). Saltando procesamiento de pago real.")
+             logger.warning("ManejadorProcesamientoPago: Pedido %s tiene total_final <= 0 (%.2f). Saltando procesamiento de pago real.", pedido.id, pedido.total_final)
              # Si el total es 0 o menos, no hay pago externo que procesar.
              # Lo consideramos como si el pago hubiera sido exitoso (implícitamente).
-             pedido.set_estado(EstadoPedido.PAGADO)
-             self._pasar_al_siguiente(pedido) # Continuar la cadena (ej. para generación de entradas/inventario)
-             return
+             pedido.disparar(EventoPedido.CONFIRMAR_PAGO)
+             return False
 
+        pedido.disparar(EventoPedido.PROCESAR_PAGO)
+        logger.info("ManejadorProcesamientoPago: Procesando pago '%s' por %.2f para pedido %s", pedido.metodo_pago, pedido.total_final, pedido.id)
+        return True
 
-        pedido.set_estado(EstadoPedido.PROCESANDO_PAGO)
-        logger.info(f"ManejadorProcesamientoPago: Procesando pago '{pedido.metodo_pago}' por {pedido.total_final:.2f} para pedido {pedido.id}")
-
-        # --- Lógica de procesamiento de pago real ---
-        pago_exitoso = True
-        error_pago_detalle = None
-
-        # Simulación de fallo por método de pago o comunicación con pasarela
+    def _simular_pago(self, pedido: Pedido) -> bool:
+        # Simulación de fallo por método de pago
         if pedido.metodo_pago == "Tarjeta rechazada":
-            pago_exitoso = False
-            error_pago_detalle = "Simulación: Tarjeta rechazada."
-            logger.error(f"  Simulando pago fallido para pedido {pedido.id} con método '{pedido.metodo_pago}'.")
-        # <<-- Aquí iría la llamada REAL a la pasarela de pago externa
-        # else:
-        #     try:
-        #        resultado_pago = pasarela_pago.procesar(pedido.metodo_pago, pedido.total_final)
-        #        if not resultado_pago.es_exitoso():
-        #           pago_exitoso = False
-        #           error_pago_detalle = resultado_pago.mensaje_error()
-        #     except Exception as e:
-        #        pago_exitoso = False
-        #        error_pago_detalle = f"Error de comunicación con pasarela: {e}"
-
-        # --- Fin Lógica ---
-
-        if pago_exitoso:
-            pedido.set_estado(EstadoPedido.PAGADO)
-            self._pasar_al_siguiente(pedido) # Pasa al siguiente solo si el pago fue exitoso
-        else:
-            # Construir el mensaje de error de forma segura
-            error_message = "Pago rechazado o fallido."
-            if error_pago_detalle:
-                 error_message += f" Detalle: {error_pago_detalle}"
+            logger.error("  Simulando pago fallido para pedido %s con método '%s'.", pedido.id, pedido.metodo_pago)
+            return self._registrar_pago(pedido, False, "Simulación: Tarjeta rechazada.")
+        return self._registrar_pago(pedido, True, None)
+
+    @staticmethod
+    def _registrar_pago(pedido: Pedido, pago_exitoso: bool, error_pago_detalle: str) -> Optional[bool]:
+        """Confirma o falla el pago. Retorna None si el pedido dejó PROCESANDO_PAGO mientras
+        se cobraba (p. ej. /cancel_order desde otro hilo): el llamador anula el cobro"""
+        # Construir el mensaje de error de forma segura
+        error_message = "Pago rechazado o fallido."
+        if error_pago_detalle:
+             error_message += f" Detalle: {error_pago_detalle}"
+        try:
+            if pago_exitoso:
+                pedido.disparar(EventoPedido.CONFIRMAR_PAGO)
+                return True # Pasa al siguiente solo si el pago fue exitoso
             pedido.set_error(error_message)
-            # No llama a _pasar_al_siguiente() si el pago falló
+        except TransicionInvalida as e:
+            logger.warning("ManejadorProcesamientoPago: Pedido %s pasó a %s durante el pago.", pedido.id, e.estado.value)
+            return None
+        # La cadena se detiene si el pago falló
+        return False
 
 
 class ManejadorGeneracionEntradas(BaseManejadorPedido):
-    def procesar_pedido(self, pedido: Pedido):
-        # Solo procesar si el estado es PAGADO
+    def ejecutar_etapa(self, pedido: Pedido) -> bool:
+        # Solo procesar si el estado es PAGADO (un pedido FALLIDO nunca llega hasta aquí)
         if pedido.estado != EstadoPedido.PAGADO:
-            if pedido.estado != EstadoPedido.FALLIDO:
-                 logger.warning(f"ManejadorGeneracionEntradas: Saltando generación de entradas para pedido {pedido.id} (estado no es PAGADO). Estado actual: {pedido.estado.value}")
-            return # No procesar si no está en el estado correcto o si ya falló
+            logger.warning("ManejadorGeneracionEntradas: Saltando generación de entradas para pedido %s (estado no es PAGADO). Estado actual: %s", pedido.id, pedido.estado.value)
+            return False # No procesar si no está en el estado correcto
 
-        logger.info(f"ManejadorGeneracionEntradas: Generando entradas para pedido {pedido.id}")
+        logger.info("ManejadorGeneracionEntradas: Generando entradas para pedido %s", pedido.id)
 
         # --- Lógica de generación real ---
         tiene_boletas = len(pedido.items_boletas) > 0
         if tiene_boletas:
-            logger.info(f"  Generando códigos/tickets para {len(pedido.items_boletas)} boletas.")
+            logger.info("  Generando códigos/tickets para %s boletas.", len(pedido.items_boletas))
             # <<-- Aquí iría la lógica para crear códigos únicos, guardar en BD, asociar al usuario/pedido
         else:
              logger.info("  No hay boletas en este pedido, saltando generación específica de entradas.")
@@ -322,25 +490,23 @@ class ManejadorGeneracionEntradas(BaseManejadorPedido):
 
         # Asumimos que la generación siempre es exitosa si llegamos a este punto con estado PAGADO.
         # Si la generación pudiera fallar, deberíamos manejar ese error aquí y llamar a pedido.set_error().
-        self._pasar_al_siguiente(pedido)
+        return True
 
 
 class ManejadorActualizacionInventario(BaseManejadorPedido):
-    def procesar_pedido(self, pedido: Pedido):
+    def ejecutar_etapa(self, pedido: Pedido) -> bool:
         # Solo actualizar si se pagó.
         if pedido.estado != EstadoPedido.PAGADO:
-             # Si llegó aquí y no está PAGADO, es que falló un manejador anterior,
-             # o hubo un error de flujo. Simplemente no hacemos la actualización exitosa.
-             if pedido.estado != EstadoPedido.FALLIDO:
-                logger.warning(f"ManejadorActualizacionInventario: Saltando actualización de inventario para pedido {pedido.id} (estado no es PAGADO). Estado actual: {pedido.estado.value}")
-             # Si el pedido ya falló, simplemente salimos.
-             return
+             # Si llegó aquí y no está PAGADO, hubo un error de flujo
+             # (un pedido FALLIDO nunca llega hasta aquí). No hacemos la actualización exitosa.
+             logger.warning("ManejadorActualizacionInventario: Saltando actualización de inventario para pedido %s (estado no es PAGADO). Estado actual: %s", pedido.id, pedido.estado.value)
+             return False
 
-        logger.info(f"ManejadorActualizacionInventario: Actualizando inventario y asientos para pedido {pedido.id}")
+        logger.info("ManejadorActualizacionInventario: Actualizando inventario y asientos para pedido %s", pedido.id)
 
         # --- Lógica de actualización real ---
-        logger.info(f"  Descontando items de confitería: {len(pedido.items_confiteria)} items.")
-        logger.info(f"  Marcando asientos como vendidos: {len(pedido.items_boletas)} asientos.")
+        logger.info("  Descontando items de confitería: %s items.", len(pedido.items_confiteria))
+        logger.info("  Marcando asientos como vendidos: %s asientos.", len(pedido.items_boletas))
         # <<-- Aquí iría la interacción con los sistemas de inventario y gestión de asientos
         # --- Fin Lógica ---
 
@@ -352,13 +518,13 @@ class ManejadorActualizacionInventario(BaseManejadorPedido):
         # Si llegamos aquí y el estado es PAGADO, significa que todos los pasos
         # anteriores fueron exitosos. Ahora marcamos como COMPLETO.
         if pedido.estado == EstadoPedido.PAGADO:
-             pedido.set_estado(EstadoPedido.COMPLETADO)
-             logger.info(f"Pedido {pedido.id}: Procesamiento COMPLETO y exitoso.")
+             pedido.disparar(EventoPedido.COMPLETAR)
+             logger.info("Pedido %s: Procesamiento COMPLETO y exitoso.", pedido.id)
 
 
-        # Aunque es el último, llamamos a pasar_al_siguiente para mantener la uniformidad.
+        # Aunque es el último, retornamos True para mantener la uniformidad.
         # El método base verificará que no hay siguiente y registrará el fin.
-        self._pasar_al_siguiente(pedido)
+        return True
 
 
 # --- Nota sobre el Cliente/Orquestación ---
@@ -0,0 +1,244 @@
+# models/descuentos.py
+
+import csv
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models.precios import CATEGORIA_BOLETA, a_centavos
+from models.registro_funciones import normalizar_horario
+
+logger = logging.getLogger(__name__)
+
+# Tipos de regla
+TIPO_PORCENTAJE = "porcentaje"  # valor: porcentaje del subtotal base (20 = 20 %)
+TIPO_FIJO = "fijo"              # valor: monto fijo en unidades de moneda
+TIPO_2X1 = "2x1"                # por cada dos unidades de la categoría, la más barata es gratis
+TIPOS_REGLA = (TIPO_PORCENTAJE, TIPO_FIJO, TIPO_2X1)
+
+# Reglas equivalentes a los descuentos que estaban fijos en ManejadorAplicacionDescuentos
+REGLAS_POR_DEFECTO = [
+    {"codigo": "CINE20", "tipo": TIPO_PORCENTAJE, "valor": 20},
+    {"nombre": "descuento-confiteria", "tipo": TIPO_FIJO, "valor": 2.0, "categoria": "confiteria", "minimo_items": 1},
+]
+
+
+class ContadorUsos:
+    """Usos de una regla con tope. tomar() y devolver() son atómicos."""
+
+    def __init__(self, maximo: int, usados: int = 0, regla: str = None):
+        self.maximo = maximo
+        self.usados = usados
+        self.regla = regla  # Nombre de la regla: identifica sus usos guardados con las ventas
+        self._lock = threading.Lock()
+
+    def tomar(self) -> bool:
+        with self._lock:
+            if self.usados >= self.maximo:
+                return False
+            self.usados += 1
+            return True
+
+    def devolver(self):
+        with self._lock:
+            if self.usados > 0:
+                self.usados -= 1
+
+    def sumar(self, usos: int):
+        with self._lock:
+            self.usados += usos
+
+
+class ReglaDescuento:
+    """Regla compilada: las condiciones de la definición se convierten una sola vez en
+    una lista de predicados; solo se incluyen los de las condiciones presentes."""
+
+    def __init__(self, nombre: str, codigo: Optional[str], tipo: str, valor, categoria: Optional[str] = None,
+                 salas: List[str] = None, horarios: List[str] = None, minimo_items: int = 0,
+                 usos_maximos: int = None, usados: int = 0, desde: datetime = None, hasta: datetime = None):
+        if tipo not in TIPOS_REGLA:
+            raise ValueError(f"tipo desconocido '{tipo}'")
+        self.nombre = nombre
+        self.codigo = codigo or None
+        self.tipo = tipo
+        self.categoria = categoria or (CATEGORIA_BOLETA if tipo == TIPO_2X1 else None)
+        self.salas = frozenset(salas or ())
+        # Misma forma que la clave de la función (ver models/registro_funciones.py)
+        self.horarios = frozenset(normalizar_horario(horario) for horario in horarios or ())
+        # Porcentaje en puntos básicos y monto fijo en centavos, como en models/precios.py
+        try:
+            self._valor = round(float(valor) * 100) if tipo == TIPO_PORCENTAJE else (
+                a_centavos(valor) if tipo == TIPO_FIJO else 0)
+        except ArithmeticError:  # decimal.InvalidOperation
+            raise ValueError(f"valor inválido '{valor}'") from None
+        self.contador = ContadorUsos(int(usos_maximos), int(usados), nombre) if usos_maximos is not None else None
+
+        predicados: List[Callable[[tuple, Dict[str, int], datetime], bool]] = []
+        if desde is not None:
+            predicados.append(lambda funcion, cantidades, ahora: ahora >= desde)
+        if hasta is not None:
+            predicados.append(lambda funcion, cantidades, ahora: ahora <= hasta)
+        if self.salas:
+            predicados.append(lambda funcion, cantidades, ahora: funcion[0] in self.salas)
+        if self.horarios:
+            predicados.append(lambda funcion, cantidades, ahora: funcion[1] in self.horarios)
+        if minimo_items:
+            if self.categoria:
+                predicados.append(lambda funcion, cantidades, ahora:
+                                  cantidades.get(self.categoria, 0) >= minimo_items)
+            else:
+                predicados.append(lambda funcion, cantidades, ahora:
+                                  sum(cantidades.values()) >= minimo_items)
+        self._predicados = tuple(predicados)
+
+    def aplica(self, funcion: tuple, cantidades: Dict[str, int], ahora: datetime) -> bool:
+        return all(predicado(funcion, cantidades, ahora) for predicado in self._predicados)
+
+    def calcular(self, lineas: List[Tuple[str, int, int]], subtotales: Dict[str, int]) -> int:
+        """Descuento en centavos sobre las líneas (categoría, precio unitario, cantidad) del pedido"""
+        base = subtotales.get(self.categoria, 0) if self.categoria else sum(subtotales.values())
+        if self.tipo == TIPO_PORCENTAJE:
+            return (base * self._valor + 5000) // 10000
+        if self.tipo == TIPO_FIJO:
+            return min(self._valor, base)
+        unidades = sorted((precio for categoria, precio, cantidad in lineas if categoria == self.categoria
+                           for _ in range(cantidad)), reverse=True)
+        return sum(unidades[1::2])
+
+    @classmethod
+    def desde_definicion(cls, definicion: dict, posicion: int = 0) -> "ReglaDescuento":
+        nombre = definicion.get("nombre") or definicion.get("codigo") or f"regla-{posicion}"
+        try:
+            return cls(
+                nombre=nombre,
+                codigo=definicion.get("codigo") or None,
+                tipo=definicion["tipo"],
+                valor=definicion.get("valor", 0),
+                categoria=definicion.get("categoria") or None,
+                salas=_lista(definicion.get("salas")),
+                horarios=_lista(definicion.get("horarios")),
+                minimo_items=int(definicion.get("minimo_items") or 0),
+                usos_maximos=definicion.get("usos_maximos") if definicion.get("usos_maximos") not in ("", None) else None,
+                usados=int(definicion.get("usados") or 0),
+                desde=_fecha(definicion.get("desde")),
+                hasta=_fecha(definicion.get("hasta")),
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Regla de descuento '{nombre}' inválida: {e}") from e
+
+
+def _lista(valor) -> List[str]:
+    if not valor:
+        return []
+    if isinstance(valor, str):
+        return [parte.strip() for parte in valor.replace(";", ",").split(",") if parte.strip()]
+    return [str(elemento) for elemento in valor]
+
+
+def _fecha(valor) -> Optional[datetime]:
+    return datetime.fromisoformat(valor) if valor else None
+
+
+class MotorDescuentos:
+    """Evalúa cupones y descuentos automáticos definidos como datos.
+
+    Las reglas se indexan al cargarlas: las que tienen código en un diccionario por
+    código (exacto, distingue mayúsculas) y las automáticas por (sala, horario), donde
+    None significa "cualquiera".
+    Para un pedido solo se evalúan las reglas de su cupón y las automáticas de su
+    función, no todas las reglas cargadas. Los descuentos de varias reglas se suman,
+    sin superar el subtotal.
+    """
+
+    def __init__(self, reglas: List[ReglaDescuento] = None):
+        self._por_codigo: Dict[str, List[ReglaDescuento]] = {}
+        self._automaticas: Dict[Tuple[Optional[str], Optional[str]], List[ReglaDescuento]] = {}
+        for regla in reglas or []:
+            if regla.codigo:
+                self._por_codigo.setdefault(regla.codigo, []).append(regla)
+            else:
+                for sala in regla.salas or (None,):
+                    for horario in regla.horarios or (None,):
+                        self._automaticas.setdefault((sala, horario), []).append(regla)
+        self.reglas = list(reglas or [])
+
+    @classmethod
+    def desde_definiciones(cls, definiciones: List[dict]) -> "MotorDescuentos":
+        return cls([ReglaDescuento.desde_definicion(definicion, posicion)
+                    for posicion, definicion in enumerate(definiciones)])
+
+    def restaurar_usos(self, usos: Dict[str, int]):
+        """Suma a cada regla con tope los usos guardados con ventas anteriores (por nombre de regla)"""
+        for regla in self.reglas:
+            if regla.contador is not None and usos.get(regla.nombre):
+                regla.contador.sumar(usos[regla.nombre])
+
+    def candidatas(self, codigo: Optional[str], funcion: tuple) -> List[ReglaDescuento]:
+        sala, horario = funcion
+        candidatas = list(self._por_codigo.get(codigo, ())) if codigo else []
+        for clave in dict.fromkeys([(sala, horario), (sala, None), (None, horario), (None, None)]):
+            candidatas.extend(self._automaticas.get(clave, ()))
+        return candidatas
+
+    def aplicar(self, pedido, lineas: List[Tuple[str, int, int]], ahora: datetime = None) -> int:
+        """Calcula el descuento del pedido en centavos y toma un uso de cada regla con tope
+        que se aplique. Los usos tomados quedan en `pedido.canjes_descuento` para
+        devolverlos si el pedido no se completa (ver devolver_canjes)."""
+        ahora = ahora or datetime.now()
+        funcion = pedido.funcion or (None, None)
+        subtotales: Dict[str, int] = {}
+        cantidades: Dict[str, int] = {}
+        for categoria, precio, cantidad in lineas:
+            subtotales[categoria] = subtotales.get(categoria, 0) + precio * cantidad
+            cantidades[categoria] = cantidades.get(categoria, 0) + cantidad
+        restante = sum(subtotales.values())
+
+        total = 0
+        for regla in self.candidatas(pedido.cupon_aplicado, funcion):
+            if restante <= 0:
+                break
+            if not regla.aplica(funcion, cantidades, ahora):
+                continue
+            descuento = min(regla.calcular(lineas, subtotales), restante)
+            if descuento <= 0:
+                continue
+            if regla.contador is not None:
+                if not regla.contador.tomar():
+                    logger.info("  Regla '%s' agotada: no se aplica al pedido %s.", regla.nombre, pedido.id)
+                    continue
+                pedido.canjes_descuento += (regla.contador,)
+            total += descuento
+            restante -= descuento
+            logger.info("  Aplicada regla '%s': %.2f de descuento.", regla.nombre, descuento / 100)
+        return total
+
+
+def reglas_canjeadas(pedido) -> List[str]:
+    """Nombres de las reglas con tope usadas por el pedido (se guardan con la venta)"""
+    return [contador.regla for contador in pedido.canjes_descuento if contador.regla]
+
+
+def devolver_canjes(pedido):
+    """Devuelve los usos de cupón tomados por un pedido que no se completó (o que se
+    reembolsó porque su reserva se perdió durante el pago)"""
+    canjes, pedido.canjes_descuento = pedido.canjes_descuento, ()
+    for contador in canjes:
+        contador.devolver()
+
+
+def cargar_reglas(ruta: str) -> MotorDescuentos:
+    """Carga las reglas desde un archivo JSON (lista de definiciones) o CSV (una por fila,
+    listas de salas/horarios separadas con ';'). Lanza ValueError si una regla es inválida.
+    Los usos guardados con ventas anteriores se suman después con restaurar_usos()."""
+    with open(ruta, encoding="utf-8") as archivo:
+        if os.path.splitext(ruta)[1].lower() == ".csv":
+            definiciones = [{clave: valor for clave, valor in fila.items() if valor not in ("", None)}
+                            for fila in csv.DictReader(archivo)]
+        else:
+            definiciones = json.load(archivo)
+    motor = MotorDescuentos.desde_definiciones(definiciones)
+    logger.info("Reglas de descuento cargadas de %s: %d", ruta, len(motor.reglas))
+    return motor
@@ -1,5 +1,12 @@
+import heapq
+import itertools
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Iterator, Optional
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import Callable, Dict, List, Iterator, Optional, Set, Tuple
+
+from models.bitset_asientos import MapaBitsAsientos
 
 class AsientoIterator(ABC):
     """Interfaz Iterator para recorrer asientos"""
@@ -19,14 +26,32 @@ class AsientoIterator(ABC):
         """Reinicia el iterator a su posición inicial"""
         pass
 
+# Contador compartido por todos los inventarios: un inventario expulsado y creado de nuevo
+# para la misma función nunca repite una versión (las cachés usan (función, versión) como clave)
+_CONTADOR_VERSIONES = itertools.count(1)
+
 class AsientosCollection:
     """Colección concreta de asientos que permite diferentes tipos de iteración"""
     
-    def __init__(self, filas: List[str] = None, asientos_por_fila: int = 10):
+    def __init__(self, filas: List[str] = None, asientos_por_fila: int = 10,
+                 reloj: Callable[[], float] = time.monotonic):
         self._filas = filas or ["A", "B", "C"]
         self._asientos_por_fila = asientos_por_fila
-        self._asientos_ocupados: List[str] = []
-        self._asientos_vendidos: List[str] = []  # Nueva lista para asientos ya vendidos
+        # Estados guardados como bitsets por fila: consultas y marcas en O(1)
+        self._ocupados = MapaBitsAsientos(self._filas, asientos_por_fila)
+        self._vendidos = MapaBitsAsientos(self._filas, asientos_por_fila)
+        self._todos_los_asientos: List[str] = None
+        # Retenciones temporales: asiento -> (sesión dueña, vencimiento). Los vencimientos
+        # se ordenan en un heap por fila; las entradas obsoletas se descartan al salir del heap.
+        self._reloj = reloj
+        self._retenciones: Dict[str, Tuple[str, float]] = {}
+        self._retenciones_por_sesion: Dict[str, Set[str]] = {}
+        self._vencimientos: List[List[Tuple[float, str, str]]] = [[] for _ in self._filas]
+        # Hook opcional llamado como observador(accion, asientos) con accion en
+        # OCUPAR, LIBERAR, VENDER o DEVOLVER (p. ej. para un diario de eventos)
+        self.observador: Optional[Callable[[str, List[str]], None]] = None
+        # Versión del mapa de asientos: cambia con cada cambio visible (ver version)
+        self._version = 0
     
     def crear_iterator_por_fila(self) -> 'AsientoPorFilaIterator':
         """Crea un iterator que recorre los asientos fila por fila"""
@@ -36,35 +61,241 @@ class AsientosCollection:
         """Crea un iterator que recorre los asientos columna por columna"""
         return AsientoPorColumnaIterator(self)
     
+    def listar_asientos(self) -> List[str]:
+        """Retorna todos los asientos de la sala en orden de fila (se calcula una vez)"""
+        if self._todos_los_asientos is None:
+            asientos = []
+            iterator = self.crear_iterator_por_fila()
+            while iterator.has_next():
+                asientos.append(iterator.next())
+            self._todos_los_asientos = asientos
+        return self._todos_los_asientos
+    
+    # --- Bloqueos (sin efecto aquí; AsientosCollectionConcurrente los implementa por fila) ---
+    
+    def _bloquear_filas(self, indices_filas):
+        """Contexto que bloquea las filas indicadas"""
+        return nullcontext()
+    
+    def _bloquear_sesiones(self):
+        """Contexto que protege el índice de retenciones por sesión"""
+        return nullcontext()
+    
+    def _fila_de(self, asiento_id: str) -> Optional[int]:
+        posicion = self._ocupados.posicion(asiento_id)
+        return posicion[0] if posicion else None
+    
+    def _filas_de(self, asientos: List[str]) -> List[int]:
+        return sorted({indice for indice in map(self._fila_de, asientos) if indice is not None})
+    
+    def _notificar(self, accion: str, asientos: List[str]):
+        # Se llama con las filas bloqueadas para que el orden de los eventos sea el de los cambios
+        if not asientos:
+            return
+        # next() es atómico: cada cambio obtiene un número distinto aunque ocurra en otra fila
+        self._version = next(_CONTADOR_VERSIONES)
+        if self.observador is not None:
+            self.observador(accion, list(asientos))
+    
+    # --- Estados ocupado / vendido ---
+    
     def marcar_asiento_ocupado(self, asiento_id: str):
         """Marca un asiento como ocupado"""
-        if asiento_id not in self._asientos_ocupados:
-            self._asientos_ocupados.append(asiento_id)
+        with self._bloquear_filas(self._filas_de([asiento_id])):
+            if self._ocupados.marcar(asiento_id):
+                self._notificar("OCUPAR", [asiento_id])
     
     def desmarcar_asiento_ocupado(self, asiento_id: str):
         """Desmarca un asiento ocupado"""
-        if asiento_id in self._asientos_ocupados:
-            self._asientos_ocupados.remove(asiento_id)
+        with self._bloquear_filas(self._filas_de([asiento_id])):
+            self._quitar_retencion(asiento_id)
+            if self._ocupados.desmarcar(asiento_id):
+                self._notificar("LIBERAR", [asiento_id])
     
     def esta_ocupado(self, asiento_id: str) -> bool:
         """Verifica si un asiento está ocupado"""
-        return asiento_id in self._asientos_ocupados
+        self.liberar_retenciones_expiradas()
+        return self._ocupados.contiene(asiento_id)
     
     def marcar_asiento_vendido(self, asiento_id: str):
         """Marca un asiento como vendido permanentemente"""
-        if asiento_id in self._asientos_ocupados:
-            self._asientos_ocupados.remove(asiento_id)
-        self._asientos_vendidos.append(asiento_id)
+        with self._bloquear_filas(self._filas_de([asiento_id])):
+            self._quitar_retencion(asiento_id)
+            self._ocupados.desmarcar(asiento_id)
+            if self._vendidos.marcar(asiento_id):
+                self._notificar("VENDER", [asiento_id])
     
     def desmarcar_asientos_vendidos(self, asientos: List[str]):
         """Desmarca asientos vendidos (útil para reembolsos)"""
-        for asiento in asientos:
-            if asiento in self._asientos_vendidos:
-                self._asientos_vendidos.remove(asiento)
+        with self._bloquear_filas(self._filas_de(asientos)):
+            # Solo se notifican los que estaban vendidos: los demás no cambian de estado
+            devueltos = self._vendidos.marcados_en(self._vendidos.mascaras_de(asientos))
+            self._vendidos.limpiar_mascaras(devueltos)
+            self._notificar("DEVOLVER", self._vendidos.asientos_de(devueltos))
     
     def esta_vendido(self, asiento_id: str) -> bool:
         """Verifica si un asiento ya fue vendido"""
-        return asiento_id in self._asientos_vendidos
+        return self._vendidos.contiene(asiento_id)
+
+    def confirmar_venta_asientos(self, asientos: List[str]):
+        """Confirma la venta de múltiples asientos"""
+        with self._bloquear_filas(self._filas_de(asientos)):
+            mascaras = self._vendidos.mascaras_de(asientos)
+            nuevos = self._vendidos.sin_marcar_en(mascaras)
+            for asiento in asientos:
+                self._quitar_retencion(asiento)
+            self._ocupados.limpiar_mascaras(mascaras)
+            self._vendidos.aplicar_mascaras(nuevos)
+            # Solo se notifican los que no estaban vendidos: los demás no cambian de estado
+            self._notificar("VENDER", self._vendidos.asientos_de(nuevos))
+    
+    # --- Retenciones temporales (reserva mientras el cliente completa la compra) ---
+    
+    def retener_asiento(self, asiento_id: str, sesion_id: str, ttl_segundos: float) -> bool:
+        """Retiene el asiento para la sesión durante ttl_segundos.
+        
+        Si la sesión ya lo retenía, renueva el vencimiento. Retorna False si el
+        asiento no existe, está vendido o lo retiene otra sesión.
+        """
+        return self.reservar_asientos([asiento_id], sesion_id, ttl_segundos)
+    
+    def reservar_asientos(self, asientos: List[str], sesion_id: str, ttl_segundos: float) -> bool:
+        """Retiene todos los asientos para la sesión o ninguno (verificar y reservar atómico)"""
+        ahora = self._reloj()
+        self.liberar_retenciones_expiradas(ahora)
+        indices_filas = self._filas_de(asientos)
+        with self._bloquear_filas(indices_filas):
+            if not all(self._disponible_para(asiento_id, sesion_id) for asiento_id in asientos):
+                return False
+            # Renovar una retención propia no cambia el mapa: solo se notifican las nuevas
+            nuevos = [asiento_id for asiento_id in dict.fromkeys(asientos)
+                      if (self._retenciones.get(asiento_id) or (None,))[0] != sesion_id]
+            vencimiento = ahora + ttl_segundos
+            for asiento_id in asientos:
+                self._poner_retencion(asiento_id, sesion_id, vencimiento)
+            self._notificar("OCUPAR", nuevos)
+            return True
+    
+    def confirmar_venta_retenidos(self, asientos: List[str], sesion_id: str) -> bool:
+        """Vende los asientos solo si todos siguen retenidos por la sesión (todo o nada)"""
+        self.liberar_retenciones_expiradas()
+        with self._bloquear_filas(self._filas_de(asientos)):
+            for asiento_id in asientos:
+                retencion = self._retenciones.get(asiento_id)
+                if retencion is None or retencion[0] != sesion_id:
+                    return False
+            self.confirmar_venta_asientos(asientos)
+            return True
+    
+    def liberar_asiento(self, asiento_id: str, sesion_id: str) -> bool:
+        """Libera la retención del asiento si pertenece a la sesión"""
+        with self._bloquear_filas(self._filas_de([asiento_id])):
+            retencion = self._retenciones.get(asiento_id)
+            if retencion is None or retencion[0] != sesion_id:
+                return False
+            self._quitar_retencion(asiento_id)
+            self._ocupados.desmarcar(asiento_id)
+            self._notificar("LIBERAR", [asiento_id])
+            return True
+    
+    def liberar_retenciones_de(self, sesion_id: str) -> List[str]:
+        """Libera todas las retenciones de la sesión (p. ej. al cancelar o reiniciar la compra)"""
+        with self._bloquear_sesiones():
+            asientos = sorted(self._retenciones_por_sesion.get(sesion_id, ()))
+        return [asiento_id for asiento_id in asientos if self.liberar_asiento(asiento_id, sesion_id)]
+    
+    def liberar_retenciones_expiradas(self, ahora: float = None) -> List[str]:
+        """Libera las retenciones vencidas. Cuesta O(filas + vencidas · log n), no O(asientos)"""
+        ahora = self._reloj() if ahora is None else ahora
+        liberados = []
+        for indice_fila, vencimientos in enumerate(self._vencimientos):
+            # El tope del heap se mira con la fila bloqueada: otros hilos lo modifican
+            with self._bloquear_filas([indice_fila]):
+                if not vencimientos or vencimientos[0][0] > ahora:
+                    continue
+                liberados_fila = []
+                while vencimientos and vencimientos[0][0] <= ahora:
+                    vencimiento, asiento_id, sesion_id = heapq.heappop(vencimientos)
+                    # Solo cuenta si sigue siendo la retención vigente (no renovada ni liberada)
+                    if self._retenciones.get(asiento_id) == (sesion_id, vencimiento):
+                        self._quitar_retencion(asiento_id)
+                        self._ocupados.desmarcar(asiento_id)
+                        liberados_fila.append(asiento_id)
+                self._notificar("LIBERAR", liberados_fila)
+                liberados.extend(liberados_fila)
+        return liberados
+    
+    def retenido_por(self, asiento_id: str) -> Optional[str]:
+        """Sesión que retiene el asiento o None"""
+        self.liberar_retenciones_expiradas()
+        retencion = self._retenciones.get(asiento_id)
+        return retencion[0] if retencion else None
+    
+    def tiempo_restante_retencion(self, asiento_id: str) -> Optional[float]:
+        """Segundos que le quedan a la retención del asiento o None si no está retenido"""
+        ahora = self._reloj()
+        self.liberar_retenciones_expiradas(ahora)
+        retencion = self._retenciones.get(asiento_id)
+        return retencion[1] - ahora if retencion else None
+    
+    def retenciones_de(self, sesion_id: str) -> Dict[str, float]:
+        """Asientos retenidos por la sesión y los segundos que les quedan"""
+        ahora = self._reloj()
+        self.liberar_retenciones_expiradas(ahora)
+        with self._bloquear_sesiones():
+            asientos = list(self._retenciones_por_sesion.get(sesion_id, ()))
+        restantes = {}
+        for asiento_id in asientos:
+            retencion = self._retenciones.get(asiento_id)
+            if retencion is not None and retencion[0] == sesion_id:
+                restantes[asiento_id] = retencion[1] - ahora
+        return restantes
+    
+    @property
+    def version(self) -> int:
+        """Número que cambia cada vez que un asiento se ocupa, libera, vende o devuelve
+        (incluidas las retenciones vencidas). Sirve como clave de caché del mapa de asientos:
+        leerlo antes de consultar los asientos."""
+        self.liberar_retenciones_expiradas()
+        return self._version
+    
+    @property
+    def numero_retenciones(self) -> int:
+        return len(self._retenciones)
+    
+    @property
+    def esta_vacio(self) -> bool:
+        """True si no hay asientos vendidos, ocupados ni retenidos"""
+        self.liberar_retenciones_expiradas()
+        return not self._ocupados and not self._vendidos
+    
+    def _disponible_para(self, asiento_id: str, sesion_id: str) -> bool:
+        if self._ocupados.posicion(asiento_id) is None or self._vendidos.contiene(asiento_id):
+            return False
+        retencion = self._retenciones.get(asiento_id)
+        if retencion is not None:
+            return retencion[0] == sesion_id
+        return not self._ocupados.contiene(asiento_id)  # Ocupado sin retención (marcar_asiento_ocupado)
+    
+    def _poner_retencion(self, asiento_id: str, sesion_id: str, vencimiento: float):
+        # Requiere la fila del asiento bloqueada
+        self._retenciones[asiento_id] = (sesion_id, vencimiento)
+        with self._bloquear_sesiones():
+            self._retenciones_por_sesion.setdefault(sesion_id, set()).add(asiento_id)
+        heapq.heappush(self._vencimientos[self._fila_de(asiento_id)], (vencimiento, asiento_id, sesion_id))
+        self._ocupados.marcar(asiento_id)
+    
+    def _quitar_retencion(self, asiento_id: str):
+        # Requiere la fila del asiento bloqueada. La entrada del heap queda obsoleta
+        # y se descarta cuando sale.
+        retencion = self._retenciones.pop(asiento_id, None)
+        if retencion is not None:
+            with self._bloquear_sesiones():
+                asientos_sesion = self._retenciones_por_sesion.get(retencion[0])
+                if asientos_sesion is not None:
+                    asientos_sesion.discard(asiento_id)
+                    if not asientos_sesion:
+                        del self._retenciones_por_sesion[retencion[0]]
 
     @property
     def filas(self) -> List[str]:
@@ -76,16 +307,45 @@ class AsientosCollection:
     
     @property
     def asientos_ocupados(self) -> List[str]:
-        return self._asientos_ocupados.copy()
+        self.liberar_retenciones_expiradas()
+        return self._ocupados.listar()
     
     @property
     def asientos_vendidos(self) -> List[str]:
-        return self._asientos_vendidos.copy()
+        return self._vendidos.listar()
+    
+    @property
+    def cantidad_retenciones(self) -> int:
+        """Retenciones vigentes (las vencidas se liberan antes de contar)"""
+        self.liberar_retenciones_expiradas()
+        return len(self._retenciones)
 
-    def confirmar_venta_asientos(self, asientos: List[str]):
-        """Confirma la venta de múltiples asientos"""
-        for asiento in asientos:
-            self.marcar_asiento_vendido(asiento)
+
+class AsientosCollectionConcurrente(AsientosCollection):
+    """AsientosCollection segura para hilos con un lock por fila (lock striping).
+    
+    Las operaciones de un asiento bloquean solo su fila y las de varios asientos
+    bloquean sus filas en orden creciente (sin interbloqueos), así que compradores
+    en filas distintas no se esperan entre sí. El índice de retenciones por sesión
+    usa un lock propio de secciones muy cortas.
+    """
+    
+    def __init__(self, filas: List[str] = None, asientos_por_fila: int = 10,
+                 reloj: Callable[[], float] = time.monotonic):
+        super().__init__(filas, asientos_por_fila, reloj)
+        # RLock: una operación compuesta puede volver a bloquear una fila que ya tiene
+        self._locks_filas = [threading.RLock() for _ in self._filas]
+        self._lock_sesiones = threading.Lock()
+    
+    @contextmanager
+    def _bloquear_filas(self, indices_filas):
+        with ExitStack() as pila:
+            for indice_fila in indices_filas:  # ya vienen ordenados
+                pila.enter_context(self._locks_filas[indice_fila])
+            yield
+    
+    def _bloquear_sesiones(self):
+        return self._lock_sesiones
 
 class AsientoPorFilaIterator(AsientoIterator):
     """Iterator concreto que recorre asientos fila por fila"""
@@ -1,15 +1,108 @@
 # models/memento.py
 
-from typing import List, Any
+from typing import List, Any, Iterable, Iterator, Optional
+
+
+class _Nodo:
+    __slots__ = ("valor", "siguiente", "tamano")
+
+    def __init__(self, valor: str, siguiente: Optional["_Nodo"]):
+        self.valor = valor
+        self.siguiente = siguiente
+        self.tamano = 1 + (siguiente.tamano if siguiente else 0)
+
+
+class ConjuntoOrdenadoPersistente:
+    """Conjunto inmutable que conserva el orden de inserción.
+
+    Internamente es una lista enlazada con el elemento más reciente al inicio.
+    Agregar crea un solo nodo y comparte el resto; quitar copia solo los nodos
+    posteriores al elemento quitado (path copying). Así, versiones consecutivas
+    comparten casi toda su estructura y "copiar" el conjunto es copiar una referencia.
+    Pensado para conjuntos pequeños (una selección de asientos): la pertenencia es O(n).
+    """
+
+    __slots__ = ("_cabeza",)
+
+    def __init__(self, elementos: Iterable[str] = (), _cabeza: Optional[_Nodo] = None):
+        self._cabeza = _cabeza
+        for elemento in elementos:
+            if elemento not in self:
+                self._cabeza = _Nodo(elemento, self._cabeza)
+
+    def agregar(self, elemento: str) -> "ConjuntoOrdenadoPersistente":
+        """Retorna una versión con el elemento al final (o la misma si ya estaba)"""
+        if elemento in self:
+            return self
+        return ConjuntoOrdenadoPersistente(_cabeza=_Nodo(elemento, self._cabeza))
+
+    def quitar(self, elemento: str) -> "ConjuntoOrdenadoPersistente":
+        """Retorna una versión sin el elemento (o la misma si no estaba)"""
+        copiados = []
+        nodo = self._cabeza
+        while nodo is not None and nodo.valor != elemento:
+            copiados.append(nodo.valor)
+            nodo = nodo.siguiente
+        if nodo is None:
+            return self
+        # La cola a partir del elemento quitado se comparte sin copiar
+        cabeza = nodo.siguiente
+        for valor in reversed(copiados):
+            cabeza = _Nodo(valor, cabeza)
+        return ConjuntoOrdenadoPersistente(_cabeza=cabeza)
+
+    def a_lista(self) -> List[str]:
+        """Elementos en orden de inserción"""
+        elementos = []
+        nodo = self._cabeza
+        while nodo is not None:
+            elementos.append(nodo.valor)
+            nodo = nodo.siguiente
+        elementos.reverse()
+        return elementos
+
+    def __contains__(self, elemento: str) -> bool:
+        nodo = self._cabeza
+        while nodo is not None:
+            if nodo.valor == elemento:
+                return True
+            nodo = nodo.siguiente
+        return False
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.a_lista())
+
+    def __len__(self) -> int:
+        return self._cabeza.tamano if self._cabeza else 0
+
+    def __eq__(self, otro) -> bool:
+        if not isinstance(otro, ConjuntoOrdenadoPersistente):
+            return NotImplemented
+        return self._cabeza is otro._cabeza or self.a_lista() == otro.a_lista()
+
+    def __hash__(self) -> int:
+        return hash(tuple(self.a_lista()))
+
+    def __repr__(self) -> str:
+        return f"ConjuntoOrdenadoPersistente({self.a_lista()!r})"
 
 
 class MementoSeleccionAsientos:
-    def __init__(self, estado_asientos: List[str], estado_datos_adicionales: Any):
-        self._estado_asientos = list(estado_asientos)  # Copia defensiva
+    __slots__ = ("_estado_asientos", "_estado_datos_adicionales")
+
+    def __init__(self, estado_asientos: Iterable[str], estado_datos_adicionales: Any):
+        # El conjunto es inmutable: guardar la referencia basta como copia defensiva
+        # y los mementos consecutivos comparten su estructura.
+        if not isinstance(estado_asientos, ConjuntoOrdenadoPersistente):
+            estado_asientos = ConjuntoOrdenadoPersistente(estado_asientos)
+        self._estado_asientos = estado_asientos
         self._estado_datos_adicionales = estado_datos_adicionales
 
     # Métodos simulando visibilidad protegida (solo el originador debe usarlos)
     def _get_estado_asientos(self) -> List[str]:
+        return self._estado_asientos.a_lista()
+
+    def _get_conjunto_asientos(self) -> ConjuntoOrdenadoPersistente:
         return self._estado_asientos
 
     def _get_estado_datos_adicionales(self) -> Any:
@@ -18,20 +111,18 @@ class MementoSeleccionAsientos:
 
 class SeleccionAsientos:
     def __init__(self):
-        self._asientos_seleccionados: List[str] = []
+        self._asientos_seleccionados = ConjuntoOrdenadoPersistente()
         self._otros_datos_estado: dict = {}  # Ejemplo: {'precio': 10000, 'tarifa': 'normal'}
 
     def seleccionar_asiento(self, asiento_id: str):
-        if asiento_id not in self._asientos_seleccionados:
-            self._asientos_seleccionados.append(asiento_id)
+        self._asientos_seleccionados = self._asientos_seleccionados.agregar(asiento_id)
 
     def deseleccionar_asiento(self, asiento_id: str):
-        if asiento_id in self._asientos_seleccionados:
-            self._asientos_seleccionados.remove(asiento_id)
+        self._asientos_seleccionados = self._asientos_seleccionados.quitar(asiento_id)
 
     def confirmar_seleccion(self):
         # Aquí podría ir lógica para persistir la selección o procesar el pago
-        print(f"Selección confirmada: {self._asientos_seleccionados}")
+        print(f"Selección confirmada: {self._asientos_seleccionados.a_lista()}")
 
     def crear_memento(self) -> MementoSeleccionAsientos:
         return MementoSeleccionAsientos(
@@ -40,12 +131,13 @@ class SeleccionAsientos:
         )
 
     def restaurar_desde_memento(self, memento: MementoSeleccionAsientos):
-        self._asientos_seleccionados = list(memento._get_estado_asientos())
+        # Restaurar es cambiar la referencia: no se copia la selección
+        self._asientos_seleccionados = memento._get_conjunto_asientos()
         self._otros_datos_estado = memento._get_estado_datos_adicionales()
 
     def obtener_estado_actual(self) -> dict:
         return {
-            "asientos": self._asientos_seleccionados,
+            "asientos": self._asientos_seleccionados.a_lista(),
             "otros_datos": self._otros_datos_estado
         }
 
@@ -78,3 +170,109 @@ class GestorHistorialSeleccion:
     def limpiar_historial(self):
         self._historial_mementos.clear()
         self._redo_stack.clear()
+
+
+class GestorHistorialDeltas:
+    """Historial de deshacer/rehacer acotado que guarda operaciones en lugar de estados.
+
+    Cada estado se registra como la operación que lo produjo a partir del anterior
+    ('+' asiento agregado, '-' asiento quitado, '=' sin cambios). Cada
+    `intervalo_checkpoint` pasos, o cuando el cambio no es una sola operación, se
+    guarda el memento completo como punto de control. Al superar
+    `profundidad_maxima` estados se descartan los más antiguos.
+    Deshacer y rehacer se comportan igual que en GestorHistorialSeleccion.
+    """
+
+    def __init__(self, profundidad_maxima: int = 100, intervalo_checkpoint: int = 20):
+        if profundidad_maxima < 1 or intervalo_checkpoint < 1:
+            raise ValueError("profundidad_maxima e intervalo_checkpoint deben ser al menos 1")
+        self._profundidad_maxima = profundidad_maxima
+        self._intervalo_checkpoint = intervalo_checkpoint
+        self._base: MementoSeleccionAsientos | None = None  # estado más antiguo conservado
+        # _pasos[i] describe el estado i + 1: una operación (op, asiento) o un memento completo
+        self._pasos: list = []
+        self._cursor = -1  # índice del estado actual; -1 si el historial está vacío
+        self._actual: MementoSeleccionAsientos | None = None
+
+    def guardar(self, memento: MementoSeleccionAsientos):
+        if self._actual is None:
+            self._base = memento
+        else:
+            # Al guardar un nuevo estado, se pierde el camino de rehacer
+            del self._pasos[self._cursor:]
+            self._pasos.append(self._codificar_paso(self._actual, memento))
+            if len(self._pasos) >= self._profundidad_maxima:
+                self._expulsar_mas_antiguo()
+        self._cursor = len(self._pasos)
+        self._actual = memento
+
+    def deshacer(self) -> MementoSeleccionAsientos | None:
+        if self._cursor > 0:
+            self._cursor -= 1
+            self._actual = self._reconstruir(self._cursor)
+        return self._actual
+
+    def rehacer(self) -> MementoSeleccionAsientos | None:
+        if self._cursor < 0 or self._cursor >= len(self._pasos):
+            return None
+        self._actual = self._aplicar(self._actual, self._pasos[self._cursor])
+        self._cursor += 1
+        return self._actual
+
+    def limpiar_historial(self):
+        self._base = None
+        self._pasos.clear()
+        self._cursor = -1
+        self._actual = None
+
+    def __len__(self) -> int:
+        """Estados conservados (deshacer y rehacer)"""
+        return len(self._pasos) + 1 if self._base is not None else 0
+
+    def _codificar_paso(self, anterior: MementoSeleccionAsientos, nuevo: MementoSeleccionAsientos):
+        if (anterior._get_estado_datos_adicionales() is nuevo._get_estado_datos_adicionales()
+                and self._pasos_desde_checkpoint() < self._intervalo_checkpoint - 1):
+            asientos_anteriores = anterior._get_estado_asientos()
+            asientos_nuevos = nuevo._get_estado_asientos()
+            if asientos_nuevos == asientos_anteriores:
+                return ("=", None)
+            if asientos_nuevos[:-1] == asientos_anteriores:
+                return ("+", asientos_nuevos[-1])
+            if len(asientos_nuevos) == len(asientos_anteriores) - 1:
+                indice = next((i for i, (a, b) in enumerate(zip(asientos_anteriores, asientos_nuevos)) if a != b),
+                              len(asientos_nuevos))
+                if asientos_anteriores[:indice] + asientos_anteriores[indice + 1:] == asientos_nuevos:
+                    return ("-", asientos_anteriores[indice])
+        return nuevo
+
+    def _pasos_desde_checkpoint(self) -> int:
+        cantidad = 0
+        for paso in reversed(self._pasos):
+            if isinstance(paso, MementoSeleccionAsientos):
+                break
+            cantidad += 1
+        return cantidad
+
+    def _expulsar_mas_antiguo(self):
+        self._base = self._aplicar(self._base, self._pasos.pop(0))
+
+    @staticmethod
+    def _aplicar(memento: MementoSeleccionAsientos, paso) -> MementoSeleccionAsientos:
+        if isinstance(paso, MementoSeleccionAsientos):
+            return paso
+        operacion, asiento_id = paso
+        if operacion == "=":
+            return memento
+        conjunto = memento._get_conjunto_asientos()
+        conjunto = conjunto.agregar(asiento_id) if operacion == "+" else conjunto.quitar(asiento_id)
+        return MementoSeleccionAsientos(conjunto, memento._get_estado_datos_adicionales())
+
+    def _reconstruir(self, indice: int) -> MementoSeleccionAsientos:
+        """Estado `indice` a partir del checkpoint más cercano anterior"""
+        inicio = indice
+        while inicio > 0 and not isinstance(self._pasos[inicio - 1], MementoSeleccionAsientos):
+            inicio -= 1
+        memento = self._base if inicio == 0 else self._pasos[inicio - 1]
+        for paso in self._pasos[inicio:indice]:
+            memento = self._aplicar(memento, paso)
+        return memento
@@ -0,0 +1,169 @@
+# models/precios.py
+
+import functools
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional (requirements-opcional.txt): sin él, el cálculo por lotes usa Python puro
+    np = None
+
+# Todos los montos se manejan en centavos enteros; las tasas en puntos básicos (1900 = 19 %).
+CATEGORIA_BOLETA = "boleta"
+CATEGORIA_CONFITERIA = "confiteria"
+TASA_IMPUESTO_POR_DEFECTO = 1900
+
+
+@functools.lru_cache(maxsize=4096)
+def a_centavos(valor) -> int:
+    """Convierte un monto (float, str o Decimal) a centavos enteros, redondeando a la mitad hacia arriba"""
+    return int(Decimal(str(valor)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def a_monto(centavos: int) -> float:
+    """Centavos a monto con dos decimales (para los campos float de Pedido)"""
+    return centavos / 100
+
+
+def _aplicar_tasa(centavos: int, puntos_basicos: int) -> int:
+    # Redondeo a la mitad hacia arriba en aritmética entera (montos no negativos)
+    return (centavos * puntos_basicos + 5000) // 10000
+
+
+class Cotizacion:
+    """Resultado del cálculo de un pedido, en centavos"""
+
+    __slots__ = ("subtotal", "impuestos", "subtotales_por_categoria", "precios_boletas")
+
+    def __init__(self, subtotal: int, impuestos: int, subtotales_por_categoria: Dict[str, int],
+                 precios_boletas: List[int] = None):
+        self.subtotal = subtotal
+        self.impuestos = impuestos
+        self.subtotales_por_categoria = subtotales_por_categoria
+        # Precio cobrado por cada boleta, en el orden de pedido.items_boletas
+        self.precios_boletas = precios_boletas or []
+
+    @property
+    def total(self) -> int:
+        return self.subtotal + self.impuestos
+
+
+class MotorPrecios:
+    """Calcula subtotales e impuestos de pedidos con aritmética entera en centavos.
+
+    - precios_por_zona: precio de la boleta por zona de la sala (en centavos).
+    - zonas_por_fila: zona de cada fila ("A" -> "preferencial"). Una boleta
+      cuya fila no tiene zona con precio usa el precio del ItemBoleta.
+    - impuestos_por_categoria: tasa en puntos básicos por categoría de item.
+      El impuesto se calcula sobre el subtotal de cada categoría y se redondea una vez.
+    """
+
+    def __init__(self, precios_por_zona: Dict[str, int] = None, zonas_por_fila: Dict[str, str] = None,
+                 impuestos_por_categoria: Dict[str, int] = None,
+                 tasa_por_defecto: int = TASA_IMPUESTO_POR_DEFECTO, max_zonas_memo: int = 4096):
+        self.precios_por_zona = dict(precios_por_zona or {})
+        self.zonas_por_fila = dict(zonas_por_fila or {})
+        self.impuestos_por_categoria = dict(impuestos_por_categoria or {})
+        self.tasa_por_defecto = tasa_por_defecto
+        # Memo acotado asiento_id -> zona (los IDs vienen de pedidos y lotes)
+        self._zona_de_asiento = functools.lru_cache(maxsize=max_zonas_memo)(self._buscar_zona)
+
+    def tasa(self, categoria: str) -> int:
+        return self.impuestos_por_categoria.get(categoria, self.tasa_por_defecto)
+
+    def _buscar_zona(self, asiento_id: str) -> Optional[str]:
+        return self.zonas_por_fila.get(asiento_id.rstrip("0123456789"))
+
+    def precio_boleta(self, item) -> int:
+        """Precio en centavos de una boleta según la zona de su fila (o el del item si no tiene)"""
+        zona = self._zona_de_asiento(item.asiento_id)
+        precio_zona = self.precios_por_zona.get(zona) if zona is not None else None
+        if precio_zona is None:
+            return a_centavos(item.precio)
+        return precio_zona
+
+    def lineas(self, pedido) -> List[Tuple[str, int, int]]:
+        """Líneas del pedido como (categoría, precio unitario en centavos, cantidad)"""
+        lineas = [(CATEGORIA_BOLETA, self.precio_boleta(item), 1) for item in pedido.items_boletas]
+        # ItemConfiteria.precio ya incluye la cantidad: se parte del precio unitario
+        lineas += [(CATEGORIA_CONFITERIA, a_centavos(item.precio_unitario), item.cantidad)
+                   for item in pedido.items_confiteria]
+        return lineas
+
+    def cotizar(self, pedido) -> Cotizacion:
+        subtotales: Dict[str, int] = {}
+        lineas = self.lineas(pedido)
+        for categoria, precio, cantidad in lineas:
+            subtotales[categoria] = subtotales.get(categoria, 0) + precio * cantidad
+        impuestos = sum(_aplicar_tasa(monto, self.tasa(categoria)) for categoria, monto in subtotales.items())
+        return Cotizacion(sum(subtotales.values()), impuestos, subtotales,
+                          _precios_boletas(pedido, lineas))
+
+    def cotizar_lote(self, pedidos: Sequence) -> List[Cotizacion]:
+        """Cotiza muchos pedidos a la vez (reportes, lotes, recálculo de una función).
+
+        Con numpy, todas las líneas se procesan como arreglos int64 y se agregan
+        por (pedido, categoría) en una sola operación; sin numpy se usa cotizar().
+        El resultado es el mismo que el de cotizar() pedido por pedido.
+        """
+        if np is None or not pedidos:
+            return [self.cotizar(pedido) for pedido in pedidos]
+
+        categorias: Dict[str, int] = {}
+        indices_pedido, indices_categoria, precios, cantidades = [], [], [], []
+        precios_boletas = []
+        for indice, pedido in enumerate(pedidos):
+            lineas = self.lineas(pedido)
+            precios_boletas.append(_precios_boletas(pedido, lineas))
+            for categoria, precio, cantidad in lineas:
+                indices_pedido.append(indice)
+                indices_categoria.append(categorias.setdefault(categoria, len(categorias)))
+                precios.append(precio)
+                cantidades.append(cantidad)
+        if not precios:
+            return [Cotizacion(0, 0, {}, boletas) for boletas in precios_boletas]
+
+        importes = np.asarray(precios, dtype=np.int64) * np.asarray(cantidades, dtype=np.int64)
+        subtotales = np.zeros((len(pedidos), len(categorias)), dtype=np.int64)
+        posiciones = (np.asarray(indices_pedido), np.asarray(indices_categoria))
+        np.add.at(subtotales, posiciones, importes)
+        # Como en cotizar(), un pedido incluye las categorías de sus líneas aunque sumen 0
+        presentes = np.zeros(subtotales.shape, dtype=bool)
+        presentes[posiciones] = True
+        tasas = np.asarray([self.tasa(categoria) for categoria in categorias], dtype=np.int64)
+        impuestos = (subtotales * tasas + 5000) // 10000
+
+        nombres = list(categorias)
+        totales_subtotal = subtotales.sum(axis=1).tolist()
+        totales_impuestos = impuestos.sum(axis=1).tolist()
+        filas, filas_presentes = subtotales.tolist(), presentes.tolist()
+        return [Cotizacion(totales_subtotal[i], totales_impuestos[i],
+                           {nombre: monto for nombre, monto, presente in zip(nombres, filas[i], filas_presentes[i])
+                            if presente},
+                           precios_boletas[i])
+                for i in range(len(pedidos))]
+
+
+def _precios_boletas(pedido, lineas: List[Tuple[str, int, int]]) -> List[int]:
+    # lineas() pone primero una línea por boleta, en el mismo orden
+    return [precio for _, precio, _ in lineas[:len(pedido.items_boletas)]]
+
+
+def motor_desde_texto(precios_zona: Optional[str], zonas_fila: Optional[str], impuestos: Optional[str]) -> MotorPrecios:
+    """Construye un motor desde textos 'preferencial=12000,general=10000', 'A=preferencial'
+    y 'boleta=1900,confiteria=800' (precios en unidades de moneda, tasas en puntos básicos)"""
+
+    def pares(texto: Optional[str]) -> Dict[str, str]:
+        resultado = {}
+        for parte in (texto or "").split(","):
+            if "=" in parte:
+                clave, valor = (elemento.strip() for elemento in parte.split("=", 1))
+                resultado[clave] = valor
+        return resultado
+
+    return MotorPrecios(
+        precios_por_zona={zona: a_centavos(precio) for zona, precio in pares(precios_zona).items()},
+        zonas_por_fila=pares(zonas_fila),
+        impuestos_por_categoria={categoria: int(tasa) for categoria, tasa in pares(impuestos).items()},
+    )
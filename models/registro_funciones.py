@@ -0,0 +1,211 @@
+# models/registro_funciones.py
+
+import functools
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from models.iterator import AsientosCollection
+
+# Una función (proyección) se identifica por (sala, horario). El horario es un
+# texto ISO 8601 ("2026-10-18T19:30") o None para una función sin horario fijo.
+ClaveFuncion = Tuple[str, Optional[str]]
+
+
+def normalizar_horario(horario: Optional[str]) -> Optional[str]:
+    """Forma canónica del horario ("AAAA-MM-DDTHH:MM") o None si no tiene.
+
+    "2030-01-01T19:30", "2030-01-01T19:30:00" y "2030-01-01 19:30" son la misma
+    función y deben dar la misma clave (inventario, SQLite, diario, SSE, caché).
+    Lanza ValueError si no es una fecha ISO válida o trae zona horaria (se
+    compara con el reloj local, que no la tiene).
+    """
+    if not horario:
+        return None
+    inicio = datetime.fromisoformat(horario)
+    if inicio.tzinfo is not None:
+        raise ValueError(f"El horario '{horario}' no debe incluir zona horaria")
+    return inicio.isoformat(timespec="minutes")
+
+
+def clave_funcion(sala: str, horario: Optional[str] = None) -> ClaveFuncion:
+    """Clave (sala, horario normalizado) de una función. Lanza ValueError si el horario es inválido"""
+    return sala, normalizar_horario(horario)
+
+
+class DistribucionSala:
+    """Distribución de filas y columnas de una sala"""
+
+    def __init__(self, filas: List[str], asientos_por_fila: int):
+        self.filas = list(filas)
+        self.asientos_por_fila = asientos_por_fila
+
+
+def distribuciones_desde_texto(texto: Optional[str]) -> Dict[str, DistribucionSala]:
+    """Lee distribuciones '1=ABC/10,2=ABCDE/12' (sala=filas/asientos por fila, una letra por fila).
+    Lanza ValueError si alguna está mal escrita o no tiene filas o asientos."""
+    distribuciones = {}
+    for parte in (texto or "").split(","):
+        if "=" in parte:
+            sala, valor = (elemento.strip() for elemento in parte.split("=", 1))
+            filas, _, asientos_por_fila = valor.partition("/")
+            try:
+                asientos_por_fila = int(asientos_por_fila)
+            except ValueError:
+                raise ValueError(f"Distribución de la sala '{sala}' inválida: '{valor}' (se espera filas/asientos)") from None
+            if not filas.strip() or asientos_por_fila < 1:
+                raise ValueError(f"Distribución de la sala '{sala}' inválida: '{valor}' (sin filas o asientos)")
+            distribuciones[sala] = DistribucionSala(list(filas.strip()), asientos_por_fila)
+    return distribuciones
+
+
+class RegistroInventarios:
+    """Registro de inventarios de asientos por (sala, horario).
+
+    Los inventarios se crean la primera vez que se consultan, usando la
+    distribución configurada para la sala, y se expulsan cuando la función
+    ya terminó para no mantener en memoria el estado de funciones pasadas.
+    Si se indican `salas`, solo se aceptan esas salas (y las configuradas con
+    configurar_sala). Como mucho se guardan `max_inventarios`: al llegar al
+    tope se expulsan los inventarios vacíos que llevan al menos
+    `intervalo_expulsion` sin consultarse (recrearlos no pierde nada).
+    """
+
+    def __init__(self, distribucion_por_defecto: DistribucionSala = None,
+                 duracion_funcion: timedelta = timedelta(hours=3),
+                 intervalo_expulsion: timedelta = timedelta(minutes=1),
+                 reloj: Callable[[], datetime] = datetime.now,
+                 fabrica_inventario: Callable[[List[str], int], AsientosCollection] = AsientosCollection,
+                 observador_inventarios: Callable[[ClaveFuncion, str, List[str]], None] = None,
+                 salas: Iterable[str] = None, max_inventarios: int = 10000):
+        self._distribucion_por_defecto = distribucion_por_defecto or DistribucionSala(["A", "B", "C"], 10)
+        self._distribuciones: Dict[str, DistribucionSala] = {}
+        self._salas = set(salas) if salas is not None else None
+        self._max_inventarios = max_inventarios
+        self._duracion_funcion = duracion_funcion
+        self._intervalo_expulsion = intervalo_expulsion
+        self._reloj = reloj
+        self._fabrica_inventario = fabrica_inventario
+        # Recibe (función, acción, asientos) por cada cambio en cualquier inventario
+        self._observador_inventarios = observador_inventarios
+        self._inventarios: Dict[ClaveFuncion, AsientosCollection] = {}
+        self._fin_funciones: Dict[ClaveFuncion, datetime] = {}
+        self._ultimos_accesos: Dict[ClaveFuncion, datetime] = {}
+        self._ultima_expulsion = reloj()
+        self._proximo_barrido = self._ultima_expulsion
+        self._lock = threading.Lock()
+
+    def configurar_sala(self, sala: str, filas: List[str], asientos_por_fila: int):
+        """Define la distribución de asientos de una sala"""
+        self._distribuciones[sala] = DistribucionSala(filas, asientos_por_fila)
+        if self._salas is not None:
+            self._salas.add(sala)
+
+    def distribucion(self, sala: str) -> DistribucionSala:
+        return self._distribuciones.get(sala, self._distribucion_por_defecto)
+
+    def fin_funcion(self, horario: Optional[str]) -> Optional[datetime]:
+        """Calcula la hora de fin de la función o None si no tiene horario.
+
+        Lanza ValueError si el horario no es una fecha ISO válida o trae zona
+        horaria (ver normalizar_horario).
+        """
+        horario = normalizar_horario(horario)
+        if horario is None:
+            return None
+        return datetime.fromisoformat(horario) + self._duracion_funcion
+
+    def obtener(self, sala: str, horario: Optional[str] = None) -> AsientosCollection:
+        """Retorna el inventario de la función, creándolo si no existe.
+
+        Lanza ValueError si la sala no existe, el horario no es una fecha ISO
+        válida, la función ya terminó o se alcanzó el tope de inventarios.
+        """
+        clave = clave_funcion(sala, horario)
+        fin = self.fin_funcion(clave[1])
+        if fin is not None and fin <= self._reloj():
+            raise ValueError(f"La función de las {clave[1]} ya terminó")
+        inventario = self._inventarios.get(clave)
+        if inventario is not None:
+            self._ultimos_accesos[clave] = self._reloj()
+            # Si justo lo expulsaron por vacío, se crea de nuevo
+            if self._inventarios.get(clave) is not inventario:
+                inventario = None
+        if inventario is None:
+            with self._lock:
+                inventario = self._inventarios.get(clave)
+                if inventario is None:
+                    if self._salas is not None and sala not in self._salas:
+                        raise ValueError(f"Sala desconocida '{sala}'")
+                    if len(self._inventarios) >= self._max_inventarios:
+                        self._expulsar_vacios()
+                        if len(self._inventarios) >= self._max_inventarios:
+                            raise ValueError("Se alcanzó el máximo de funciones abiertas")
+                    distribucion = self.distribucion(sala)
+                    inventario = self._fabrica_inventario(distribucion.filas, distribucion.asientos_por_fila)
+                    if self._observador_inventarios is not None:
+                        inventario.observador = functools.partial(self._observador_inventarios, clave)
+                    self._inventarios[clave] = inventario
+                    if fin is not None:
+                        self._fin_funciones[clave] = fin
+                self._ultimos_accesos[clave] = self._reloj()
+        self._expulsar_si_corresponde()
+        return inventario
+
+    def buscar(self, sala: str, horario: Optional[str] = None) -> Optional[AsientosCollection]:
+        """Retorna el inventario de la función sin crearlo (None si no existe o el horario es inválido)"""
+        try:
+            return self._inventarios.get(clave_funcion(sala, horario))
+        except ValueError:
+            return None
+
+    def expulsar_finalizadas(self, ahora: datetime = None) -> int:
+        """Elimina los inventarios de funciones que ya terminaron"""
+        ahora = ahora or self._reloj()
+        with self._lock:
+            finalizadas = [clave for clave, fin in self._fin_funciones.items() if fin <= ahora]
+            for clave in finalizadas:
+                del self._fin_funciones[clave]
+                self._inventarios.pop(clave, None)
+                self._ultimos_accesos.pop(clave, None)
+            self._ultima_expulsion = ahora
+        return len(finalizadas)
+
+    def _expulsar_vacios(self):
+        # Requiere self._lock. Solo los inactivos: una petición en curso puede tener
+        # el inventario recién obtenido y no debe quedarse con uno fuera del registro.
+        # El recorrido es O(inventarios), así que se hace como mucho una vez por segundo.
+        ahora = self._reloj()
+        if ahora < self._proximo_barrido:
+            return
+        self._proximo_barrido = ahora + timedelta(seconds=1)
+        limite = ahora - self._intervalo_expulsion
+        for clave, inventario in list(self._inventarios.items()):
+            acceso = self._ultimos_accesos.get(clave)
+            if acceso is not None and acceso <= limite and inventario.esta_vacio:
+                del self._inventarios[clave]
+                self._fin_funciones.pop(clave, None)
+                self._ultimos_accesos.pop(clave, None)
+
+    def _expulsar_si_corresponde(self):
+        ahora = self._reloj()
+        if ahora - self._ultima_expulsion >= self._intervalo_expulsion:
+            self.expulsar_finalizadas(ahora)
+
+    def funciones_activas(self) -> List[ClaveFuncion]:
+        return list(self._inventarios.keys())
+
+    def retenciones_activas(self) -> int:
+        """Retenciones vigentes sumando todas las funciones"""
+        return sum(inventario.cantidad_retenciones for inventario in list(self._inventarios.values()))
+
+    def liberar_retenciones_de(self, sesion_id: str) -> int:
+        """Libera las retenciones de la sesión en todas las funciones. Retorna cuántas liberó"""
+        return sum(len(inventario.liberar_retenciones_de(sesion_id))
+                   for inventario in list(self._inventarios.values()))
+
+    def __contains__(self, clave: ClaveFuncion) -> bool:
+        return clave in self._inventarios
+
+    def __len__(self) -> int:
+        return len(self._inventarios)
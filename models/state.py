@@ -1,173 +1,191 @@
 # models/state.py
-from abc import ABC, abstractmethod
-class EstadoPedido(ABC):
-    @abstractmethod
-    def procesar_pago(self, pedido): pass
-
-    @abstractmethod
-    def cancelar(self, pedido): pass
-
-    @abstractmethod
-    def confirmar(self, pedido): pass
-
-    @abstractmethod
-    def emitir_entradas(self, pedido): pass
-
-    @abstractmethod
-    def solicitar_reembolso(self, pedido): pass
-
-class Pedido:
-    def __init__(self, id, items, metodo_pago, total):
-        self.id = id
-        self.items = items
-        self.metodo_pago = metodo_pago
-        self.total = total
-        self.mensaje_error = ""
-        self._estado_actual = EstadoPedidoPendiente()
-
-    def establecer_estado(self, nuevo_estado):
-        self._estado_actual = nuevo_estado
-
-    def procesar_pago(self):
-        self._estado_actual.procesar_pago(self)
-
-    def cancelar(self):
-        self._estado_actual.cancelar(self)
-
-    def confirmar(self):
-        self._estado_actual.confirmar(self)
-
-    def emitir_entradas(self):
-        self._estado_actual.emitir_entradas(self)
-
-    def solicitar_reembolso(self):
-        self._estado_actual.solicitar_reembolso(self)
-
-class EstadoPedidoPendiente(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("Procesando pago...")
-        pedido.establecer_estado(EstadoPedidoProcesandoPago())
-
-    def cancelar(self, pedido):
-        print("Pedido cancelado.")
-        pedido.establecer_estado(EstadoPedidoCancelado())
-
-    def confirmar(self, pedido):
-        print("No se puede confirmar, aún no ha sido pagado.")
-
-    def emitir_entradas(self, pedido):
-        print("No se puede emitir entradas sin confirmar.")
-
-    def solicitar_reembolso(self, pedido):
-        print("No se puede reembolsar un pedido pendiente.")
-
-class EstadoPedidoProcesandoPago(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("Ya se está procesando el pago...")
-
-    def cancelar(self, pedido):
-        print("Cancelando mientras se procesaba el pago.")
-        pedido.establecer_estado(EstadoPedidoCancelado())
-
-    def confirmar(self, pedido):
-        print("Esperando confirmación de pago...")
-
-    def emitir_entradas(self, pedido):
-        print("Pago no confirmado aún.")
-
-    def solicitar_reembolso(self, pedido):
-        print("No se puede reembolsar sin pago confirmado.")
-
-    def notificado_pago_exitoso(self, pedido):
-        print("Pago exitoso.")
-        pedido.establecer_estado(EstadoPedidoPagado())
-
-    def notificado_pago_fallido(self, pedido, razon):
-        print(f"Pago fallido: {razon}")
-        pedido.mensaje_error = razon
-        pedido.establecer_estado(EstadoPedidoFallido())
-
-class EstadoPedidoPagado(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("El pedido ya fue pagado.")
-
-    def cancelar(self, pedido):
-        print("No se puede cancelar después de pagar.")
-
-    def confirmar(self, pedido):
-        print("Confirmando pedido...")
-        pedido.establecer_estado(EstadoPedidoConfirmado())
-
-    def emitir_entradas(self, pedido):
-        print("Debe confirmar primero el pedido.")
-
-    def solicitar_reembolso(self, pedido):
-        print("Reembolsando...")
-        pedido.establecer_estado(EstadoPedidoReembolsado())
-
-class EstadoPedidoConfirmado(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("El pedido ya fue procesado.")
-
-    def cancelar(self, pedido):
-        print("No se puede cancelar después de confirmar.")
-
-    def confirmar(self, pedido):
-        print("Ya está confirmado.")
-
-    def emitir_entradas(self, pedido):
-        print("Entradas emitidas.")
-
-    def solicitar_reembolso(self, pedido):
-        print("Solicitando reembolso...")
-        pedido.establecer_estado(EstadoPedidoReembolsado())
-
-class EstadoPedidoCancelado(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("No se puede procesar un pedido cancelado.")
-
-    def cancelar(self, pedido):
-        print("Ya está cancelado.")
-
-    def confirmar(self, pedido):
-        print("No se puede confirmar un pedido cancelado.")
-
-    def emitir_entradas(self, pedido):
-        print("No se pueden emitir entradas para un pedido cancelado.")
-
-    def solicitar_reembolso(self, pedido):
-        print("Pedido cancelado, nada que reembolsar.")
-
-class EstadoPedidoFallido(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("Reintentando pago...")
-        pedido.establecer_estado(EstadoPedidoProcesandoPago())
-
-    def cancelar(self, pedido):
-        print("Cancelando pedido fallido...")
-        pedido.establecer_estado(EstadoPedidoCancelado())
-
-    def confirmar(self, pedido):
-        print("No se puede confirmar un pago fallido.")
-
-    def emitir_entradas(self, pedido):
-        print("No se pueden emitir entradas.")
-
-    def solicitar_reembolso(self, pedido):
-        print("No se puede reembolsar, el pago falló.")
-
-class EstadoPedidoReembolsado(EstadoPedido):
-    def procesar_pago(self, pedido):
-        print("El pedido ya fue reembolsado.")
-
-    def cancelar(self, pedido):
-        print("Ya está reembolsado.")
-
-    def confirmar(self, pedido):
-        print("No se puede confirmar un pedido reembolsado.")
-
-    def emitir_entradas(self, pedido):
-        print("Entradas no disponibles, fue reembolsado.")
-
-    def solicitar_reembolso(self, pedido):
-        print("Ya fue reembolsado.")
\ No newline at end of file
+import threading
+from enum import Enum
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, Type
+
+
+class EstadoPedido(Enum):
+    PENDIENTE = "PENDIENTE"
+    VALIDANDO = "VALIDANDO"
+    CALCULANDO_PRECIOS = "CALCULANDO_PRECIOS"
+    APLICANDO_DESCUENTOS = "APLICANDO_DESCUENTOS"
+    PROCESANDO_PAGO = "PROCESANDO_PAGO"
+    PAGADO = "PAGADO"
+    COMPLETADO = "COMPLETADO"
+    FALLIDO = "FALLIDO"
+    CANCELADO = "CANCELADO"
+    REEMBOLSO_SOLICITADO = "REEMBOLSO_SOLICITADO"
+    REEMBOLSO_PROCESADO = "REEMBOLSO_PROCESADO"
+    REEMBOLSO_RECHAZADO = "REEMBOLSO_RECHAZADO"
+
+
+class EventoPedido(Enum):
+    VALIDAR = "VALIDAR"
+    CALCULAR_PRECIOS = "CALCULAR_PRECIOS"
+    APLICAR_DESCUENTOS = "APLICAR_DESCUENTOS"
+    PROCESAR_PAGO = "PROCESAR_PAGO"
+    CONFIRMAR_PAGO = "CONFIRMAR_PAGO"
+    COMPLETAR = "COMPLETAR"
+    FALLAR = "FALLAR"
+    CANCELAR = "CANCELAR"
+    SOLICITAR_REEMBOLSO = "SOLICITAR_REEMBOLSO"
+    REEMBOLSAR = "REEMBOLSAR"
+    RECHAZAR_REEMBOLSO = "RECHAZAR_REEMBOLSO"
+
+
+# Estados antes del pago (cualquiera puede fallar o cancelarse)
+_PREPARACION = (EstadoPedido.PENDIENTE, EstadoPedido.VALIDANDO,
+                EstadoPedido.CALCULANDO_PRECIOS, EstadoPedido.APLICANDO_DESCUENTOS)
+_EN_CURSO = _PREPARACION + (EstadoPedido.PROCESANDO_PAGO,)
+# Estados de un pedido que todavía recorre la cadena (p. ej. esperando a la pasarela de pago)
+ESTADOS_EN_CURSO = frozenset(_EN_CURSO)
+
+# Evento de cada etapa previa al pago y el estado al que lleva
+ESTADO_DE_ETAPA = {
+    EventoPedido.VALIDAR: EstadoPedido.VALIDANDO,
+    EventoPedido.CALCULAR_PRECIOS: EstadoPedido.CALCULANDO_PRECIOS,
+    EventoPedido.APLICAR_DESCUENTOS: EstadoPedido.APLICANDO_DESCUENTOS,
+}
+# Orden de esas etapas en la cadena por defecto (controller/cadenas.py)
+ETAPAS_PREPARACION = (EventoPedido.VALIDAR, EventoPedido.CALCULAR_PRECIOS, EventoPedido.APLICAR_DESCUENTOS)
+
+
+def transiciones_pedido(etapas_preparacion: Sequence[EventoPedido] = ETAPAS_PREPARACION) -> tuple:
+    """Tabla de transiciones de una cadena cuyas etapas previas al pago disparan esos eventos
+    en ese orden: cada etapa solo se alcanza desde la anterior (la primera desde PENDIENTE), y
+    el pago desde la última (o desde PENDIENTE si no hay etapas). Lanza ValueError si un evento no es de preparación o se repite."""
+    if len(set(etapas_preparacion)) != len(etapas_preparacion):
+        raise ValueError(f"Etapas previas al pago repetidas: {[e.value for e in etapas_preparacion]}")
+    transiciones = []
+    origen = EstadoPedido.PENDIENTE
+    for evento in etapas_preparacion:
+        if evento not in ESTADO_DE_ETAPA:
+            raise ValueError(f"El evento {evento.value} no es de una etapa previa al pago")
+        transiciones.append(((origen,), evento, ESTADO_DE_ETAPA[evento], None))
+        origen = ESTADO_DE_ETAPA[evento]
+    # (estados de origen, evento, estado siguiente, nombre de la acción o None)
+    return tuple(transiciones) + (
+        ((origen,), EventoPedido.PROCESAR_PAGO, EstadoPedido.PROCESANDO_PAGO, None),
+        # Un pedido con total 0 se da por pagado desde la última etapa, sin pasar por la pasarela
+        ((EstadoPedido.PROCESANDO_PAGO, origen), EventoPedido.CONFIRMAR_PAGO, EstadoPedido.PAGADO, None),
+        ((EstadoPedido.PAGADO,), EventoPedido.COMPLETAR, EstadoPedido.COMPLETADO, None),
+        (_EN_CURSO + (EstadoPedido.PAGADO,), EventoPedido.FALLAR, EstadoPedido.FALLIDO, "liberar_pedido"),
+        (_EN_CURSO, EventoPedido.CANCELAR, EstadoPedido.CANCELADO, "liberar_pedido"),
+        ((EstadoPedido.COMPLETADO,), EventoPedido.SOLICITAR_REEMBOLSO, EstadoPedido.REEMBOLSO_SOLICITADO, None),
+        ((EstadoPedido.COMPLETADO, EstadoPedido.REEMBOLSO_SOLICITADO), EventoPedido.REEMBOLSAR,
+         EstadoPedido.REEMBOLSO_PROCESADO, "marcar_reembolsado"),
+        ((EstadoPedido.COMPLETADO, EstadoPedido.REEMBOLSO_SOLICITADO), EventoPedido.RECHAZAR_REEMBOLSO,
+         EstadoPedido.REEMBOLSO_RECHAZADO, None),
+    )
+
+
+TRANSICIONES_PEDIDO = transiciones_pedido()
+
+
+class TransicionInvalida(Exception):
+    """El evento no está permitido en el estado actual (o, con llevar_a, el estado de
+    destino no se alcanza desde el actual; entonces `evento` es ese estado)"""
+
+    def __init__(self, estado: Enum, evento: Enum):
+        if type(evento) is type(estado):
+            mensaje = f"El estado {evento.value} no se alcanza desde el estado {estado.value}"
+        else:
+            mensaje = f"El evento {evento.value} no está permitido en el estado {estado.value}"
+        super().__init__(mensaje)
+        self.estado = estado
+        self.evento = evento
+
+
+# Locks de la máquina: un sujeto siempre cae en la misma franja, sujetos distintos casi nunca compiten
+CANTIDAD_FRANJAS_LOCK = 64
+
+
+class MaquinaEstados:
+    """Máquina de estados por tabla.
+
+    Las transiciones se compilan en un arreglo plano indexado por
+    (posición del estado × cantidad de eventos + posición del evento), con
+    (estado siguiente, acción) o None si el evento no está permitido. El estado
+    de cada sujeto es solo su atributo `estado` (un miembro del enum), así que
+    no se crea ningún objeto por pedido.
+    `observador`, si no es None, se llama como observador(sujeto, origen, evento, destino)
+    en cada transición. disparar es atómico por sujeto: la consulta del estado, el
+    cambio, la acción y el observador corren bajo el lock de su franja (la cadena de
+    pago y /cancel_order pueden disparar eventos sobre el mismo pedido desde hilos distintos).
+    """
+
+    def __init__(self, estados: Type[Enum], eventos: Type[Enum],
+                 transiciones: Iterable[Tuple[Iterable[Enum], Enum, Enum, Optional[str]]],
+                 acciones: Dict[str, Callable] = None):
+        acciones = acciones or {}
+        self._estados, self._eventos, self._acciones = estados, eventos, acciones
+        self._posicion_estado = {estado: posicion for posicion, estado in enumerate(estados)}
+        self._posicion_evento = {evento: posicion for posicion, evento in enumerate(eventos)}
+        self._cantidad_eventos = len(self._posicion_evento)
+        tabla = [None] * (len(self._posicion_estado) * self._cantidad_eventos)
+        self._evento_hacia: Dict[Tuple[Enum, Enum], Enum] = {}
+        for origenes, evento, destino, nombre_accion in transiciones:
+            if nombre_accion is not None and nombre_accion not in acciones:
+                raise ValueError(f"Acción '{nombre_accion}' no definida para el evento {evento.value}")
+            accion = acciones.get(nombre_accion)
+            for origen in origenes:
+                indice = self._posicion_estado[origen] * self._cantidad_eventos + self._posicion_evento[evento]
+                if tabla[indice] is not None:
+                    raise ValueError(f"Transición duplicada: {origen.value} + {evento.value}")
+                tabla[indice] = (destino, accion)
+                # Para llevar_a: el primer evento de la tabla que va de origen a destino
+                self._evento_hacia.setdefault((origen, destino), evento)
+        self._tabla = tuple(tabla)
+        self._locks = tuple(threading.RLock() for _ in range(CANTIDAD_FRANJAS_LOCK))
+        self._observador = [None]  # Celda compartida con las máquinas derivadas
+
+    @property
+    def observador(self) -> Optional[Callable]:
+        return self._observador[0]
+
+    @observador.setter
+    def observador(self, observador: Optional[Callable]):
+        self._observador[0] = observador
+
+    def derivar(self, transiciones: Iterable[Tuple[Iterable[Enum], Enum, Enum, Optional[str]]]) -> "MaquinaEstados":
+        """Máquina con otra tabla y los mismos estados, eventos y acciones. Comparte con esta
+        el observador (también el que se asigne después) y los locks de los sujetos."""
+        derivada = MaquinaEstados(self._estados, self._eventos, transiciones, self._acciones)
+        derivada._locks = self._locks
+        derivada._observador = self._observador
+        return derivada
+
+    def _lock_de(self, sujeto) -> threading.RLock:
+        # id() está alineado a 16 bytes: sin el corrimiento solo se usarían 4 franjas
+        return self._locks[(id(sujeto) >> 4) % CANTIDAD_FRANJAS_LOCK]
+
+    def transicion(self, estado: Enum, evento: Enum) -> Optional[Tuple[Enum, Optional[Callable]]]:
+        return self._tabla[self._posicion_estado[estado] * self._cantidad_eventos + self._posicion_evento[evento]]
+
+    def permite(self, estado: Enum, evento: Enum) -> bool:
+        return self.transicion(estado, evento) is not None
+
+    def disparar(self, sujeto, evento: Enum) -> Enum:
+        """Aplica el evento al sujeto y retorna el nuevo estado. Lanza TransicionInvalida si no está permitido."""
+        with self._lock_de(sujeto):
+            origen = sujeto.estado
+            transicion = self.transicion(origen, evento)
+            if transicion is None:
+                raise TransicionInvalida(origen, evento)
+            destino, accion = transicion
+            sujeto.estado = destino
+            if accion is not None:
+                accion(sujeto)
+            observador = self._observador[0]
+            if observador is not None:
+                observador(sujeto, origen, evento, destino)
+            return destino
+
+    def llevar_a(self, sujeto, destino: Enum) -> Enum:
+        """Dispara el evento que lleva al sujeto de su estado actual a `destino`.
+        Lanza TransicionInvalida si ninguna transición de la tabla lo hace."""
+        with self._lock_de(sujeto):
+            evento = self._evento_hacia.get((sujeto.estado, destino))
+            if evento is None:
+                raise TransicionInvalida(sujeto.estado, destino)
+            return self.disparar(sujeto, evento)
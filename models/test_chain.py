@@ -1,22 +1,32 @@
 
 # test_chain.py
 
-from chain import (
+import os
+import sys
+
+# Permite ejecutarlo como script desde models/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.chain import (
     Pedido,
+    ItemBoleta,
+    ItemConfiteria,
     ManejadorValidacionStock,
     ManejadorAplicacionDescuentos,
     ManejadorCalculoPreciosYImpuestos,
     ManejadorProcesamientoPago,
     ManejadorGeneracionEntradas,
-    ManejadorActualizacionInventario
+    ManejadorActualizacionInventario,
+    maquina_pedidos
 )
+from models.state import EstadoPedido, TransicionInvalida
 
 def main():
     # --- Crear un pedido ficticio ---
     pedido = Pedido(
         id="P12345",
-        items_boletas=["B1", "B2"],  # Puedes usar strings dummy como identificadores
-        items_confiteria=["C1", "C2"],
+        items_boletas=[ItemBoleta("B1"), ItemBoleta("B2")],
+        items_confiteria=[ItemConfiteria("Palomitas", 1, 5.00), ItemConfiteria("Gaseosa", 2, 3.50)],
         metodo_pago="Tarjeta",
         cupon_aplicado="CINE20"
     )
@@ -40,7 +50,17 @@ def main():
 
     # --- Ver resultado final ---
     print("Estado final del pedido:")
-    print(pedido)
+    print(pedido.estado.value, "- Total:", pedido.total_final, "- Error:", pedido.mensaje_error)
+    # Descuentos antes del cálculo: la tabla de transiciones sigue el orden de esta cadena
+    assert pedido.estado == EstadoPedido.COMPLETADO and pedido.maquina is not maquina_pedidos
+
+    # set_estado usa la misma tabla de transiciones que disparar
+    assert pedido.set_estado(EstadoPedido.REEMBOLSO_SOLICITADO) == EstadoPedido.REEMBOLSO_SOLICITADO
+    try:
+        pedido.set_estado(EstadoPedido.PENDIENTE)
+        raise AssertionError("Se esperaba TransicionInvalida")
+    except TransicionInvalida as e:
+        print("Rechazado:", e)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,140 @@
+# test_descuentos.py
+
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# Permite ejecutarlo como script desde models/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.chain import ItemBoleta, ItemConfiteria, Pedido
+from models.descuentos import MotorDescuentos, ReglaDescuento, cargar_reglas, devolver_canjes, reglas_canjeadas
+from models.precios import MotorPrecios
+from models.state import EventoPedido
+
+AHORA = datetime(2026, 10, 18, 18, 0)
+
+
+def pedido(asientos, cupon=None, funcion=("1", "2026-10-18T19:30"), confiteria=()):
+    return Pedido("P", [ItemBoleta(asiento, 10000.0) for asiento in asientos],
+                  [ItemConfiteria(*item) for item in confiteria], "efectivo", cupon, funcion)
+
+
+def descuento(motor, orden) -> int:
+    return motor.aplicar(orden, MotorPrecios().lineas(orden), AHORA)
+
+
+def probar_compilacion():
+    # Solo se compilan predicados para las condiciones presentes
+    assert len(ReglaDescuento("libre", None, "fijo", 1)._predicados) == 0
+    completa = ReglaDescuento.desde_definicion({
+        "nombre": "completa", "tipo": "porcentaje", "valor": 12.5, "salas": "1;2", "horarios": ["2026-10-18T19:30"],
+        "minimo_items": 2, "desde": "2026-10-01T00:00", "hasta": "2026-10-31T23:59"})
+    assert len(completa._predicados) == 5 and completa.salas == {"1", "2"}
+    assert completa.aplica(("2", "2026-10-18T19:30"), {"boleta": 2}, AHORA)
+    assert not completa.aplica(("2", "2026-10-18T19:30"), {"boleta": 1}, AHORA)
+    assert not completa.aplica(("3", "2026-10-18T19:30"), {"boleta": 2}, AHORA)
+    assert not completa.aplica(("1", "2026-10-18T19:30"), {"boleta": 2}, datetime(2026, 11, 1))
+    # 12.5 % en puntos básicos, con redondeo a la mitad hacia arriba: 12.5 % de 1 centavo x 4 = 0.5 -> 1
+    assert completa.calcular([], {"boleta": 4}) == 1
+
+    for definicion in ({"tipo": "regalo"}, {"codigo": "X"}, {"tipo": "fijo", "valor": "mucho"},
+                       {"tipo": "fijo", "desde": "ayer"}):
+        try:
+            ReglaDescuento.desde_definicion(definicion)
+        except ValueError as e:
+            print("Rechazada:", e)
+        else:
+            raise AssertionError(f"Se esperaba ValueError para {definicion}")
+    print("Compilación de reglas: OK")
+
+
+def probar_indice():
+    motor = MotorDescuentos.desde_definiciones([
+        {"codigo": "CINE20", "tipo": "porcentaje", "valor": 20},
+        {"codigo": "CINE20", "nombre": "cine20-sala-2", "tipo": "fijo", "valor": 1000, "salas": "2"},
+        {"nombre": "sala-1", "tipo": "fijo", "valor": 500, "salas": "1"},
+        {"nombre": "estreno", "tipo": "fijo", "valor": 100, "horarios": "2026-10-18T19:30"},
+        {"nombre": "todas", "tipo": "2x1"},
+    ])
+    nombres = lambda codigo, funcion: [regla.nombre for regla in motor.candidatas(codigo, funcion)]
+    assert nombres(None, ("1", "2026-10-18T19:30")) == ["sala-1", "estreno", "todas"]
+    assert nombres(None, ("2", None)) == ["todas"]
+    assert nombres("CINE20", ("3", None)) == ["CINE20", "cine20-sala-2", "todas"]
+    # Los códigos se comparan exactos: distinguen mayúsculas
+    assert nombres("cine20", ("3", None)) == ["todas"] and nombres("OTRO", ("3", None)) == ["todas"]
+
+    # Las reglas candidatas que no aplican no descuentan; el 2x1 regala la boleta más barata
+    assert descuento(motor, pedido(["A1", "A2"], "CINE20", ("2", None))) == 400000 + 100000 + 1000000
+    assert descuento(motor, pedido(["A1"], "cine20", ("2", None))) == 0
+    print("Índice por código y función: OK")
+
+
+def probar_usos():
+    motor = MotorDescuentos.desde_definiciones([
+        {"codigo": "UNO", "tipo": "fijo", "valor": 10, "usos_maximos": 2, "usados": 1},
+    ])
+    contador = motor.reglas[0].contador
+    primero, segundo = pedido(["A1"], "UNO"), pedido(["A2"], "UNO")
+    assert descuento(motor, primero) == 1000 and contador.usados == 2
+    assert descuento(motor, segundo) == 0 and segundo.canjes_descuento == ()  # Agotada
+
+    # Un pedido que falla devuelve su uso (acción de la transición FALLAR) una sola vez
+    primero.disparar(EventoPedido.VALIDAR)
+    primero.disparar(EventoPedido.FALLAR)
+    assert contador.usados == 1 and primero.canjes_descuento == ()
+    devolver_canjes(primero)
+    assert contador.usados == 1
+    assert descuento(motor, segundo) == 1000 and contador.usados == 2
+
+    # Un descuento en 0 (nada que descontar) no consume usos
+    sin_boletas = pedido([], "UNO")
+    contador.devolver()
+    assert descuento(motor, sin_boletas) == 0 and contador.usados == 1
+
+    # Los usos guardados con ventas anteriores se suman a los de la definición, por nombre de regla
+    assert reglas_canjeadas(segundo) == ["UNO"]
+    motor = MotorDescuentos.desde_definiciones([
+        {"codigo": "UNO", "tipo": "fijo", "valor": 10, "usos_maximos": 3, "usados": 1},
+        {"codigo": "LIBRE", "tipo": "fijo", "valor": 10},
+    ])
+    motor.restaurar_usos({"UNO": 2, "LIBRE": 5, "OTRA": 1})
+    assert motor.reglas[0].contador.usados == 3 and motor.reglas[1].contador is None
+    assert descuento(motor, pedido(["A3"], "UNO")) == 0  # Agotada tras el reinicio
+    print("Tope de usos: OK")
+
+
+def probar_carga():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_csv = os.path.join(directorio, "reglas.csv")
+        with open(ruta_csv, "w", encoding="utf-8") as archivo:
+            archivo.write("nombre,codigo,tipo,valor,salas,usos_maximos\n"
+                          "vip,,fijo,5,VIP;1,\n"
+                          "cupon,Promo,porcentaje,10,,3\n")
+        motor = cargar_reglas(ruta_csv)
+        assert [regla.nombre for regla in motor.candidatas("Promo", ("VIP", None))] == ["cupon", "vip"]
+        assert motor.reglas[1].contador.maximo == 3 and motor.reglas[0].contador is None
+
+        ruta_json = os.path.join(directorio, "reglas.json")
+        with open(ruta_json, "w", encoding="utf-8") as archivo:
+            json.dump([{"codigo": "X", "tipo": "desconocido"}], archivo)
+        try:
+            cargar_reglas(ruta_json)
+        except ValueError as e:
+            print("Rechazado:", e)
+        else:
+            raise AssertionError("Se esperaba ValueError")
+    print("Carga desde CSV y JSON: OK")
+
+
+def main():
+    probar_compilacion()
+    probar_indice()
+    probar_usos()
+    probar_carga()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# test_iterator.py
+
+import os
+import random
+import sys
+import threading
+
+# Permite ejecutarlo como script desde models/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.bitset_asientos import MapaBitsAsientos
+from models.iterator import AsientosCollection, AsientosCollectionConcurrente
+
+
+def probar_bitsets():
+    mapa = MapaBitsAsientos(["A", "B"], 12)
+    assert mapa.posicion("A1") == (0, 1) and mapa.posicion("B12") == (1, 1 << 11)
+    assert mapa.marcar("B12") and not mapa.marcar("B12")
+    assert mapa.marcar("A3") and "A3" in mapa and len(mapa) == 2
+    assert mapa.listar() == ["A3", "B12"]
+
+    # Los IDs fuera de la distribución se ignoran en todas las operaciones
+    for desconocido in ("C1", "A13", "A0", "", "a1"):
+        assert mapa.posicion(desconocido) is None
+        assert not mapa.marcar(desconocido) and not mapa.contiene(desconocido)
+        assert not mapa.desmarcar(desconocido)
+    assert mapa.mascaras_de(["A1", "Z9", "B2"]) == [1, 2]
+
+    mascaras = mapa.mascaras_de(["A1", "A3", "B12"])
+    assert mapa.asientos_de(mapa.marcados_en(mascaras)) == ["A3", "B12"]
+    assert mapa.asientos_de(mapa.sin_marcar_en(mascaras)) == ["A1"]
+    mapa.aplicar_mascaras(mascaras)
+    assert mapa.listar() == ["A1", "A3", "B12"]
+    mapa.limpiar_mascaras(mapa.mascaras_de(["A3", "B12"]))
+    assert mapa.listar() == ["A1"] and mapa.desmarcar("A1") and len(mapa) == 0
+    print("Bitsets por fila: OK")
+
+
+def probar_notificaciones():
+    inventario = AsientosCollection(["A", "B"], 5)
+    eventos = []
+    inventario.observador = lambda accion, asientos: eventos.append((accion, asientos))
+
+    inventario.confirmar_venta_asientos(["A1", "A2", "X9"])
+    assert eventos == [("VENDER", ["A1", "A2"])]
+    assert inventario.asientos_vendidos == ["A1", "A2"]
+    version = inventario.version
+
+    # Vender de nuevo o devolver asientos no vendidos no cambia nada: sin eventos ni versión nueva
+    inventario.confirmar_venta_asientos(["A2", "A1"])
+    inventario.desmarcar_asientos_vendidos(["B1", "X9"])
+    assert len(eventos) == 1 and inventario.version == version
+
+    inventario.confirmar_venta_asientos(["A2", "B3"])
+    inventario.desmarcar_asientos_vendidos(["A1", "B1", "B3"])
+    assert eventos[1:] == [("VENDER", ["B3"]), ("DEVOLVER", ["A1", "B3"])]
+    assert inventario.asientos_vendidos == ["A2"] and inventario.version > version
+
+    inventario.marcar_asiento_ocupado("Z1")
+    inventario.marcar_asiento_vendido("Z1")
+    assert len(eventos) == 3 and not inventario.esta_ocupado("Z1") and not inventario.esta_vendido("Z1")
+
+    # Renovar las retenciones propias (process_order) no cambia el mapa: solo se notifican las nuevas
+    assert inventario.reservar_asientos(["B4", "B5"], "s1", 60)
+    version = inventario.version
+    assert inventario.reservar_asientos(["B5", "B4"], "s1", 60) and inventario.retener_asiento("B4", "s1", 60)
+    assert len(eventos) == 4 and inventario.version == version
+    assert inventario.reservar_asientos(["B4", "B2", "B2"], "s1", 60)
+    assert eventos[3:] == [("OCUPAR", ["B4", "B5"]), ("OCUPAR", ["B2"])]
+    print("Notificaciones solo con cambios: OK")
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+
+def probar_vencimiento_retenciones():
+    reloj = Reloj()
+    inventario = AsientosCollection(["A", "B"], 5, reloj=reloj)
+    eventos = []
+    inventario.observador = lambda accion, asientos: eventos.append((accion, asientos))
+
+    assert inventario.retener_asiento("A1", "s1", 10)
+    assert inventario.retener_asiento("A2", "s1", 10)
+    assert inventario.retener_asiento("B1", "s2", 30)
+    assert not inventario.retener_asiento("A1", "s2", 10)  # Retenido por otra sesión
+
+    # Renovar deja obsoleta la entrada anterior del heap: vencer en t=10 no debe liberar A1
+    reloj.ahora = 5.0
+    assert inventario.retener_asiento("A1", "s1", 10)
+    # Liberar y volver a retener (otra sesión) también deja una entrada obsoleta de A2
+    assert inventario.liberar_asiento("A2", "s1") and inventario.retener_asiento("A2", "s2", 20)
+
+    reloj.ahora = 10.0
+    assert inventario.liberar_retenciones_expiradas() == []
+    assert inventario.retenido_por("A1") == "s1" and inventario.retenido_por("A2") == "s2"
+    assert round(inventario.tiempo_restante_retencion("A1"), 6) == 5.0
+
+    reloj.ahora = 15.0
+    assert inventario.liberar_retenciones_expiradas() == ["A1"]
+    assert not inventario.esta_ocupado("A1") and inventario.retenciones_de("s1") == {}
+    assert inventario.retener_asiento("A1", "s2", 10)  # Ya libre para otra sesión
+
+    reloj.ahora = 100.0
+    assert sorted(inventario.asientos_ocupados) == [] and inventario.numero_retenciones == 0
+    liberados = [asientos for accion, asientos in eventos if accion == "LIBERAR"]
+    assert liberados[0] == ["A2"] and liberados[1] == ["A1"]
+    assert sorted(sum(liberados[2:], [])) == ["A1", "A2", "B1"]  # Cada retención vencida una sola vez
+
+    # Vender un asiento retenido quita la retención: su vencimiento ya no lo libera
+    assert inventario.retener_asiento("B2", "s3", 10)
+    assert inventario.confirmar_venta_retenidos(["B2"], "s3")
+    reloj.ahora = 200.0
+    assert inventario.liberar_retenciones_expiradas() == [] and inventario.esta_vendido("B2")
+
+    # Cancelar o reiniciar la compra libera de una vez todo lo que retiene la sesión
+    assert inventario.reservar_asientos(["A3", "B4"], "s4", 60) and inventario.retener_asiento("A4", "s5", 60)
+    assert inventario.liberar_retenciones_de("s4") == ["A3", "B4"]
+    assert inventario.retenciones_de("s4") == {} and inventario.retenido_por("A4") == "s5"
+    assert inventario.liberar_retenciones_de("s4") == [] and inventario.asientos_ocupados == ["A4"]
+    print("Vencimiento de retenciones: OK")
+
+
+def probar_reservas_concurrentes():
+    inventario = AsientosCollectionConcurrente(["A", "B", "C"], 6)
+    asientos = inventario.listar_asientos()
+    # Sombra actualizada por el observador (que corre con las filas bloqueadas):
+    # un OCUPAR sobre un asiento ya ocupado sería una doble retención
+    ocupados, dobles = set(), []
+
+    def observar(accion, cambiados):
+        for asiento_id in cambiados:
+            if accion == "OCUPAR":
+                if asiento_id in ocupados:
+                    dobles.append(asiento_id)
+                ocupados.add(asiento_id)
+            elif accion == "LIBERAR":
+                ocupados.discard(asiento_id)
+
+    inventario.observador = observar
+    vigentes = {}  # sesión -> asientos reservados aún no liberados
+    parciales = []
+    inicio = threading.Barrier(8)
+
+    def comprador(numero):
+        aleatorio = random.Random(numero)
+        inicio.wait()
+        for intento in range(300):
+            sesion = f"s{numero}-{intento}"  # Sesión nueva por intento: nunca es una renovación
+            pedido = aleatorio.sample(asientos, aleatorio.randint(2, 5))  # Suele cruzar filas
+            if inventario.reservar_asientos(pedido, sesion, 60):
+                if set(inventario.retenciones_de(sesion)) != set(pedido):
+                    parciales.append((sesion, pedido))
+                if aleatorio.random() < 0.7:
+                    for asiento_id in pedido:
+                        inventario.liberar_asiento(asiento_id, sesion)
+                else:
+                    vigentes[sesion] = pedido
+            elif inventario.retenciones_de(sesion):
+                parciales.append((sesion, pedido))
+
+    intervalo = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Más cambios de hilo para provocar carreras
+    try:
+        hilos = [threading.Thread(target=comprador, args=(numero,)) for numero in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        sys.setswitchinterval(intervalo)
+
+    assert not dobles, f"Asientos retenidos dos veces: {dobles}"
+    assert not parciales, f"Reservas parciales: {parciales[:3]}"
+    # Los asientos retenidos al final son exactamente la unión disjunta de las reservas vigentes
+    retenidos = [asiento_id for pedido in vigentes.values() for asiento_id in pedido]
+    assert len(retenidos) == len(set(retenidos))
+    assert sorted(inventario.asientos_ocupados) == sorted(retenidos) == sorted(ocupados)
+    for sesion, pedido in vigentes.items():
+        assert all(inventario.retenido_por(asiento_id) == sesion for asiento_id in pedido)
+    print(f"Reservas concurrentes: OK ({len(vigentes)} vigentes, {len(retenidos)} asientos)")
+
+
+def main():
+    probar_bitsets()
+    probar_notificaciones()
+    probar_vencimiento_retenciones()
+    probar_reservas_concurrentes()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from memento import SeleccionAsientos, GestorHistorialSeleccion
+from memento import SeleccionAsientos, GestorHistorialSeleccion, GestorHistorialDeltas
 
 def main():
     seleccion = SeleccionAsientos()
@@ -42,5 +42,28 @@ def main():
     print("\n✅ Confirmando selección:")
     seleccion.confirmar_seleccion()
 
+    # Los mementos consecutivos comparten estructura: restaurar no copia la selección
+    antes = seleccion.crear_memento()
+    seleccion.seleccionar_asiento("C1")
+    despues = seleccion.crear_memento()
+    assert despues._get_conjunto_asientos()._cabeza.siguiente is antes._get_conjunto_asientos()._cabeza
+    seleccion.restaurar_desde_memento(antes)
+    assert seleccion.obtener_estado_actual()["asientos"] == antes._get_estado_asientos()
+    print("\n♻️  Mementos con estructura compartida: OK")
+
+    # Historial por operaciones: acotado y con el primer estado fijo al deshacer
+    seleccion = SeleccionAsientos()
+    historial = GestorHistorialDeltas(profundidad_maxima=3, intervalo_checkpoint=2)
+    for asiento in ["A1", "A2", "A3", "A4"]:
+        seleccion.seleccionar_asiento(asiento)
+        historial.guardar(seleccion.crear_memento())
+    assert len(historial) == 3
+    for _ in range(5):
+        seleccion.restaurar_desde_memento(historial.deshacer())
+    assert seleccion.obtener_estado_actual()["asientos"] == ["A1", "A2"]
+    seleccion.restaurar_desde_memento(historial.rehacer())
+    assert seleccion.obtener_estado_actual()["asientos"] == ["A1", "A2", "A3"]
+    print("📦 Historial por operaciones acotado: OK")
+
 if __name__ == "__main__":
     main()
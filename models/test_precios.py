@@ -0,0 +1,114 @@
+# test_precios.py
+
+import os
+import random
+import sys
+
+# Permite ejecutarlo como script desde models/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import precios
+from models.chain import ItemBoleta, ItemConfiteria, ManejadorCalculoPreciosYImpuestos, Pedido
+from models.precios import MotorPrecios, a_centavos, a_monto, motor_desde_texto
+from models.state import EventoPedido
+
+
+def pedido(boletas, confiteria=()):
+    return Pedido("P", [ItemBoleta(*boleta) if isinstance(boleta, tuple) else ItemBoleta(boleta) for boleta in boletas],
+                  [ItemConfiteria(*item) for item in confiteria], "efectivo")
+
+
+def probar_centavos():
+    assert a_centavos(0.1 + 0.2) == 30 and a_centavos("19.99") == 1999 and a_centavos(10000.0) == 1000000
+    # Mitad hacia arriba sobre el valor decimal escrito, no sobre el binario del float
+    assert a_centavos(1.005) == 101 and a_centavos("0.004") == 0 and a_centavos("2.675") == 268
+    assert a_monto(1999) == 19.99
+
+    # Las tasas en puntos básicos redondean a la mitad hacia arriba en enteros
+    assert precios._aplicar_tasa(3, 1900) == 1  # 0.57 -> 1
+    assert precios._aplicar_tasa(2, 1900) == 0  # 0.38 -> 0
+    assert precios._aplicar_tasa(50, 1000) == 5 and precios._aplicar_tasa(5, 1000) == 1  # 0.5 -> 1
+    print("Centavos y puntos básicos: OK")
+
+
+def probar_cotizacion():
+    motor = motor_desde_texto("preferencial=12000.50", "A=preferencial", "boleta=1900,confiteria=800")
+    orden = pedido(["A1", ("B1", 9999.99)], [("Palomitas", 3, 1.15), ("Agua", 1, 0.0)])
+    cotizacion = motor.cotizar(orden)
+
+    # Cotizar no modifica el pedido; la fila sin zona conserva su precio
+    assert [item.precio for item in orden.items_boletas] == [10000.0, 9999.99]
+    assert cotizacion.precios_boletas == [1200050, 999999]
+    assert cotizacion.subtotales_por_categoria == {"boleta": 1200050 + 999999, "confiteria": 345}
+    # El impuesto se redondea una vez por categoría, no por línea (3 x 9.2 centavos = 27.6 -> 28)
+    assert cotizacion.impuestos == (2200049 * 1900 + 5000) // 10000 + 28
+    assert cotizacion.total == cotizacion.subtotal + cotizacion.impuestos
+
+    # Una categoría que suma 0 se mantiene en la cotización
+    gratis = motor.cotizar(pedido(["B2"], [("Cortesía", 2, 0.0)]))
+    assert gratis.subtotales_por_categoria == {"boleta": 1000000, "confiteria": 0}
+
+    # La etapa de precios (después de la validación) guarda en cada boleta el precio cobrado
+    orden.disparar(EventoPedido.VALIDAR)
+    ManejadorCalculoPreciosYImpuestos(motor).ejecutar_etapa(orden)
+    assert [item.precio for item in orden.items_boletas] == [12000.5, 9999.99]
+    assert orden.total_final == a_monto(cotizacion.total)
+    print("Cotización por zona y categoría: OK")
+
+
+def probar_lote():
+    aleatorio = random.Random(7)
+    motor = MotorPrecios({"vip": 2500000, "gratis": 0}, {"A": "vip", "B": "gratis"}, {"confiteria": 800})
+    pedidos = []
+    for _ in range(300):
+        boletas = [(f"{aleatorio.choice('ABCD')}{aleatorio.randint(1, 12)}", aleatorio.choice([0.0, 8500.5, 10000.0]))
+                   for _ in range(aleatorio.randint(0, 4))]
+        confiteria = [("Combo", aleatorio.randint(1, 3), aleatorio.choice([0.0, 4.35, 12.99]))
+                      for _ in range(aleatorio.randint(0, 2))]
+        pedidos.append(pedido(boletas, confiteria))
+
+    individuales = [motor.cotizar(p) for p in pedidos]
+    lote = motor.cotizar_lote(pedidos)
+    for uno, otro in zip(individuales, lote):
+        assert (uno.subtotal, uno.impuestos, uno.subtotales_por_categoria) == \
+               (otro.subtotal, otro.impuestos, otro.subtotales_por_categoria)
+
+    assert [c.precios_boletas for c in individuales] == [c.precios_boletas for c in lote]
+    assert motor.cotizar_lote([]) == [] and motor.cotizar_lote([pedido([])])[0].subtotales_por_categoria == {}
+    print(f"Cotización por lotes ({'numpy' if precios.np is not None else 'Python'}) igual a la individual: OK")
+
+
+def probar_numpy_igual_a_python():
+    if precios.np is None:
+        print("Cotización con numpy igual a Python puro: omitida (numpy no instalado)")
+        return
+    aleatorio = random.Random(11)
+    motor = MotorPrecios({"vip": 1850075, "general": 999999}, {"A": "vip", "B": "general"},
+                         {"boleta": 1900, "confiteria": 833})
+    pedidos = [pedido([(f"{aleatorio.choice('ABC')}{aleatorio.randint(1, 20)}", aleatorio.choice([0.0, 7300.25]))
+                       for _ in range(aleatorio.randint(0, 6))],
+                      [("Combo", aleatorio.randint(1, 5), aleatorio.choice([0.01, 4.35, 15.5]))
+                       for _ in range(aleatorio.randint(0, 3))])
+               for _ in range(500)]
+
+    con_numpy = motor.cotizar_lote(pedidos)
+    np, precios.np = precios.np, None
+    try:
+        sin_numpy = motor.cotizar_lote(pedidos)
+    finally:
+        precios.np = np
+    for uno, otro in zip(con_numpy, sin_numpy):
+        assert (uno.subtotal, uno.impuestos, uno.total, uno.subtotales_por_categoria, uno.precios_boletas) == \
+               (otro.subtotal, otro.impuestos, otro.total, otro.subtotales_por_categoria, otro.precios_boletas)
+    print("Cotización con numpy igual a Python puro: OK")
+
+
+def main():
+    probar_centavos()
+    probar_cotizacion()
+    probar_lote()
+    probar_numpy_igual_a_python()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# test_registro_funciones.py
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Permite ejecutarlo como script desde models/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.registro_funciones import RegistroInventarios, clave_funcion, distribuciones_desde_texto, normalizar_horario
+
+
+class Reloj:
+    def __init__(self, ahora: datetime):
+        self.ahora = ahora
+
+    def __call__(self) -> datetime:
+        return self.ahora
+
+
+def esperar_error(funcion, *args):
+    try:
+        funcion(*args)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError("Se esperaba ValueError")
+
+
+def probar_horarios():
+    reloj = Reloj(datetime(2026, 10, 18, 12, 0))
+    registro = RegistroInventarios(reloj=reloj, salas=["1"])
+    registro.obtener("1", "2026-10-18T19:30")
+
+    # Un horario con zona horaria se rechaza en lugar de compararse con el reloj local
+    for horario in ("2026-10-18T19:30+00:00", "2026-10-18T19:30Z", "no-es-fecha"):
+        print("Rechazado:", esperar_error(registro.obtener, "1", horario))
+    reloj.ahora += timedelta(hours=1)
+    assert registro.obtener("1", "2026-10-18T20:00") is not None  # La expulsión sigue funcionando
+
+    reloj.ahora = datetime(2026, 10, 18, 22, 45)
+    assert registro.expulsar_finalizadas() == 1
+    assert registro.funciones_activas() == [("1", "2026-10-18T20:00")]
+
+    # Una función que ya terminó (o termina justo ahora) no se abre ni se recrea
+    print("Rechazado:", esperar_error(registro.obtener, "1", "2001-01-01T19:30"))
+    reloj.ahora = datetime(2026, 10, 18, 23, 0)
+    print("Rechazado:", esperar_error(registro.obtener, "1", "2026-10-18T20:00"))
+
+
+def probar_normalizacion():
+    registro = RegistroInventarios(reloj=Reloj(datetime(2026, 10, 18, 12, 0)), salas=["1"])
+    inventario = registro.obtener("1", "2030-01-01T19:30")
+    # Las distintas escrituras del mismo horario comparten inventario: el asiento se vende una vez
+    for horario in ("2030-01-01T19:30:00", "2030-01-01 19:30", "2030-01-01T19:30:00.000"):
+        assert registro.obtener("1", horario) is inventario
+        assert registro.buscar("1", horario) is inventario
+    assert registro.funciones_activas() == [("1", "2030-01-01T19:30")]
+    assert normalizar_horario("2030-01-01 19:30:00") == "2030-01-01T19:30"
+    assert clave_funcion("1", "") == ("1", None)
+    assert registro.buscar("1", "no-es-fecha") is None
+
+
+def probar_salas():
+    registro = RegistroInventarios(salas=["1", "2"])
+    registro.obtener("1")
+    registro.obtener("2")
+    print("Rechazado:", esperar_error(registro.obtener, "99"))
+    registro.configurar_sala("VIP", ["A"], 8)
+    assert registro.obtener("VIP").asientos_por_fila == 8
+    assert len(registro) == 3
+
+    # Sin lista de salas se acepta cualquiera (comportamiento anterior)
+    assert RegistroInventarios().obtener("cualquiera") is not None
+
+    # Distribuciones configuradas por texto (DISTRIBUCION_SALAS en app.py)
+    distribuciones = distribuciones_desde_texto("1=ABCD/12, IMAX = ABCDEFGH/20")
+    assert distribuciones["1"].filas == ["A", "B", "C", "D"] and distribuciones["IMAX"].asientos_por_fila == 20
+    for sala, distribucion in distribuciones.items():
+        registro.configurar_sala(sala, distribucion.filas, distribucion.asientos_por_fila)
+    assert registro.obtener("IMAX").filas[-1] == "H"
+    assert distribuciones_desde_texto(None) == {}
+    print("Rechazado:", esperar_error(distribuciones_desde_texto, "1=ABC/diez"))
+    print("Rechazado:", esperar_error(distribuciones_desde_texto, "1=/10"))
+
+
+def probar_tope():
+    reloj = Reloj(datetime(2026, 10, 18, 12, 0))
+    registro = RegistroInventarios(reloj=reloj, max_inventarios=3, intervalo_expulsion=timedelta(minutes=1))
+    vendida = registro.obtener("1")
+    vendida.confirmar_venta_asientos(["A1"])
+    registro.obtener("2")
+    registro.obtener("3")
+
+    # Los vacíos recién consultados no se expulsan (una petición podría estar usándolos)
+    print("Rechazado:", esperar_error(registro.obtener, "4"))
+
+    reloj.ahora += timedelta(minutes=2)
+    registro.obtener("3")  # Consultado recién: se conserva
+    cuarta = registro.obtener("4")
+    assert sorted(registro.funciones_activas()) == [("1", None), ("3", None), ("4", None)]
+    assert registro.obtener("1") is vendida and vendida.asientos_vendidos == ["A1"]
+
+    # Un inventario expulsado y recreado no repite versiones del anterior (caché del mapa, ETags)
+    cuarta.marcar_asiento_ocupado("A1")
+    cuarta.desmarcar_asiento_ocupado("A1")
+    reloj.ahora += timedelta(minutes=2)
+    registro.obtener("1")
+    registro.obtener("3")
+    assert registro.obtener("5") is not None and ("4", None) not in registro
+    nueva = registro.buscar("5")
+    nueva.marcar_asiento_ocupado("A1")
+    assert nueva.version > cuarta.version > 0
+    print("Tope de inventarios: OK")
+
+
+def main():
+    probar_horarios()
+    probar_normalizacion()
+    probar_salas()
+    probar_tope()
+
+
+if __name__ == "__main__":
+    main()
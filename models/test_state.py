@@ -1,21 +1,92 @@
-from state import Pedido, EstadoPedidoProcesandoPago
+from state import EstadoPedido, EventoPedido, MaquinaEstados, TRANSICIONES_PEDIDO, TransicionInvalida, transiciones_pedido
 
-# Crear pedido de prueba
-pedido = Pedido(id="123", items=["Boleta A", "Combo 1"], metodo_pago="Tarjeta", total=25.0)
 
-# Estado inicial
-print("Estado inicial: Pendiente")
-pedido.procesar_pago()
+class PedidoPrueba:
+    def __init__(self):
+        self.estado = EstadoPedido.PENDIENTE
+        self.reembolsado = False
+        self.liberado = False
 
-# Simular que el sistema externo notifica que el pago fue exitoso
-if isinstance(pedido._estado_actual, EstadoPedidoProcesandoPago):
-    pedido._estado_actual.notificado_pago_exitoso(pedido)
 
-# Confirmar
-pedido.confirmar()
+def main():
+    transiciones = []
+    maquina = MaquinaEstados(EstadoPedido, EventoPedido, TRANSICIONES_PEDIDO, acciones={
+        "liberar_pedido": lambda pedido: setattr(pedido, "liberado", True),
+        "marcar_reembolsado": lambda pedido: setattr(pedido, "reembolsado", True),
+    })
+    maquina.observador = lambda pedido, origen, evento, destino: transiciones.append((origen, evento, destino))
 
-# Emitir entradas
-pedido.emitir_entradas()
+    # Flujo completo: pendiente -> pago -> confirmado -> reembolso
+    pedido = PedidoPrueba()
+    print("Estado inicial:", pedido.estado.value)
+    for evento in (EventoPedido.VALIDAR, EventoPedido.CALCULAR_PRECIOS, EventoPedido.APLICAR_DESCUENTOS,
+                   EventoPedido.PROCESAR_PAGO, EventoPedido.CONFIRMAR_PAGO, EventoPedido.COMPLETAR):
+        print(f"{evento.value}: {maquina.disparar(pedido, evento).value}")
+    assert pedido.estado == EstadoPedido.COMPLETADO
 
-# Solicitar reembolso
-pedido.solicitar_reembolso()
+    # No se puede cancelar un pedido completado
+    assert not maquina.permite(pedido.estado, EventoPedido.CANCELAR)
+    try:
+        maquina.disparar(pedido, EventoPedido.CANCELAR)
+        raise AssertionError("Se esperaba TransicionInvalida")
+    except TransicionInvalida as e:
+        print("Rechazado:", e)
+    assert pedido.estado == EstadoPedido.COMPLETADO
+
+    maquina.disparar(pedido, EventoPedido.REEMBOLSAR)
+    assert pedido.estado == EstadoPedido.REEMBOLSO_PROCESADO and pedido.reembolsado
+    print("Reembolsado:", pedido.estado.value)
+
+    # Las etapas previas al pago van en orden, sin repetirse ni saltar al pago
+    fallido = PedidoPrueba()
+    assert not maquina.permite(fallido.estado, EventoPedido.PROCESAR_PAGO)
+    assert not maquina.permite(fallido.estado, EventoPedido.CALCULAR_PRECIOS)
+    maquina.disparar(fallido, EventoPedido.VALIDAR)
+    assert not maquina.permite(fallido.estado, EventoPedido.VALIDAR)
+    assert not maquina.permite(fallido.estado, EventoPedido.CONFIRMAR_PAGO)
+    maquina.disparar(fallido, EventoPedido.CALCULAR_PRECIOS)
+    maquina.disparar(fallido, EventoPedido.APLICAR_DESCUENTOS)
+    # Solo la última etapa confirma sin pasarela (total 0)
+    assert maquina.permite(fallido.estado, EventoPedido.CONFIRMAR_PAGO)
+
+    # Un pago fallido ejecuta la acción de liberación
+    maquina.disparar(fallido, EventoPedido.PROCESAR_PAGO)
+    maquina.disparar(fallido, EventoPedido.FALLAR)
+    assert fallido.estado == EstadoPedido.FALLIDO and fallido.liberado
+    assert not maquina.permite(fallido.estado, EventoPedido.REEMBOLSAR)
+
+    # llevar_a busca el evento de la tabla que alcanza el estado pedido
+    directo = PedidoPrueba()
+    assert maquina.llevar_a(directo, EstadoPedido.CANCELADO) == EstadoPedido.CANCELADO and directo.liberado
+    try:
+        maquina.llevar_a(directo, EstadoPedido.PENDIENTE)
+        raise AssertionError("Se esperaba TransicionInvalida")
+    except TransicionInvalida as e:
+        print("Rechazado:", e)
+        assert e.evento == EstadoPedido.PENDIENTE
+
+    # Una cadena con otro orden de etapas tiene su propia tabla, con el mismo observador
+    derivada = maquina.derivar(transiciones_pedido((EventoPedido.VALIDAR, EventoPedido.APLICAR_DESCUENTOS,
+                                                    EventoPedido.CALCULAR_PRECIOS)))
+    otro_orden = PedidoPrueba()
+    for evento in (EventoPedido.VALIDAR, EventoPedido.APLICAR_DESCUENTOS, EventoPedido.CALCULAR_PRECIOS):
+        derivada.disparar(otro_orden, evento)
+    assert derivada.permite(otro_orden.estado, EventoPedido.CONFIRMAR_PAGO)
+    assert not maquina.permite(EstadoPedido.APLICANDO_DESCUENTOS, EventoPedido.CALCULAR_PRECIOS)
+    try:
+        transiciones_pedido((EventoPedido.VALIDAR, EventoPedido.VALIDAR))
+        raise AssertionError("Se esperaba ValueError")
+    except ValueError as e:
+        print("Rechazado:", e)
+
+    # Cada transición llega al observador
+    assert len(transiciones) == 16
+    assert transiciones[11] == (EstadoPedido.PROCESANDO_PAGO, EventoPedido.FALLAR, EstadoPedido.FALLIDO)
+    assert transiciones[12] == (EstadoPedido.PENDIENTE, EventoPedido.CANCELAR, EstadoPedido.CANCELADO)
+    assert transiciones[-1] == (EstadoPedido.APLICANDO_DESCUENTOS, EventoPedido.CALCULAR_PRECIOS,
+                                EstadoPedido.CALCULANDO_PRECIOS)
+    print("Transiciones registradas:", len(transiciones))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# servicios/diario_eventos.py
+
+import json
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from models.state import EstadoPedido
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evento
+EVENTO_ESTADO_PEDIDO = 1
+EVENTO_ASIENTOS = 2
+EVENTO_CANJES = 3  # Reglas de descuento con tope usadas por una venta
+
+# Acciones sobre asientos (un byte en el registro)
+ACCIONES_ASIENTOS = ("OCUPAR", "LIBERAR", "VENDER", "DEVOLVER")
+_CODIGO_ACCION = {accion: codigo for codigo, accion in enumerate(ACCIONES_ASIENTOS)}
+
+# Registro: [longitud u32][crc32 u32] + cuerpo. Cuerpo: [tipo u8][marca de tiempo f64][dato u8]
+# seguido de textos UTF-8 con prefijo de longitud u32 (sala y horario vienen del usuario).
+_MARCO = struct.Struct("<II")
+_CABECERA = struct.Struct("<BdB")
+_LONGITUD_TEXTO = struct.Struct("<I")
+
+_PATRON_SEGMENTO = re.compile(r"^diario-(\d{8})\.bin$")
+
+# Estados tras los que el diario ya no tiene nada que aportar sobre el pedido
+ESTADOS_CERRADOS = frozenset(estado.value for estado in (
+    EstadoPedido.FALLIDO, EstadoPedido.CANCELADO,
+    EstadoPedido.REEMBOLSO_PROCESADO, EstadoPedido.REEMBOLSO_RECHAZADO,
+))
+
+
+def codificar_evento(tipo: int, dato: int, textos: List[str], marca_tiempo: float = None) -> bytes:
+    partes = [_CABECERA.pack(tipo, time.time() if marca_tiempo is None else marca_tiempo, dato)]
+    for texto in textos:
+        datos = texto.encode("utf-8")
+        partes.append(_LONGITUD_TEXTO.pack(len(datos)))
+        partes.append(datos)
+    cuerpo = b"".join(partes)
+    return _MARCO.pack(len(cuerpo), zlib.crc32(cuerpo)) + cuerpo
+
+
+def decodificar_eventos(datos: bytes) -> Iterator[Tuple[int, float, int, List[str]]]:
+    """Itera (tipo, marca de tiempo, dato, textos). Se detiene en el primer registro
+    incompleto o corrupto (p. ej. una escritura cortada por una caída)"""
+    posicion = 0
+    while posicion + _MARCO.size <= len(datos):
+        longitud, crc = _MARCO.unpack_from(datos, posicion)
+        inicio = posicion + _MARCO.size
+        cuerpo = datos[inicio:inicio + longitud]
+        if len(cuerpo) < longitud or zlib.crc32(cuerpo) != crc:
+            return
+        tipo, marca_tiempo, dato = _CABECERA.unpack_from(cuerpo)
+        textos = []
+        desplazamiento = _CABECERA.size
+        while desplazamiento < longitud:
+            (largo,) = _LONGITUD_TEXTO.unpack_from(cuerpo, desplazamiento)
+            desplazamiento += _LONGITUD_TEXTO.size
+            textos.append(cuerpo[desplazamiento:desplazamiento + largo].decode("utf-8"))
+            desplazamiento += largo
+        yield tipo, marca_tiempo, dato, textos
+        posicion = inicio + longitud
+
+
+class EstadoRecuperado:
+    """Estado proyectado a partir del diario: estado de cada pedido, asientos vendidos por
+    función y usos de cada regla de descuento con tope"""
+
+    def __init__(self):
+        self.estados_pedidos: Dict[str, str] = {}
+        self.asientos_vendidos: Dict[Tuple[str, Optional[str]], Set[str]] = {}
+        self.usos_descuento: Dict[str, int] = {}
+        # Pedido podado con la numeración más alta: la secuencia de IDs no debe retroceder
+        self.ultimo_pedido_podado: Optional[str] = None
+
+    def aplicar(self, tipo: int, dato: int, textos: List[str]):
+        if tipo == EVENTO_ESTADO_PEDIDO:
+            pedido_id, estado = textos
+            self.estados_pedidos[pedido_id] = estado
+        elif tipo == EVENTO_ASIENTOS:
+            sala, horario, *asientos = textos
+            accion = ACCIONES_ASIENTOS[dato]
+            clave = (sala, horario or None)
+            if accion == "VENDER":
+                self.asientos_vendidos.setdefault(clave, set()).update(asientos)
+            elif accion == "DEVOLVER" and clave in self.asientos_vendidos:
+                self.asientos_vendidos[clave].difference_update(asientos)
+            # OCUPAR/LIBERAR quedan solo como auditoría: las retenciones no sobreviven a un reinicio
+        elif tipo == EVENTO_CANJES:
+            _, *reglas = textos
+            for regla in reglas:
+                self.usos_descuento[regla] = self.usos_descuento.get(regla, 0) + 1
+
+    def podar(self, funcion_terminada: Callable[[Tuple[str, Optional[str]]], bool] = None,
+              numero_pedido: Callable[[str], Optional[int]] = None):
+        """Descarta las funciones terminadas y los pedidos en un estado cerrado.
+        Sin numero_pedido los pedidos se conservan (no se podría fijar la secuencia)."""
+        for clave in [clave for clave, asientos in self.asientos_vendidos.items()
+                      if not asientos or (funcion_terminada is not None and funcion_terminada(clave))]:
+            del self.asientos_vendidos[clave]
+        if numero_pedido is None:
+            return
+        cerrados = [pedido_id for pedido_id, estado in self.estados_pedidos.items() if estado in ESTADOS_CERRADOS]
+        if not cerrados:
+            return
+        candidatos = cerrados + ([self.ultimo_pedido_podado] if self.ultimo_pedido_podado else [])
+        self.ultimo_pedido_podado = max(candidatos, key=lambda pedido_id: numero_pedido(pedido_id) or 0)
+        for pedido_id in cerrados:
+            del self.estados_pedidos[pedido_id]
+
+    def pedidos_conocidos(self) -> List[str]:
+        """IDs de pedidos que fijan la numeración al arrancar (incluye el último podado)"""
+        return list(self.estados_pedidos) + ([self.ultimo_pedido_podado] if self.ultimo_pedido_podado else [])
+
+    def a_dict(self) -> dict:
+        return {
+            "estados_pedidos": self.estados_pedidos,
+            "ultimo_pedido_podado": self.ultimo_pedido_podado,
+            "usos_descuento": self.usos_descuento,
+            "asientos_vendidos": [[sala, horario or "", sorted(asientos)]
+                                  for (sala, horario), asientos in self.asientos_vendidos.items() if asientos],
+        }
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "EstadoRecuperado":
+        estado = cls()
+        estado.estados_pedidos = dict(datos.get("estados_pedidos", {}))
+        estado.ultimo_pedido_podado = datos.get("ultimo_pedido_podado")
+        estado.usos_descuento = dict(datos.get("usos_descuento", {}))
+        for sala, horario, asientos in datos.get("asientos_vendidos", []):
+            estado.asientos_vendidos[(sala, horario or None)] = set(asientos)
+        return estado
+
+
+class DiarioEventos:
+    """Diario de solo-anexar con los cambios de estado de pedidos y asientos.
+
+    Los eventos se escriben como registros binarios en segmentos
+    `diario-NNNNNNNN.bin`. Cada `intervalo_snapshot` eventos se cierra el
+    segmento y se abre uno nuevo; un hilo de fondo aplica el segmento cerrado a
+    su propia copia del estado, la poda (funciones terminadas y pedidos
+    cerrados) y guarda la instantánea. Al arrancar solo se reproducen los
+    segmentos posteriores a la última instantánea. Los segmentos antiguos se
+    conservan como auditoría.
+    Escribir un evento es una escritura en el buffer del archivo (sin fsync);
+    los segmentos cerrados y las instantáneas sí se sincronizan a disco, fuera
+    del lock y del hilo de la petición.
+    """
+
+    def __init__(self, directorio: str, intervalo_snapshot: int = 10000,
+                 funcion_terminada: Callable[[Tuple[str, Optional[str]]], bool] = None,
+                 numero_pedido: Callable[[str], Optional[int]] = None):
+        self.directorio = directorio
+        self._intervalo_snapshot = intervalo_snapshot
+        self._funcion_terminada = funcion_terminada
+        self._numero_pedido = numero_pedido
+        os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._suspendido = False
+        self._estado, self._segmento = self._recuperar()
+        self._eventos_desde_snapshot = 0
+        self._archivo = open(self._ruta_segmento(self._segmento), "ab")
+        # Segmentos cerrados pendientes de instantánea (None detiene el hilo)
+        self._segmentos_cerrados: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._estado_snapshot: Optional[EstadoRecuperado] = None
+        self._siguiente_segmento = 0
+        self._hilo_snapshots = threading.Thread(target=self._ciclo_snapshots, name="diario-snapshots", daemon=True)
+        self._hilo_snapshots.start()
+
+    # --- Recuperación ---
+
+    @property
+    def estado(self) -> EstadoRecuperado:
+        """Estado recuperado al abrir el diario (los eventos posteriores no lo modifican)"""
+        return self._estado
+
+    def _recuperar(self) -> Tuple[EstadoRecuperado, int]:
+        estado, desde_segmento = self._leer_snapshot()
+        segmentos = self._segmentos_en_disco()
+        eventos = self._reproducir(estado, [segmento for segmento in segmentos if segmento >= desde_segmento])
+        logger.info("Diario recuperado desde el segmento %d: %d eventos reproducidos", desde_segmento, eventos)
+        # Se escribe siempre en un segmento nuevo: un final corrupto del anterior queda aislado
+        return estado, max(segmentos + [desde_segmento - 1]) + 1
+
+    def _leer_snapshot(self) -> Tuple[EstadoRecuperado, int]:
+        ruta_snapshot = os.path.join(self.directorio, "snapshot.json")
+        if not os.path.exists(ruta_snapshot):
+            return EstadoRecuperado(), 0
+        with open(ruta_snapshot, encoding="utf-8") as archivo:
+            datos = json.load(archivo)
+        return EstadoRecuperado.desde_dict(datos["estado"]), datos["segmento"]
+
+    def _segmentos_en_disco(self) -> List[int]:
+        return sorted(int(coincidencia.group(1)) for coincidencia in
+                      map(_PATRON_SEGMENTO.match, os.listdir(self.directorio)) if coincidencia)
+
+    def _reproducir(self, estado: EstadoRecuperado, segmentos: List[int], sincronizar: bool = False) -> int:
+        eventos = 0
+        for segmento in segmentos:
+            with open(self._ruta_segmento(segmento), "rb") as archivo:
+                if sincronizar:
+                    os.fsync(archivo.fileno())
+                for tipo, _, dato, textos in decodificar_eventos(archivo.read()):
+                    estado.aplicar(tipo, dato, textos)
+                    eventos += 1
+        return eventos
+
+    # --- Escritura ---
+
+    def registrar_transicion_pedido(self, pedido, origen, evento, destino):
+        """Observador de models.chain.maquina_pedidos: guarda el estado siguiente del pedido"""
+        self._anexar(EVENTO_ESTADO_PEDIDO, 0, [pedido.id, destino.value])
+
+    def registrar_asientos(self, funcion: Tuple[str, Optional[str]], accion: str, asientos: List[str]):
+        if asientos:
+            sala, horario = funcion
+            self._anexar(EVENTO_ASIENTOS, _CODIGO_ACCION[accion], [sala, horario or "", *asientos])
+
+    def registrar_canjes(self, pedido_id: str, reglas: List[str]):
+        """Usos de cupones con tope de una venta confirmada (ver models.descuentos.reglas_canjeadas)"""
+        if reglas:
+            self._anexar(EVENTO_CANJES, 0, [pedido_id, *reglas])
+
+    @contextmanager
+    def suspendido(self):
+        """Ignora los eventos mientras dura el bloque (p. ej. al restaurar el estado al arrancar)"""
+        self._suspendido = True
+        try:
+            yield
+        finally:
+            self._suspendido = False
+
+    def _anexar(self, tipo: int, dato: int, textos: List[str]):
+        if self._suspendido:
+            return
+        registro = codificar_evento(tipo, dato, textos)
+        with self._lock:
+            if self._archivo is None:
+                return
+            self._archivo.write(registro)
+            self._archivo.flush()
+            self._eventos_desde_snapshot += 1
+            if self._eventos_desde_snapshot >= self._intervalo_snapshot:
+                self._rotar_segmento()
+
+    def guardar_snapshot(self):
+        """Cierra el segmento actual y espera a que su instantánea quede en disco"""
+        with self._lock:
+            if self._archivo is None:
+                return
+            self._rotar_segmento()
+        self._segmentos_cerrados.join()
+
+    def _rotar_segmento(self):
+        # Bajo el lock solo se cambia de archivo; el fsync y la instantánea van al hilo de fondo
+        self._archivo.close()
+        self._segmentos_cerrados.put(self._segmento)
+        self._segmento += 1
+        self._archivo = open(self._ruta_segmento(self._segmento), "ab")
+        self._eventos_desde_snapshot = 0
+
+    # --- Instantáneas (hilo de fondo) ---
+
+    def _ciclo_snapshots(self):
+        while True:
+            segmento = self._segmentos_cerrados.get()
+            try:
+                if segmento is None:
+                    return
+                self._guardar_snapshot(segmento)
+            except Exception:
+                # La instantánea anterior sigue siendo válida: al arrancar se reproducen más segmentos
+                logger.exception("No se pudo guardar la instantánea del segmento %d", segmento)
+            finally:
+                self._segmentos_cerrados.task_done()
+
+    def _guardar_snapshot(self, segmento: int):
+        if self._estado_snapshot is None:
+            # Copia propia leída de disco: el estado recuperado puede estar en uso al arrancar
+            self._estado_snapshot, self._siguiente_segmento = self._leer_snapshot()
+        try:
+            pendientes = [pendiente for pendiente in self._segmentos_en_disco()
+                          if self._siguiente_segmento <= pendiente <= segmento]
+            self._reproducir(self._estado_snapshot, pendientes, sincronizar=True)
+            self._estado_snapshot.podar(self._funcion_terminada, self._numero_pedido)
+        except Exception:
+            # Estado a medio aplicar: se reconstruye desde disco en la próxima instantánea
+            self._estado_snapshot = None
+            raise
+        self._siguiente_segmento = segmento + 1
+        ruta = os.path.join(self.directorio, "snapshot.json")
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump({"segmento": self._siguiente_segmento, "estado": self._estado_snapshot.a_dict()}, archivo)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+
+    def cerrar(self):
+        with self._lock:
+            if self._archivo is None:
+                return
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._archivo.close()
+            self._archivo = None
+        self._segmentos_cerrados.put(None)
+        self._hilo_snapshots.join()
+
+    def _ruta_segmento(self, segmento: int) -> str:
+        return os.path.join(self.directorio, f"diario-{segmento:08d}.bin")
@@ -0,0 +1,198 @@
+# servicios/eventos_asientos.py
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Estado resultante de cada acción del inventario (ver AsientosCollection._notificar)
+ESTADO_POR_ACCION = {
+    "OCUPAR": "retenido",
+    "LIBERAR": "disponible",
+    "VENDER": "vendido",
+    "DEVOLVER": "disponible",
+}
+
+
+def formatear_evento(evento: str, datos: dict, evento_id: str = None) -> str:
+    """Un mensaje Server-Sent Events"""
+    cabecera = f"id: {evento_id}\n" if evento_id is not None else ""
+    return f"{cabecera}event: {evento}\ndata: {json.dumps(datos, separators=(',', ':'))}\n\n"
+
+
+class CanalAsientos:
+    """Cambios de asientos de una función, agrupados en marcos numerados.
+
+    publicar() solo anota el estado final de cada asiento (un asiento que cambia
+    varias veces en una ráfaga aparece una vez). Los cambios pendientes se cierran
+    en un marco cuando pasa `intervalo_segundos` desde el primero; cierra el marco
+    el primer suscriptor que despierta, sin hilos propios. Se guardan los últimos
+    `marcos_retenidos` marcos para reanudar con Last-Event-ID.
+    Los marcos se numeran desde 0 en cada canal; el id enviado al cliente es
+    "<época>-<número>" (id_evento), con una época nueva por canal, así un id de un
+    canal anterior (expulsado o de otro proceso) no se confunde con uno de este.
+    """
+
+    def __init__(self, intervalo_segundos: float = 0.25, marcos_retenidos: int = 1000,
+                 reloj: Callable[[], float] = time.monotonic, epoca: str = None):
+        self.epoca = epoca or uuid.uuid4().hex[:12]
+        self._intervalo = intervalo_segundos
+        self._reloj = reloj
+        self._condicion = threading.Condition()
+        self._pendientes: Dict[str, str] = {}
+        self._primer_pendiente = 0.0
+        self._marcos: deque = deque(maxlen=marcos_retenidos)  # (id, {estado: [asientos]})
+        self._ultimo_id = 0
+        self.suscriptores = 0
+
+    @property
+    def ultimo_id(self) -> int:
+        with self._condicion:
+            self._cerrar_marco_vencido()
+            return self._ultimo_id
+
+    def id_evento(self, numero: int) -> str:
+        return f"{self.epoca}-{numero}"
+
+    def numero_de(self, evento_id: Optional[str]) -> Optional[int]:
+        """Número de marco de un id de este canal, o None si es de otra época o no es válido"""
+        epoca, _, numero = (evento_id or "").rpartition("-")
+        return int(numero) if epoca == self.epoca and numero.isdigit() else None
+
+    def publicar(self, accion: str, asientos: List[str]):
+        estado = ESTADO_POR_ACCION.get(accion)
+        if estado is None or not asientos:
+            return
+        with self._condicion:
+            if not self._pendientes:
+                self._primer_pendiente = self._reloj()
+            for asiento_id in asientos:
+                self._pendientes[asiento_id] = estado
+            self._condicion.notify_all()
+
+    def _cerrar_marco_vencido(self) -> Optional[float]:
+        """Cierra el marco pendiente si ya pasó el intervalo. Retorna los segundos que faltan
+        o None si no hay cambios pendientes (requiere la condición tomada)"""
+        if not self._pendientes:
+            return None
+        faltan = self._primer_pendiente + self._intervalo - self._reloj()
+        if faltan > 0:
+            return faltan
+        cambios: Dict[str, List[str]] = {}
+        for asiento_id, estado in self._pendientes.items():
+            cambios.setdefault(estado, []).append(asiento_id)
+        self._pendientes = {}
+        self._ultimo_id += 1
+        self._marcos.append((self._ultimo_id, cambios))
+        self._condicion.notify_all()
+        return None
+
+    def marcos_desde(self, ultimo_id: int) -> Optional[List[Tuple[int, dict]]]:
+        """Marcos posteriores a ultimo_id, o None si ya no están retenidos (o el id no existe)"""
+        with self._condicion:
+            self._cerrar_marco_vencido()
+            return self._marcos_desde(ultimo_id)
+
+    def _marcos_desde(self, ultimo_id: int) -> Optional[List[Tuple[int, dict]]]:
+        if ultimo_id > self._ultimo_id:
+            return None
+        if ultimo_id == self._ultimo_id:
+            return []
+        primero = self._marcos[0][0] if self._marcos else self._ultimo_id + 1
+        if ultimo_id + 1 < primero:
+            return None
+        return [marco for marco in self._marcos if marco[0] > ultimo_id]
+
+    def esperar(self, ultimo_id: int, timeout: float) -> Optional[List[Tuple[int, dict]]]:
+        """Bloquea hasta que haya marcos posteriores a ultimo_id o pase el timeout
+        (retorna [] en ese caso, o None si ultimo_id ya no se puede reanudar)"""
+        limite = self._reloj() + timeout
+        with self._condicion:
+            while True:
+                faltan = self._cerrar_marco_vencido()
+                marcos = self._marcos_desde(ultimo_id)
+                if marcos is None or marcos:
+                    return marcos
+                restante = limite - self._reloj()
+                if restante <= 0:
+                    return []
+                self._condicion.wait(min(restante, faltan) if faltan is not None else restante)
+
+
+class DifusorAsientos:
+    """Canales de eventos de asientos por función (sala, horario).
+
+    `publicar(funcion, accion, asientos)` tiene la firma de los observadores de
+    RegistroInventarios y se llama con las filas del inventario bloqueadas:
+    solo anota el cambio. Solo las funciones con algún suscriptor (o suscriptores
+    recientes, para reanudar) tienen canal; se guardan hasta `capacidad` canales.
+    """
+
+    def __init__(self, intervalo_segundos: float = 0.25, marcos_retenidos: int = 1000,
+                 capacidad: int = 256, reloj: Callable[[], float] = time.monotonic):
+        self._intervalo = intervalo_segundos
+        self._marcos_retenidos = marcos_retenidos
+        self._capacidad = capacidad
+        self._reloj = reloj
+        self._canales: "OrderedDict[tuple, CanalAsientos]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publicar(self, funcion: tuple, accion: str, asientos: List[str]):
+        canal = self._canales.get(funcion)
+        if canal is not None:
+            canal.publicar(accion, asientos)
+
+    def canal(self, funcion: tuple) -> CanalAsientos:
+        with self._lock:
+            canal = self._canales.get(funcion)
+            if canal is None:
+                canal = self._canales[funcion] = CanalAsientos(self._intervalo, self._marcos_retenidos, self._reloj)
+                # Expulsar los canales menos usados que ya no tienen suscriptores
+                for clave in [clave for clave, otro in self._canales.items() if otro.suscriptores == 0]:
+                    if len(self._canales) <= self._capacidad:
+                        break
+                    if clave != funcion:
+                        del self._canales[clave]
+            self._canales.move_to_end(funcion)
+            return canal
+
+    def escuchar(self, funcion: tuple, ultimo_id: Optional[str], estado_actual: Callable[[], dict],
+                 keepalive_segundos: float = 15.0, revisar: Callable[[], None] = None) -> Iterator[str]:
+        """Genera los mensajes SSE de la función.
+
+        Sin ultimo_id (el Last-Event-ID), si es de otra época del canal o si ya no se
+        puede reanudar desde él, empieza con un evento 'estado' con el estado completo
+        (estado_actual()) y sigue con eventos 'asientos' con los cambios
+        {estado: [asientos]}. Cada mensaje lleva su id "<época>-<número>".
+        `revisar`, si no es None, se llama antes de cada espera (p. ej. para vencer
+        las retenciones del inventario, que solo se liberan al consultarlo).
+        """
+        canal = self.canal(funcion)
+        with self._lock:
+            canal.suscriptores += 1
+        try:
+            yield f"retry: {int(self._intervalo * 1000) + 1000}\n\n"
+            numero = canal.numero_de(ultimo_id)
+            marcos = canal.marcos_desde(numero) if numero is not None else None
+            if marcos is None:
+                # El id se toma antes del estado: los cambios posteriores llegan en los marcos
+                numero = canal.ultimo_id
+                yield formatear_evento("estado", estado_actual(), canal.id_evento(numero))
+            while True:
+                for numero_marco, cambios in marcos or ():
+                    yield formatear_evento("asientos", cambios, canal.id_evento(numero_marco))
+                    numero = numero_marco
+                if revisar is not None:
+                    revisar()
+                marcos = canal.esperar(numero, keepalive_segundos)
+                if marcos is None:
+                    # Un suscriptor lento quedó fuera de los marcos retenidos: se reenvía el estado
+                    numero = canal.ultimo_id
+                    yield formatear_evento("estado", estado_actual(), canal.id_evento(numero))
+                elif not marcos:
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                canal.suscriptores -= 1
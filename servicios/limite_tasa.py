@@ -0,0 +1,142 @@
+# servicios/limite_tasa.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Presupuesto: (ráfaga máxima, solicitudes por segundo)
+Presupuesto = Tuple[int, float]
+
+
+class LimitadorTasa:
+    """Limitador token bucket en memoria por (presupuesto, clave).
+
+    El estado de cada clave es un solo número: el instante en que su bucket
+    vuelve a estar lleno (forma GCRA del token bucket). Una solicitud se admite
+    si faltan menos de (ráfaga - 1) / tasa segundos para ese instante, y cada
+    admisión lo corre 1 / tasa. Las claves se guardan por orden de último uso:
+    las del principio con el bucket ya lleno equivalen a no tener entrada y se
+    descartan al pasar, y si se supera `capacidad` se expulsa la menos usada.
+    Cada verificación cuesta O(1) amortizado.
+    """
+
+    def __init__(self, presupuestos: Dict[str, Presupuesto], capacidad: int = 100000,
+                 reloj: Callable[[], float] = time.monotonic):
+        for nombre, (rafaga, tasa) in presupuestos.items():
+            validar_presupuesto(nombre, rafaga, tasa)
+        self._presupuestos = dict(presupuestos)
+        self._capacidad = capacidad
+        self._reloj = reloj
+        self._llenos_en: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rechazos = 0
+
+    def __contains__(self, presupuesto: str) -> bool:
+        return presupuesto in self._presupuestos
+
+    def __len__(self) -> int:
+        return len(self._llenos_en)
+
+    def permitir(self, presupuesto: str, clave: str, multiplicador: float = 1.0) -> float:
+        """Consume una solicitud del bucket de la clave. Retorna 0 si se admite o los
+        segundos que faltan para que se admita. `multiplicador` escala la ráfaga y la
+        tasa del presupuesto (p. ej. para claves compartidas como una IP)."""
+        return self.permitir_todas(presupuesto, [(clave, multiplicador)])
+
+    def permitir_todas(self, presupuesto: str, claves: Sequence[Tuple[str, float]]) -> float:
+        """Como permitir() para varias (clave, multiplicador) a la vez: la solicitud solo se
+        consume si todas la admiten, así que un rechazo de una no gasta el presupuesto de
+        las demás. Retorna 0 o la mayor espera entre las claves que la rechazan."""
+        rafaga, tasa = self._presupuestos[presupuesto]
+        ahora = self._reloj()
+        with self._lock:
+            admitidas, espera = [], 0.0
+            for clave, multiplicador in claves:
+                intervalo = 1.0 / (tasa * multiplicador)
+                tolerancia = (rafaga * multiplicador - 1) * intervalo
+                entrada = (presupuesto, clave)
+                lleno_en = max(self._llenos_en.get(entrada, ahora), ahora)
+                exceso = lleno_en - ahora - tolerancia
+                # Con un margen mínimo: sumar intervalos en float no debe quitar la última solicitud de la ráfaga
+                if exceso > 1e-9:
+                    espera = max(espera, exceso)
+                admitidas.append((entrada, lleno_en + intervalo))
+            if espera:
+                self.rechazos += 1
+                return espera
+            for entrada, lleno_en in admitidas:
+                self._llenos_en[entrada] = lleno_en
+                self._llenos_en.move_to_end(entrada)
+            self._expulsar(ahora)
+        return 0.0
+
+    def _expulsar(self, ahora: float):
+        # Claves inactivas (bucket lleno) al principio y, si aún sobran, las menos usadas
+        while self._llenos_en:
+            entrada, lleno_en = next(iter(self._llenos_en.items()))
+            if lleno_en > ahora and len(self._llenos_en) <= self._capacidad:
+                break
+            del self._llenos_en[entrada]
+
+
+class LimiteConexiones:
+    """Tope de conexiones simultáneas por clave (p. ej. streams SSE por IP).
+
+    A diferencia de LimitadorTasa no cuenta solicitudes por segundo sino
+    conexiones abiertas: adquirir() ocupa un lugar y liberar() lo devuelve al
+    cerrarse la conexión. Solo se guardan las claves con conexiones abiertas.
+    """
+
+    def __init__(self, maximo_por_clave: int):
+        if maximo_por_clave < 1:
+            raise ValueError(f"El máximo de conexiones por clave debe ser >= 1 (recibido {maximo_por_clave})")
+        self._maximo = maximo_por_clave
+        self._abiertas: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.rechazos = 0
+
+    def __len__(self) -> int:
+        return len(self._abiertas)
+
+    def adquirir(self, clave: str) -> bool:
+        """Ocupa un lugar para la clave. Retorna False si ya tiene el máximo abierto"""
+        with self._lock:
+            abiertas = self._abiertas.get(clave, 0)
+            if abiertas >= self._maximo:
+                self.rechazos += 1
+                return False
+            self._abiertas[clave] = abiertas + 1
+            return True
+
+    def liberar(self, clave: str):
+        with self._lock:
+            abiertas = self._abiertas.get(clave, 0) - 1
+            if abiertas > 0:
+                self._abiertas[clave] = abiertas
+            else:
+                self._abiertas.pop(clave, None)
+
+
+def validar_presupuesto(nombre: str, rafaga: int, tasa: float):
+    """Lanza ValueError si el presupuesto no admite ninguna solicitud o no tiene tasa"""
+    if not rafaga >= 1 or not tasa > 0:
+        raise ValueError(f"Presupuesto '{nombre}' inválido: la ráfaga debe ser >= 1 y la tasa > 0 "
+                         f"(recibido {rafaga}/{tasa})")
+
+
+def presupuestos_desde_texto(texto: Optional[str]) -> Dict[str, Presupuesto]:
+    """Lee presupuestos 'select_seat=20/10,undo=10/5' (endpoint=ráfaga/solicitudes por segundo).
+    Lanza ValueError si alguno está mal escrito o tiene ráfaga < 1 o tasa <= 0."""
+    presupuestos = {}
+    for parte in (texto or "").split(","):
+        if "=" in parte:
+            nombre, valor = (elemento.strip() for elemento in parte.split("=", 1))
+            rafaga, _, tasa = valor.partition("/")
+            try:
+                presupuesto = (int(rafaga), float(tasa or rafaga))
+            except ValueError:
+                raise ValueError(f"Presupuesto '{nombre}' inválido: '{valor}' (se espera ráfaga/tasa)") from None
+            validar_presupuesto(nombre, *presupuesto)
+            presupuestos[nombre] = presupuesto
+    return presupuestos
@@ -0,0 +1,137 @@
+# servicios/logs.py
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Dict
+
+FORMATO_TEXTO = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Alias de subsistema -> nombre del logger, para configurar niveles por subsistema
+SUBSISTEMAS = {
+    "cadena": "models.chain",
+    "modelos": "models",
+    "controlador": "controller",
+    "app": "app",
+}
+
+# Atributos propios de LogRecord; el resto son campos estructurados pasados con extra={...}
+_ATRIBUTOS_ESTANDAR = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener: logging.handlers.QueueListener = None
+
+# Argumentos que se pueden formatear más tarde sin cambiar el mensaje
+_TIPOS_INMUTABLES = (str, int, float, bool, bytes, type(None))
+
+
+class FormateadorJSON(logging.Formatter):
+    """Formatea cada registro como una línea JSON con sus argumentos y campos extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": self.formatTime(record),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        if record.args:
+            datos["args"] = record.args
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_ESTANDAR:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            datos["excepcion"] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class ColaDiferidaHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo de la petición.
+
+    El QueueHandler estándar arma el mensaje (msg % args) antes de encolar; aquí,
+    si todos los argumentos son inmutables (texto, números, None), el registro se
+    encola tal cual y el formateo ocurre en el hilo del listener. Con cualquier otro
+    argumento (p. ej. un Pedido que sigue cambiando) el mensaje se arma antes de
+    encolar, para que muestre el objeto como estaba al registrarlo.
+    La excepción siempre se convierte a texto, porque no puede cruzar hilos de forma segura.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        argumentos = record.args.values() if isinstance(record.args, dict) else record.args or ()
+        if not all(isinstance(argumento, _TIPOS_INMUTABLES) for argumento in argumentos):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parsear_niveles(texto: str) -> Dict[str, str]:
+    """Convierte 'cadena=WARNING,controller=INFO' en {'models.chain': 'WARNING', 'controller': 'INFO'}"""
+    niveles = {}
+    for parte in (texto or "").split(","):
+        if "=" not in parte:
+            continue
+        nombre, nivel = (valor.strip() for valor in parte.split("=", 1))
+        niveles[SUBSISTEMAS.get(nombre, nombre)] = nivel.upper()
+    return niveles
+
+
+def detener_logging_asincrono():
+    """Vacía la cola y detiene el hilo del listener, si hay uno activo."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configurar_logging(nivel: str = "INFO", niveles_subsistema: Dict[str, str] = None,
+                       asincrono: bool = False, formato: str = "texto", stream=None):
+    """Configura el logging del proceso.
+
+    - nivel: nivel del logger raíz.
+    - niveles_subsistema: niveles por logger o alias de SUBSISTEMAS.
+    - asincrono: si es True, las peticiones solo encolan el registro y un hilo
+      aparte lo formatea y lo escribe.
+    - formato: 'texto' o 'json'.
+    """
+    global _listener
+    detener_logging_asincrono()
+
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+
+    salida = logging.StreamHandler(stream or sys.stderr)
+    salida.setFormatter(FormateadorJSON() if formato == "json" else logging.Formatter(FORMATO_TEXTO))
+
+    if asincrono:
+        cola = queue.SimpleQueue()
+        raiz.addHandler(ColaDiferidaHandler(cola))
+        _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+        _listener.start()
+    else:
+        raiz.addHandler(salida)
+
+    raiz.setLevel(nivel.upper())
+    for nombre, nivel_subsistema in (niveles_subsistema or {}).items():
+        logging.getLogger(SUBSISTEMAS.get(nombre, nombre)).setLevel(nivel_subsistema.upper())
+
+
+def configurar_logging_desde_entorno():
+    """Configura el logging con LOG_NIVEL, LOG_NIVELES, LOG_ASINCRONO y LOG_FORMATO."""
+    configurar_logging(
+        nivel=os.environ.get("LOG_NIVEL", "INFO"),
+        niveles_subsistema=parsear_niveles(os.environ.get("LOG_NIVELES", "")),
+        asincrono=os.environ.get("LOG_ASINCRONO", "0").lower() in ("1", "true", "si", "sí"),
+        formato=os.environ.get("LOG_FORMATO", "texto"),
+    )
+
+
+atexit.register(detener_logging_asincrono)
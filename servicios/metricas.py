@@ -0,0 +1,134 @@
+# servicios/metricas.py
+
+import bisect
+import threading
+from typing import Callable, Dict, List, Tuple
+
+# Límites de buckets en segundos (desde 100 µs hasta 10 s)
+BUCKETS_POR_DEFECTO = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                       0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _formatear_etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{nombre}="{valor}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class Histograma:
+    """Histograma de buckets fijos con series por combinación de etiquetas.
+
+    Registrar una observación es una búsqueda binaria sobre los límites y un
+    incremento, protegidos por un lock propio del histograma.
+    """
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = BUCKETS_POR_DEFECTO):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        # valores de etiquetas -> [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *valores_etiquetas: str):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[valores_etiquetas] = serie
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def conteo(self, *valores_etiquetas: str) -> int:
+        serie = self._series.get(valores_etiquetas)
+        return serie[2] if serie else 0
+
+    def exportar(self) -> List[str]:
+        """Líneas en formato de texto de Prometheus"""
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = [(valores, list(serie[0]), serie[1], serie[2]) for valores, serie in self._series.items()]
+        for valores, conteos, suma, total in sorted(series):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, valores, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, valores, 'le="+Inf"')
+            lineas.append(f"{self.nombre}_bucket{etiquetas} {total}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, valores)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {suma}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class Indicador:
+    """Gauge cuyo valor se lee de una función al exportar."""
+
+    def __init__(self, nombre: str, ayuda: str, funcion: Callable[[], float]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._funcion = funcion
+
+    def exportar(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge",
+                f"{self.nombre} {self._funcion()}"]
+
+
+class RegistroMetricas:
+    """Conjunto de métricas del proceso exportable en formato Prometheus."""
+
+    def __init__(self):
+        self._metricas: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                   buckets: Tuple[float, ...] = BUCKETS_POR_DEFECTO) -> Histograma:
+        """Retorna el histograma con ese nombre, creándolo si no existe"""
+        with self._lock:
+            if nombre not in self._metricas:
+                self._metricas[nombre] = Histograma(nombre, ayuda, etiquetas, buckets)
+            return self._metricas[nombre]
+
+    def indicador(self, nombre: str, ayuda: str, funcion: Callable[[], float]) -> Indicador:
+        with self._lock:
+            self._metricas[nombre] = Indicador(nombre, ayuda, funcion)
+            return self._metricas[nombre]
+
+    def exportar_prometheus(self) -> str:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = []
+        for metrica in metricas:
+            lineas.extend(metrica.exportar())
+        return "\n".join(lineas) + "\n"
+
+
+class InstrumentacionCadena:
+    """Hook para BaseManejadorPedido.instrumentacion que alimenta histogramas de latencia.
+
+    - cine_cadena_etapa_segundos{manejador, resultado}: tiempo de cada manejador.
+      resultado es FALLIDO si la etapa dejó el pedido fallido y OK en otro caso.
+    - cine_pedido_segundos{estado}: tiempo total de la cadena por pedido, según su
+      estado final (COMPLETADO, FALLIDO...).
+    """
+
+    def __init__(self, registro: RegistroMetricas):
+        self._etapas = registro.histograma(
+            "cine_cadena_etapa_segundos", "Tiempo por manejador de la cadena de pedidos",
+            ("manejador", "resultado"))
+        self._pedidos = registro.histograma(
+            "cine_pedido_segundos", "Tiempo total de procesamiento de un pedido en la cadena",
+            ("estado",))
+
+    def registrar_etapa(self, nombre_manejador: str, pedido, segundos: float):
+        resultado = "FALLIDO" if pedido.estado.value == "FALLIDO" else "OK"
+        self._etapas.observar(segundos, nombre_manejador, resultado)
+
+    def registrar_pedido(self, pedido, segundos: float):
+        self._pedidos.observar(segundos, pedido.estado.value)
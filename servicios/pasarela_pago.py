@@ -0,0 +1,270 @@
+# servicios/pasarela_pago.py
+
+import abc
+import asyncio
+import concurrent.futures
+import json
+import logging
+import threading
+import uuid
+from typing import Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+# Errores al hablar con la pasarela que se informan como pago fallido en lugar de propagarse:
+# E/S y timeouts de conexión (OSError), respuesta cortada (asyncio.IncompleteReadError),
+# línea de estado mal formada (IndexError/ValueError) y cuerpo que no es JSON (json.JSONDecodeError).
+ERRORES_COMUNICACION = (OSError, asyncio.IncompleteReadError, IndexError, json.JSONDecodeError, ValueError)
+
+
+class ResultadoPago:
+    """Resultado de un intento de cobro en la pasarela"""
+
+    def __init__(self, exitoso: bool, detalle_error: str = None, referencia: str = None,
+                 clave_idempotencia: str = None):
+        self.exitoso = exitoso
+        self.detalle_error = detalle_error
+        self.referencia = referencia
+        # Identifica el cobro en la pasarela (para consultarlo o anularlo)
+        self.clave_idempotencia = clave_idempotencia
+
+    def es_exitoso(self) -> bool:
+        return self.exitoso
+
+    def mensaje_error(self) -> Optional[str]:
+        return self.detalle_error
+
+
+class PasarelaPago(abc.ABC):
+    """Interfaz de pasarela de pago usada por ManejadorProcesamientoPago.
+
+    Las corrutinas de la pasarela corren en un event loop propio, en un hilo de
+    fondo: programar() las envía sin bloquear y procesar() espera el resultado.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop = None
+        self._hilo: threading.Thread = None
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    async def procesar_async(self, metodo_pago: str, monto: float, referencia: str = None,
+                             clave_idempotencia: str = None) -> ResultadoPago:
+        pass
+
+    async def anular_async(self, clave_idempotencia: str) -> bool:
+        """Anula el cobro con esa clave (o impide que se haga si aún no llega). Retorna True si quedó anulado"""
+        return False
+
+    async def anular_o_conciliar(self, clave_idempotencia: str, referencia: str) -> bool:
+        """anular_async sin lanzar: si la anulación falla o no se confirma, deja el cobro en el log para conciliar"""
+        try:
+            if await self.anular_async(clave_idempotencia):
+                logger.info("Pasarela de pago: cobro de %s anulado (clave %s)", referencia, clave_idempotencia)
+                return True
+            logger.error("CONCILIAR: la pasarela no anuló el cobro de %s (clave %s)", referencia, clave_idempotencia)
+        except (asyncio.TimeoutError, *ERRORES_COMUNICACION) as e:
+            logger.error("CONCILIAR: no se pudo anular el cobro de %s (clave %s): %s", referencia, clave_idempotencia, e)
+        return False
+
+    def procesar(self, metodo_pago: str, monto: float, referencia: str = None) -> ResultadoPago:
+        """Versión bloqueante para los manejadores síncronos de la cadena"""
+        return self.programar(self.procesar_async(metodo_pago, monto, referencia)).result()
+
+    def anular(self, clave_idempotencia: str, referencia: str) -> bool:
+        """Versión bloqueante de anular_o_conciliar"""
+        return self.programar(self.anular_o_conciliar(clave_idempotencia, referencia)).result()
+
+    def programar(self, corutina) -> concurrent.futures.Future:
+        """Ejecuta la corrutina en el event loop de la pasarela y retorna su futuro sin esperarlo"""
+        return asyncio.run_coroutine_threadsafe(corutina, self._loop_de_fondo())
+
+    def _loop_de_fondo(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._hilo = threading.Thread(target=self._loop.run_forever, name="pasarela-pago", daemon=True)
+                self._hilo.start()
+        return self._loop
+
+    def cerrar(self):
+        """Detiene el event loop de fondo"""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join()
+        self._loop.close()
+        self._loop = None
+
+
+class PasarelaSimulada(PasarelaPago):
+    """Pasarela local: rechaza el método 'Tarjeta rechazada' y aprueba el resto"""
+
+    async def procesar_async(self, metodo_pago: str, monto: float, referencia: str = None,
+                             clave_idempotencia: str = None) -> ResultadoPago:
+        return self.procesar(metodo_pago, monto, referencia)
+
+    async def anular_async(self, clave_idempotencia: str) -> bool:
+        return True
+
+    def procesar(self, metodo_pago: str, monto: float, referencia: str = None) -> ResultadoPago:
+        if metodo_pago == "Tarjeta rechazada":
+            return ResultadoPago(False, "Simulación: Tarjeta rechazada.")
+        return ResultadoPago(True, referencia=referencia)
+
+
+class PasarelaHTTPAsync(PasarelaPago):
+    """Pasarela que cobra contra un endpoint HTTP con conexiones keep-alive reutilizables.
+
+    Envía POST <url> con JSON {"metodo_pago", "monto", "referencia"} y la cabecera
+    Idempotency-Key (una clave nueva por cobro), y espera una respuesta JSON
+    {"aprobado": bool, "referencia": str, "error": str}. Repetir la clave no cobra
+    dos veces. Si el resultado es incierto (timeout o respuesta cortada o inválida
+    después de enviar el cobro) se anula con POST <url>/<clave>/anulacion, para que
+    un cobro que sí llegó a la pasarela no quede hecho con el pedido FALLIDO.
+    """
+
+    def __init__(self, url: str, max_conexiones: int = 20,
+                 timeout_conexion: float = 2.0, timeout_total: float = 5.0):
+        super().__init__()
+        partes = urlsplit(url)
+        if partes.scheme != "http":
+            raise ValueError(f"Solo se soporta http:// para la pasarela (recibido '{url}')")
+        self._host = partes.hostname
+        self._puerto = partes.port or 80
+        self._ruta = partes.path or "/"
+        self._max_conexiones = max_conexiones
+        self._timeout_conexion = timeout_conexion
+        self._timeout_total = timeout_total
+        self._libres = []  # conexiones (reader, writer) inactivas listas para reutilizar
+        self._limite: asyncio.Semaphore = None
+
+    def cerrar(self):
+        """Cierra las conexiones del pool y detiene el event loop de fondo"""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._cerrar_conexiones(), self._loop).result()
+        super().cerrar()
+
+    async def _cerrar_conexiones(self):
+        while self._libres:
+            _, writer = self._libres.pop()
+            writer.close()
+
+    # --- Pool de conexiones ---
+
+    async def _tomar_conexion(self):
+        while self._libres:
+            reader, writer = self._libres.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._puerto), self._timeout_conexion)
+
+    def _devolver_conexion(self, reader, writer):
+        if len(self._libres) < self._max_conexiones and not writer.is_closing():
+            self._libres.append((reader, writer))
+        else:
+            writer.close()
+
+    # --- Cobro ---
+
+    async def procesar_async(self, metodo_pago: str, monto: float, referencia: str = None,
+                             clave_idempotencia: str = None) -> ResultadoPago:
+        if self._limite is None:
+            self._limite = asyncio.Semaphore(self._max_conexiones)
+        clave = clave_idempotencia or uuid.uuid4().hex
+        cuerpo = json.dumps({"metodo_pago": metodo_pago, "monto": monto, "referencia": referencia}).encode()
+        async with self._limite:
+            loop = asyncio.get_running_loop()
+            limite_tiempo = loop.time() + self._timeout_total
+            try:
+                conexion = await asyncio.wait_for(self._tomar_conexion(), self._timeout_total)
+            except asyncio.TimeoutError:
+                logger.warning("Pasarela de pago: tiempo de espera agotado al conectar para %s", referencia)
+                return ResultadoPago(False, "Tiempo de espera agotado con la pasarela de pago.", referencia, clave)
+            except ERRORES_COMUNICACION as e:
+                logger.warning("Pasarela de pago: error de conexión para %s: %s", referencia, e)
+                return ResultadoPago(False, f"Error de comunicación con pasarela: {e}", referencia, clave)
+
+            # Desde aquí la pasarela puede haber recibido el cobro: un resultado incierto se anula
+            try:
+                estado, datos = await asyncio.wait_for(
+                    self._enviar(conexion, "POST", self._ruta, cuerpo, clave), max(limite_tiempo - loop.time(), 0))
+                return _resultado_cobro(estado, datos, referencia, clave)
+            except asyncio.TimeoutError:
+                logger.warning("Pasarela de pago: tiempo de espera agotado para %s (clave %s)", referencia, clave)
+                motivo = "Tiempo de espera agotado con la pasarela de pago."
+            except ERRORES_COMUNICACION as e:
+                logger.warning("Pasarela de pago: error de comunicación para %s (clave %s): %s", referencia, clave, e)
+                motivo = f"Error de comunicación con pasarela: {e}"
+            if await self.anular_o_conciliar(clave, referencia):
+                return ResultadoPago(False, motivo + " El cobro fue anulado.", referencia, clave)
+            return ResultadoPago(False, motivo, referencia, clave)
+
+    async def anular_async(self, clave_idempotencia: str) -> bool:
+        ruta = f"{self._ruta.rstrip('/')}/{clave_idempotencia}/anulacion"
+        conexion = await asyncio.wait_for(self._tomar_conexion(), self._timeout_total)
+        estado, datos = await asyncio.wait_for(self._enviar(conexion, "POST", ruta, b"", clave_idempotencia),
+                                               self._timeout_total)
+        return estado == 200 and _objeto_json(datos).get("anulado") is True
+
+    async def _enviar(self, conexion, metodo: str, ruta: str, cuerpo: bytes, clave: str):
+        reader, writer = conexion
+        try:
+            writer.write(
+                f"{metodo} {ruta} HTTP/1.1\r\n"
+                f"Host: {self._host}:{self._puerto}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Idempotency-Key: {clave}\r\n"
+                f"Content-Length: {len(cuerpo)}\r\n"
+                "Connection: keep-alive\r\n\r\n".encode() + cuerpo)
+            await writer.drain()
+            estado, cabeceras, datos = await _leer_respuesta(reader)
+        except BaseException:
+            # Conexión en estado desconocido (p. ej. timeout a mitad de respuesta): se descarta
+            writer.close()
+            raise
+        if cabeceras.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._devolver_conexion(reader, writer)
+        return estado, datos
+
+
+def _objeto_json(datos: bytes) -> dict:
+    respuesta = json.loads(datos or b"{}")
+    if not isinstance(respuesta, dict):
+        raise ValueError("La pasarela respondió un JSON que no es un objeto")
+    return respuesta
+
+
+def _resultado_cobro(estado: int, datos: bytes, referencia: str, clave: str) -> ResultadoPago:
+    if estado != 200:
+        return ResultadoPago(False, f"La pasarela respondió HTTP {estado}.", referencia, clave)
+    respuesta = _objeto_json(datos)
+    if respuesta.get("aprobado"):
+        return ResultadoPago(True, referencia=respuesta.get("referencia"), clave_idempotencia=clave)
+    return ResultadoPago(False, respuesta.get("error") or "Pago rechazado por la pasarela.",
+                         respuesta.get("referencia"), clave)
+
+
+async def _leer_respuesta(reader: asyncio.StreamReader):
+    """Lee una respuesta HTTP/1.1 con Content-Length. Retorna (estado, cabeceras, cuerpo)"""
+    linea_estado = await reader.readline()
+    if not linea_estado:
+        raise ConnectionResetError("La pasarela cerró la conexión")
+    estado = int(linea_estado.split()[1])
+    cabeceras = {}
+    while True:
+        linea = await reader.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        cabeceras[nombre.strip().lower()] = valor.strip()
+    longitud = int(cabeceras.get("content-length", "0"))
+    cuerpo = await reader.readexactly(longitud) if longitud else b""
+    return estado, cabeceras, cuerpo
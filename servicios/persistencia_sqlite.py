@@ -0,0 +1,319 @@
+# servicios/persistencia_sqlite.py
+
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from models.chain import EstadoPedido, ItemBoleta, ItemConfiteria, Pedido
+from models.descuentos import reglas_canjeadas
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS pedidos (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    metodo_pago TEXT,
+    cupon TEXT,
+    sala TEXT,
+    horario TEXT,
+    subtotal REAL NOT NULL DEFAULT 0,
+    descuento REAL NOT NULL DEFAULT 0,
+    impuestos REAL NOT NULL DEFAULT 0,
+    total_final REAL NOT NULL DEFAULT 0,
+    mensaje_error TEXT
+);
+CREATE TABLE IF NOT EXISTS items_pedido (
+    pedido_id TEXT NOT NULL REFERENCES pedidos(id),
+    tipo TEXT NOT NULL,
+    descripcion TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    precio_unitario REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_pedido_por_pedido ON items_pedido(pedido_id);
+CREATE TABLE IF NOT EXISTS asientos (
+    sala TEXT NOT NULL,
+    horario TEXT NOT NULL,
+    asiento_id TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    pedido_id TEXT,
+    PRIMARY KEY (sala, horario, asiento_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS canjes_descuento (
+    pedido_id TEXT NOT NULL REFERENCES pedidos(id),
+    regla TEXT NOT NULL,
+    PRIMARY KEY (pedido_id, regla)
+) WITHOUT ROWID;
+"""
+
+# Sentencias fijas: sqlite3 las compila una vez por conexión y las reutiliza de su caché
+SQL_GUARDAR_PEDIDO = """
+INSERT INTO pedidos (id, estado, metodo_pago, cupon, sala, horario, subtotal, descuento, impuestos, total_final, mensaje_error)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET estado = excluded.estado, subtotal = excluded.subtotal,
+    descuento = excluded.descuento, impuestos = excluded.impuestos,
+    total_final = excluded.total_final, mensaje_error = excluded.mensaje_error
+"""
+SQL_BORRAR_ITEMS = "DELETE FROM items_pedido WHERE pedido_id = ?"
+SQL_INSERTAR_ITEM = "INSERT INTO items_pedido (pedido_id, tipo, descripcion, cantidad, precio_unitario) VALUES (?, ?, ?, ?, ?)"
+SQL_VENDER_ASIENTO = """
+INSERT INTO asientos (sala, horario, asiento_id, estado, pedido_id) VALUES (?, ?, ?, 'VENDIDO', ?)
+ON CONFLICT(sala, horario, asiento_id) DO UPDATE SET estado = 'VENDIDO', pedido_id = excluded.pedido_id
+"""
+SQL_CANJEAR_REGLA = "INSERT OR IGNORE INTO canjes_descuento (pedido_id, regla) VALUES (?, ?)"
+SQL_LIBERAR_ASIENTO = "DELETE FROM asientos WHERE sala = ? AND horario = ? AND asiento_id = ?"
+SQL_ACTUALIZAR_ESTADO = "UPDATE pedidos SET estado = ?, mensaje_error = ? WHERE id = ?"
+
+# Una operación es una lista de (sql, parámetros) que debe aplicarse completa
+Operacion = List[Tuple[str, tuple]]
+
+
+def _conectar(ruta: str, sincronizacion: str) -> sqlite3.Connection:
+    conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None,
+                               cached_statements=64)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute(f"PRAGMA synchronous={sincronizacion}")
+    conexion.execute("PRAGMA foreign_keys=ON")
+    conexion.execute("PRAGMA busy_timeout=5000")
+    return conexion
+
+
+class PoolConexionesSQLite:
+    """Pool fijo de conexiones de lectura. Con WAL las lecturas no bloquean al escritor."""
+
+    def __init__(self, ruta: str, tamano: int = 4):
+        self._libres: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._todas = [_conectar(ruta, "NORMAL") for _ in range(tamano)]
+        for conexion in self._todas:
+            self._libres.put(conexion)
+
+    @contextmanager
+    def conexion(self) -> Iterator[sqlite3.Connection]:
+        conexion = self._libres.get()
+        try:
+            yield conexion
+        finally:
+            self._libres.put(conexion)
+
+    def cerrar(self):
+        for conexion in self._todas:
+            conexion.close()
+
+
+class _Escritura:
+    __slots__ = ("operacion", "listo", "error")
+
+    def __init__(self, operacion: Operacion):
+        self.operacion = operacion
+        self.listo = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class EscritorDiferido:
+    """Hilo escritor que agrupa las operaciones encoladas en una sola transacción.
+
+    Mientras se confirma una transacción, las operaciones nuevas se acumulan y
+    entran juntas en la siguiente (hasta `max_lote`), así muchas ventas pagan un
+    solo fsync. Quien necesita durabilidad espera a que su lote se confirme.
+    Si un lote falla, sus operaciones se reintentan una por una para que una
+    operación inválida no descarte las demás. Cualquier error (no solo de SQLite)
+    queda en la escritura que lo causó; quien espera nunca se queda bloqueado,
+    ni siquiera si el hilo escritor terminó.
+    """
+
+    _FIN = object()
+
+    def __init__(self, ruta: str, max_lote: int = 256):
+        self._conexion = _conectar(ruta, "FULL")
+        self._max_lote = max_lote
+        self._cola: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.lotes_confirmados = 0
+        self.operaciones_confirmadas = 0
+        self._hilo = threading.Thread(target=self._correr, name="escritor-sqlite", daemon=True)
+        self._hilo.start()
+
+    def escribir(self, operacion: Operacion, esperar: bool = False):
+        """Encola la operación. Con esperar=True bloquea hasta que esté confirmada en disco
+        y lanza el error de la escritura si falló. Lanza RuntimeError si el escritor está detenido."""
+        if not self._hilo.is_alive():
+            raise RuntimeError("El escritor SQLite está detenido")
+        escritura = _Escritura(operacion)
+        self._cola.put(escritura)
+        if esperar:
+            while not escritura.listo.wait(timeout=1.0):
+                if not self._hilo.is_alive():
+                    raise RuntimeError("El escritor SQLite terminó sin confirmar la escritura")
+            if escritura.error is not None:
+                raise escritura.error
+
+    def detener(self):
+        """Confirma lo pendiente y detiene el hilo escritor"""
+        if self._hilo.is_alive():
+            self._cola.put(self._FIN)
+            self._hilo.join()
+        self._conexion.close()
+
+    def _correr(self):
+        while True:
+            primera = self._cola.get()
+            if primera is self._FIN:
+                return
+            lote = [primera]
+            terminar = False
+            while len(lote) < self._max_lote:
+                try:
+                    siguiente = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is self._FIN:
+                    terminar = True
+                    break
+                lote.append(siguiente)
+            self._confirmar_lote(lote)
+            if terminar:
+                return
+
+    def _confirmar_lote(self, lote: List[_Escritura]):
+        try:
+            self._ejecutar([escritura.operacion for escritura in lote])
+        except Exception:
+            logger.warning("Lote de %d escrituras falló; se reintenta una por una", len(lote), exc_info=True)
+            for escritura in lote:
+                try:
+                    self._ejecutar([escritura.operacion])
+                except Exception as e:
+                    logger.error("Escritura descartada: %r", e)
+                    escritura.error = e
+        else:
+            self.lotes_confirmados += 1
+            self.operaciones_confirmadas += len(lote)
+        finally:
+            for escritura in lote:
+                escritura.listo.set()
+
+    def _ejecutar(self, operaciones: List[Operacion]):
+        conexion = self._conexion
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            for operacion in operaciones:
+                for sql, parametros in operacion:
+                    conexion.execute(sql, parametros)
+            conexion.execute("COMMIT")
+        except BaseException:
+            if conexion.in_transaction:
+                conexion.execute("ROLLBACK")
+            raise
+
+
+class RepositorioSQLite:
+    """Persistencia de pedidos, sus items, los asientos vendidos y los usos de cupones con tope en SQLite.
+
+    Las escrituras pasan por un EscritorDiferido: las ventas y reembolsos esperan
+    a que su lote esté confirmado (durables antes de responder) y los cambios de
+    estado sin efecto sobre asientos se confirman en segundo plano.
+    Las lecturas usan un pool de conexiones aparte.
+    """
+
+    def __init__(self, ruta: str, tamano_pool: int = 4, max_lote: int = 256):
+        self.ruta = ruta
+        inicial = _conectar(ruta, "FULL")
+        inicial.executescript(ESQUEMA)
+        inicial.close()
+        self._escritor = EscritorDiferido(ruta, max_lote)
+        self._pool = PoolConexionesSQLite(ruta, tamano_pool)
+
+    # --- Escrituras ---
+
+    def registrar_venta(self, pedido: Pedido, esperar: bool = True):
+        """Guarda el pedido, sus items y usos de cupones, y marca sus asientos como vendidos"""
+        sala, horario = _clave_funcion(pedido)
+        operacion = [(SQL_GUARDAR_PEDIDO, _fila_pedido(pedido)), (SQL_BORRAR_ITEMS, (pedido.id,))]
+        operacion += [(SQL_INSERTAR_ITEM, (pedido.id, "boleta", item.asiento_id, 1, item.precio))
+                      for item in pedido.items_boletas]
+        operacion += [(SQL_INSERTAR_ITEM, (pedido.id, "confiteria", item.nombre, item.cantidad, item.precio_unitario))
+                      for item in pedido.items_confiteria]
+        operacion += [(SQL_VENDER_ASIENTO, (sala, horario, item.asiento_id, pedido.id))
+                      for item in pedido.items_boletas]
+        operacion += [(SQL_CANJEAR_REGLA, (pedido.id, regla)) for regla in reglas_canjeadas(pedido)]
+        self._escritor.escribir(operacion, esperar)
+
+    def registrar_reembolso(self, pedido: Pedido, esperar: bool = True):
+        """Actualiza el estado del pedido y libera sus asientos"""
+        sala, horario = _clave_funcion(pedido)
+        operacion = [(SQL_ACTUALIZAR_ESTADO, (pedido.estado.value, pedido.mensaje_error, pedido.id))]
+        operacion += [(SQL_LIBERAR_ASIENTO, (sala, horario, item.asiento_id)) for item in pedido.items_boletas]
+        self._escritor.escribir(operacion, esperar)
+
+    def actualizar_estado(self, pedido: Pedido, esperar: bool = False):
+        self._escritor.escribir([(SQL_ACTUALIZAR_ESTADO, (pedido.estado.value, pedido.mensaje_error, pedido.id))],
+                                esperar)
+
+    # --- Lecturas ---
+
+    def cargar_pedidos(self) -> List[Pedido]:
+        """Reconstruye los pedidos guardados en orden de creación"""
+        with self._pool.conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT id, estado, metodo_pago, cupon, sala, horario, subtotal, descuento,"
+                " impuestos, total_final, mensaje_error FROM pedidos ORDER BY rowid").fetchall()
+            items: Dict[str, list] = {}
+            for pedido_id, tipo, descripcion, cantidad, precio_unitario in conexion.execute(
+                    "SELECT pedido_id, tipo, descripcion, cantidad, precio_unitario FROM items_pedido ORDER BY rowid"):
+                items.setdefault(pedido_id, []).append((tipo, descripcion, cantidad, precio_unitario))
+
+        pedidos = []
+        for (pedido_id, estado, metodo_pago, cupon, sala, horario, subtotal, descuento,
+             impuestos, total_final, mensaje_error) in filas:
+            boletas, confiteria = [], []
+            for tipo, descripcion, cantidad, precio_unitario in items.get(pedido_id, []):
+                if tipo == "boleta":
+                    boletas.append(ItemBoleta(descripcion, precio_unitario))
+                else:
+                    confiteria.append(ItemConfiteria(descripcion, cantidad, precio_unitario))
+            pedido = Pedido(pedido_id, boletas, confiteria, metodo_pago, cupon,
+                            (sala, horario or None) if sala is not None else None)
+            pedido.subtotal, pedido.descuento_aplicado = subtotal, descuento
+            pedido.impuestos, pedido.total_final = impuestos, total_final
+            pedido.estado = EstadoPedido(estado)
+            pedido.mensaje_error = mensaje_error
+            pedido._asientos_reembolsados = pedido.estado == EstadoPedido.REEMBOLSO_PROCESADO
+            pedidos.append(pedido)
+        return pedidos
+
+    def cargar_asientos_vendidos(self) -> Dict[Tuple[str, Optional[str]], List[str]]:
+        """Asientos vendidos agrupados por función (sala, horario)"""
+        vendidos: Dict[Tuple[str, Optional[str]], List[str]] = {}
+        with self._pool.conexion() as conexion:
+            for sala, horario, asiento_id in conexion.execute(
+                    "SELECT sala, horario, asiento_id FROM asientos WHERE estado = 'VENDIDO'"):
+                vendidos.setdefault((sala, horario or None), []).append(asiento_id)
+        return vendidos
+
+    def cargar_usos_descuento(self) -> Dict[str, int]:
+        """Usos de cada regla de descuento con tope en las ventas guardadas"""
+        with self._pool.conexion() as conexion:
+            return dict(conexion.execute("SELECT regla, COUNT(*) FROM canjes_descuento GROUP BY regla"))
+
+    def estadisticas(self) -> dict:
+        return {"lotes_confirmados": self._escritor.lotes_confirmados,
+                "operaciones_confirmadas": self._escritor.operaciones_confirmadas}
+
+    def cerrar(self):
+        self._escritor.detener()
+        self._pool.cerrar()
+
+
+def _clave_funcion(pedido: Pedido) -> Tuple[str, str]:
+    # Las claves primarias no admiten NULL de forma útil: una función sin horario se guarda con ''
+    sala, horario = pedido.funcion or ("", None)
+    return sala, horario or ""
+
+
+def _fila_pedido(pedido: Pedido) -> tuple:
+    sala, horario = pedido.funcion or (None, None)
+    return (pedido.id, pedido.estado.value, pedido.metodo_pago, pedido.cupon_aplicado, sala, horario,
+            pedido.subtotal, pedido.descuento_aplicado, pedido.impuestos, pedido.total_final,
+            pedido.mensaje_error)
@@ -0,0 +1,185 @@
+# servicios/servidor_pago_stub.py
+# Servidor HTTP local que imita una pasarela de pago, para pruebas y benchmarks.
+# Uso: python -m servicios.servidor_pago_stub --puerto 8099 --latencia-min 300 --latencia-max 800 --tasa-fallo 0.05
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import uuid
+
+
+class ServidorPagoStub:
+    """Pasarela de pago falsa con latencia y tasa de rechazo configurables.
+
+    Atiende POST con JSON {"metodo_pago", "monto", "referencia"} sobre conexiones
+    HTTP/1.1 keep-alive y responde {"aprobado", "referencia", "error"}. El método
+    'Tarjeta rechazada' siempre se rechaza. Un cobro con una cabecera Idempotency-Key
+    ya vista responde lo mismo sin cobrar de nuevo, y POST <ruta>/<clave>/anulacion
+    anula ese cobro (si todavía no llega o está en curso, se rechaza al terminar).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 0,
+                 latencia_min_ms: float = 0.0, latencia_max_ms: float = 0.0,
+                 tasa_fallo: float = 0.0, semilla: int = None):
+        self.host = host
+        self.puerto = puerto
+        self.latencia_min_ms = latencia_min_ms
+        self.latencia_max_ms = max(latencia_max_ms, latencia_min_ms)
+        self.tasa_fallo = tasa_fallo
+        self.solicitudes_atendidas = 0
+        self.conexiones_abiertas = 0
+        self.conexiones_aceptadas = 0  # Total desde el arranque (para medir la reutilización)
+        self.cobros_en_curso = 0
+        self.max_cobros_en_curso = 0
+        self.cobros_procesados = 0
+        self.cobros = {}  # clave de idempotencia -> respuesta del cobro
+        self.anulados = set()  # claves anuladas
+        self._aleatorio = random.Random(semilla)
+        self._servidor: asyncio.base_events.Server = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._hilo: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.puerto}/pagos"
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.conexiones_abiertas += 1
+        self.conexiones_aceptadas += 1
+        try:
+            while True:
+                linea_solicitud = await reader.readline()
+                if not linea_solicitud:
+                    break
+                _, ruta, *_ = linea_solicitud.decode("latin-1").split()
+                cabeceras = {}
+                while True:
+                    linea = await reader.readline()
+                    if linea in (b"\r\n", b"\n", b""):
+                        break
+                    nombre, _, valor = linea.decode("latin-1").partition(":")
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+                longitud = int(cabeceras.get("content-length", "0"))
+                cuerpo = await reader.readexactly(longitud) if longitud else b"{}"
+
+                clave = cabeceras.get("idempotency-key")
+                if ruta.endswith("/anulacion"):
+                    respuesta = self._anular(ruta.rsplit("/", 2)[-2])
+                elif clave in self.cobros:
+                    respuesta = self.cobros[clave]
+                else:
+                    respuesta = await self._cobrar(json.loads(cuerpo or b"{}"), clave)
+                datos = json.dumps(respuesta).encode()
+                # Se cuenta antes de responder: el cliente puede leer el contador apenas recibe la respuesta
+                self.solicitudes_atendidas += 1
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(datos)}\r\n\r\n".encode() + datos)
+                await writer.drain()
+                if cabeceras.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass  # detener() cancela las conexiones abiertas: la tarea termina sin error
+        finally:
+            self.conexiones_abiertas -= 1
+            writer.close()
+
+    def _anular(self, clave: str) -> dict:
+        self.anulados.add(clave)
+        if self.cobros.get(clave, {}).get("aprobado"):
+            self.cobros[clave] = {**self.cobros[clave], "aprobado": False, "error": "Cobro anulado."}
+        return {"anulado": True}
+
+    async def _cobrar(self, solicitud: dict, clave: str = None) -> dict:
+        respuesta = await self._resultado_cobro(solicitud)
+        if clave is not None:
+            if clave in self.anulados:
+                respuesta = {**respuesta, "aprobado": False, "error": "Cobro anulado."}
+            self.cobros[clave] = respuesta
+        return respuesta
+
+    async def _resultado_cobro(self, solicitud: dict) -> dict:
+        self.cobros_procesados += 1
+        self.cobros_en_curso += 1
+        self.max_cobros_en_curso = max(self.max_cobros_en_curso, self.cobros_en_curso)
+        try:
+            latencia_ms = self._aleatorio.uniform(self.latencia_min_ms, self.latencia_max_ms)
+            if latencia_ms > 0:
+                await asyncio.sleep(latencia_ms / 1000)
+        finally:
+            self.cobros_en_curso -= 1
+        referencia = solicitud.get("referencia") or uuid.uuid4().hex
+        if solicitud.get("metodo_pago") == "Tarjeta rechazada":
+            return {"aprobado": False, "referencia": referencia, "error": "Tarjeta rechazada."}
+        if self._aleatorio.random() < self.tasa_fallo:
+            return {"aprobado": False, "referencia": referencia, "error": "Simulación: fondos insuficientes."}
+        return {"aprobado": True, "referencia": referencia}
+
+    # --- Ejecución en segundo plano (para pruebas y benchmarks) ---
+
+    def iniciar_en_hilo(self) -> "ServidorPagoStub":
+        """Arranca el servidor en un hilo propio y retorna cuando ya acepta conexiones"""
+        listo = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def correr():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.iniciar())
+            listo.set()
+            self._loop.run_forever()
+
+        self._hilo = threading.Thread(target=correr, name="pasarela-stub", daemon=True)
+        self._hilo.start()
+        listo.wait()
+        return self
+
+    def detener(self):
+        if self._loop is None:
+            return
+
+        async def cerrar():
+            self._servidor.close()
+            # Cancelar las conexiones keep-alive que siguen abiertas
+            tareas = [tarea for tarea in asyncio.all_tasks() if tarea is not asyncio.current_task()]
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            await self._servidor.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(cerrar(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join()
+        self._loop.close()
+        self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pasarela de pago falsa para pruebas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8099)
+    parser.add_argument("--latencia-min", type=float, default=300.0, help="Latencia mínima en ms")
+    parser.add_argument("--latencia-max", type=float, default=800.0, help="Latencia máxima en ms")
+    parser.add_argument("--tasa-fallo", type=float, default=0.0, help="Probabilidad de rechazo (0 a 1)")
+    args = parser.parse_args()
+
+    servidor = ServidorPagoStub(args.host, args.puerto, args.latencia_min, args.latencia_max, args.tasa_fallo)
+
+    async def correr():
+        await servidor.iniciar()
+        print(f"Pasarela stub escuchando en {servidor.url}")
+        async with servidor._servidor:
+            await servidor._servidor.serve_forever()
+
+    asyncio.run(correr())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# test_diario_eventos.py
+
+import os
+import sys
+import tempfile
+
+# Permite ejecutarlo como script desde servicios/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from servicios.diario_eventos import (
+    EVENTO_ASIENTOS, EVENTO_ESTADO_PEDIDO, DiarioEventos, codificar_evento, decodificar_eventos
+)
+
+
+class Pedido:
+    def __init__(self, pedido_id: str):
+        self.id = pedido_id
+
+
+class Estado:
+    def __init__(self, valor: str):
+        self.value = valor
+
+
+def segmentos(directorio: str):
+    return sorted(nombre for nombre in os.listdir(directorio) if nombre.endswith(".bin"))
+
+
+def probar_codificacion():
+    # Textos de más de 65535 bytes (sala u horario del usuario) se codifican sin error
+    largo = "S" * 70000
+    registro = codificar_evento(EVENTO_ASIENTOS, 2, [largo, "", "A1"], marca_tiempo=1.5)
+    assert list(decodificar_eventos(registro)) == [(EVENTO_ASIENTOS, 1.5, 2, [largo, "", "A1"])]
+
+    # Un CRC que no coincide detiene la lectura en ese registro
+    registros = [codificar_evento(EVENTO_ESTADO_PEDIDO, 0, [f"P{numero}", "PAGADO"], 0.0) for numero in range(3)]
+    datos = bytearray(b"".join(registros))
+    datos[len(registros[0]) + 12] ^= 0xFF  # Un byte del cuerpo del segundo registro
+    assert [textos for _, _, _, textos in decodificar_eventos(bytes(datos))] == [["P0", "PAGADO"]]
+
+    # Un registro cortado a la mitad tampoco se entrega
+    cortado = b"".join(registros)[:-5]
+    assert len(list(decodificar_eventos(cortado))) == 2
+    print("Codificación y CRC: OK")
+
+
+def probar_final_cortado():
+    with tempfile.TemporaryDirectory() as directorio:
+        diario = DiarioEventos(directorio)
+        diario.registrar_asientos(("1", None), "VENDER", ["A1", "A2"])
+        diario.registrar_transicion_pedido(Pedido("P1"), None, None, Estado("PAGADO"))
+        diario.cerrar()
+
+        # Simula una caída a mitad de escritura: medio registro al final del segmento
+        with open(os.path.join(directorio, segmentos(directorio)[0]), "ab") as archivo:
+            archivo.write(codificar_evento(EVENTO_ASIENTOS, 2, ["1", "", "B1"])[:9])
+
+        diario = DiarioEventos(directorio)
+        assert diario.estado.asientos_vendidos == {("1", None): {"A1", "A2"}}
+        # Lo nuevo va a otro segmento: el final corrupto no tapa los eventos posteriores
+        diario.registrar_asientos(("1", None), "DEVOLVER", ["A1"])
+        diario.cerrar()
+        assert len(segmentos(directorio)) == 2
+
+        diario = DiarioEventos(directorio)
+        assert diario.estado.asientos_vendidos == {("1", None): {"A2"}}
+        assert diario.estado.estados_pedidos == {"P1": "PAGADO"}
+        diario.cerrar()
+    print("Recuperación con final cortado: OK")
+
+
+def probar_snapshot():
+    with tempfile.TemporaryDirectory() as directorio:
+        diario = DiarioEventos(directorio, intervalo_snapshot=3)
+        diario.registrar_asientos(("1", "2026-10-18T19:30"), "VENDER", ["A1", "A2", "A3"])
+        diario.registrar_asientos(("1", "2026-10-18T19:30"), "DEVOLVER", ["A2"])
+        diario.registrar_transicion_pedido(Pedido("P1"), None, None, Estado("PAGADO"))  # Instantánea
+        diario.registrar_transicion_pedido(Pedido("P1"), None, None, Estado("ENTREGADO"))
+        diario.registrar_asientos(("2", None), "VENDER", ["C4"])
+        diario.registrar_canjes("P1", ["GRUPO", "CINE20"])
+        diario.registrar_canjes("P2", ["GRUPO"])
+        diario.cerrar()
+
+        # Los segmentos anteriores a la instantánea ya no se reproducen
+        os.remove(os.path.join(directorio, segmentos(directorio)[0]))
+        diario = DiarioEventos(directorio)
+        assert diario.estado.asientos_vendidos == {("1", "2026-10-18T19:30"): {"A1", "A3"}, ("2", None): {"C4"}}
+        assert diario.estado.estados_pedidos == {"P1": "ENTREGADO"}
+        assert diario.estado.usos_descuento == {"GRUPO": 2, "CINE20": 1}
+
+        # Suspendido no escribe nada (restauración al arrancar)
+        with diario.suspendido():
+            diario.registrar_asientos(("2", None), "DEVOLVER", ["C4"])
+        assert diario.estado.asientos_vendidos[("2", None)] == {"C4"}
+        diario.cerrar()
+    print("Instantánea y reproducción: OK")
+
+
+def probar_poda():
+    terminada = ("1", "2026-10-18T15:00")
+    vigente = ("1", "2026-10-18T21:00")
+
+    def numero_pedido(pedido_id):
+        return int(pedido_id[1:])
+
+    with tempfile.TemporaryDirectory() as directorio:
+        diario = DiarioEventos(directorio, funcion_terminada=lambda funcion: funcion == terminada,
+                               numero_pedido=numero_pedido)
+        diario.registrar_asientos(terminada, "VENDER", ["A1"])
+        diario.registrar_asientos(vigente, "VENDER", ["B1"])
+        for pedido_id, estado in (("P7", "CANCELADO"), ("P9", "REEMBOLSO_PROCESADO"),
+                                  ("P8", "FALLIDO"), ("P3", "COMPLETADO")):
+            diario.registrar_transicion_pedido(Pedido(pedido_id), None, None, Estado(estado))
+        # El estado recuperado no cambia con los eventos nuevos; la instantánea es del hilo de fondo
+        diario.guardar_snapshot()
+        assert diario.estado.asientos_vendidos == {}
+        diario.cerrar()
+
+        for nombre in segmentos(directorio):
+            os.remove(os.path.join(directorio, nombre))
+        diario = DiarioEventos(directorio)
+        # Solo quedan la función vigente y el pedido no cerrado; P9 fija la numeración
+        assert diario.estado.asientos_vendidos == {vigente: {"B1"}}
+        assert diario.estado.estados_pedidos == {"P3": "COMPLETADO"}
+        assert sorted(diario.estado.pedidos_conocidos()) == ["P3", "P9"]
+        diario.cerrar()
+    print("Poda de la instantánea: OK")
+
+
+def main():
+    probar_codificacion()
+    probar_final_cortado()
+    probar_snapshot()
+    probar_poda()
+
+
+if __name__ == "__main__":
+    main()
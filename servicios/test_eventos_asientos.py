@@ -0,0 +1,118 @@
+# test_eventos_asientos.py
+
+import json
+import os
+import sys
+
+# Permite ejecutarlo como script desde servicios/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from servicios.eventos_asientos import CanalAsientos, DifusorAsientos
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+
+def leer_mensaje(mensaje: str):
+    """(id, evento, datos) de un mensaje SSE"""
+    campos = dict(linea.split(": ", 1) for linea in mensaje.strip().split("\n"))
+    return campos["id"], campos["event"], json.loads(campos["data"])
+
+
+def probar_marcos():
+    reloj = Reloj()
+    canal = CanalAsientos(intervalo_segundos=1.0, marcos_retenidos=3, reloj=reloj)
+    canal.publicar("OCUPAR", ["A1", "A2"])
+    canal.publicar("LIBERAR", ["A1"])  # Misma ráfaga: solo cuenta el estado final
+    canal.publicar("DESCONOCIDA", ["A3"])
+    assert canal.ultimo_id == 0  # El marco no se cierra antes del intervalo
+
+    reloj.ahora = 1.0
+    assert canal.marcos_desde(0) == [(1, {"disponible": ["A1"], "retenido": ["A2"]})]
+    for numero in range(2, 6):
+        canal.publicar("VENDER", [f"B{numero}"])
+        reloj.ahora += 1.0
+        assert canal.ultimo_id == numero
+
+    # Se retienen los 3 últimos marcos: desde 2 se puede reanudar, desde 1 ya no
+    assert [marco_id for marco_id, _ in canal.marcos_desde(2)] == [3, 4, 5]
+    assert canal.marcos_desde(1) is None and canal.marcos_desde(5) == []
+    assert canal.marcos_desde(99) is None  # Un id que este canal nunca emitió
+    assert canal.esperar(5, timeout=0) == [] and canal.esperar(1, timeout=0) is None
+    print("Marcos agrupados y retenidos: OK")
+
+
+def probar_reanudacion():
+    reloj = Reloj()
+    difusor = DifusorAsientos(intervalo_segundos=1.0, marcos_retenidos=2, reloj=reloj)
+    funcion = ("1", None)
+    estado = {"vendidos": []}
+
+    # Primera conexión: retry, estado completo y luego los cambios, con ids "<época>-<número>"
+    flujo = difusor.escuchar(funcion, None, lambda: estado, keepalive_segundos=0)
+    canal = difusor.canal(funcion)
+    assert next(flujo).startswith("retry: ")
+    assert leer_mensaje(next(flujo)) == (f"{canal.epoca}-0", "estado", {"vendidos": []})
+    difusor.publicar(funcion, "VENDER", ["A1"])
+    reloj.ahora = 1.0
+    assert leer_mensaje(next(flujo)) == (canal.id_evento(1), "asientos", {"vendido": ["A1"]})
+    assert next(flujo) == ": keepalive\n\n"
+    flujo.close()  # El cliente se desconecta
+
+    # Mientras está desconectado el canal sigue recibiendo cambios
+    # (otro suscriptor cierra los marcos; sin nadie que consulte, los cambios seguirían en el mismo marco)
+    difusor.publicar(funcion, "OCUPAR", ["A2"])
+    reloj.ahora = 2.0
+    assert difusor.canal(funcion).ultimo_id == 2
+    difusor.publicar(funcion, "DEVOLVER", ["A1"])
+    reloj.ahora = 3.0
+    assert difusor.canal(funcion).ultimo_id == 3
+
+    # Reconexión con Last-Event-ID: solo los marcos perdidos, sin estado completo
+    flujo = difusor.escuchar(funcion, canal.id_evento(1), lambda: estado, keepalive_segundos=0)
+    next(flujo)
+    assert [leer_mensaje(next(flujo)) for _ in range(2)] == [
+        (canal.id_evento(2), "asientos", {"retenido": ["A2"]}),
+        (canal.id_evento(3), "asientos", {"disponible": ["A1"]})]
+    flujo.close()
+
+    # Un id ya descartado, de otra época del canal (expulsado o de otro proceso, que
+    # vuelve a numerar desde 0) o sin época recibe de nuevo el estado completo con el id actual
+    estado = {"vendidos": ["B1"]}
+    for ultimo_id in (canal.id_evento(0), canal.id_evento(42), "otra-epoca-2", "2", "basura"):
+        flujo = difusor.escuchar(funcion, ultimo_id, lambda: estado, keepalive_segundos=0)
+        next(flujo)
+        assert leer_mensaje(next(flujo)) == (canal.id_evento(3), "estado", {"vendidos": ["B1"]}), ultimo_id
+        flujo.close()
+    assert difusor.canal(funcion).suscriptores == 0
+    print("Reanudación con Last-Event-ID: OK")
+
+
+def probar_capacidad():
+    difusor = DifusorAsientos(capacidad=2)
+    escuchando = difusor.escuchar(("1", None), None, dict, keepalive_segundos=0)
+    next(escuchando)  # Suscriptor activo en la función 1
+    difusor.canal(("2", None))
+    difusor.canal(("3", None))
+    difusor.canal(("4", None))
+    # Los canales sin suscriptores se expulsan; el de la función con suscriptor se conserva
+    assert list(difusor._canales) == [("1", None), ("4", None)]
+    difusor.publicar(("9", None), "VENDER", ["A1"])  # Sin canal: no crea uno
+    assert ("9", None) not in difusor._canales
+    escuchando.close()
+    print("Canales por función: OK")
+
+
+def main():
+    probar_marcos()
+    probar_reanudacion()
+    probar_capacidad()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# test_limite_tasa.py
+
+import os
+import sys
+
+# Permite ejecutarlo como script desde servicios/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from servicios.limite_tasa import LimitadorTasa, LimiteConexiones, presupuestos_desde_texto
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+
+def esperar_error(funcion, *args):
+    try:
+        funcion(*args)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError("Se esperaba ValueError")
+
+
+def probar_bucket():
+    reloj = Reloj()
+    limitador = LimitadorTasa({"select": (3, 2.0)}, reloj=reloj)
+    # Ráfaga de 3 y luego una solicitud cada 0.5 s
+    assert [limitador.permitir("select", "s1") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limitador.permitir("select", "s1") == 0.5 and limitador.rechazos == 1
+    assert limitador.permitir("select", "s2") == 0.0  # Otra clave, otro bucket
+    reloj.ahora = 0.5
+    assert limitador.permitir("select", "s1") == 0.0 and limitador.permitir("select", "s1") == 0.5
+
+    # El multiplicador escala ráfaga y tasa (claves compartidas como una IP)
+    assert sum(limitador.permitir("select", "ip", 10) == 0.0 for _ in range(40)) == 30
+    reloj.ahora = 0.6
+    assert limitador.permitir("select", "ip", 10) == 0.0  # 20 por segundo: una cada 0.05 s
+    print("Ráfaga y tasa: OK")
+
+
+def probar_varias_claves():
+    reloj = Reloj()
+    limitador = LimitadorTasa({"select": (2, 1.0)}, reloj=reloj)
+    claves = [("ip:1", 3), ("sesion:a", 1)]
+    assert limitador.permitir_todas("select", claves) == 0.0
+    assert limitador.permitir_todas("select", claves) == 0.0
+    # La sesión rechaza: la IP no gasta su presupuesto por esas solicitudes
+    for _ in range(50):
+        assert limitador.permitir_todas("select", claves) == 1.0
+    for sesion in "bcde":
+        assert limitador.permitir_todas("select", [("ip:1", 3), (f"sesion:{sesion}", 1)]) == 0.0
+    # Ahora la IP agotó su ráfaga de 6: rechaza también a sesiones nuevas
+    assert limitador.permitir_todas("select", [("ip:1", 3), ("sesion:f", 1)]) > 0
+    assert limitador.permitir("select", "sesion:f") == 0.0  # La sesión f no gastó nada
+    print("Varias claves sin gasto parcial: OK")
+
+
+def probar_capacidad():
+    reloj = Reloj()
+    limitador = LimitadorTasa({"select": (2, 1.0)}, capacidad=2, reloj=reloj)
+    for clave in ("a", "b", "c"):
+        limitador.permitir("select", clave)
+    assert len(limitador) == 2  # Se expulsa la menos usada
+    reloj.ahora = 10.0
+    limitador.permitir("select", "d")
+    assert len(limitador) == 1  # Las que ya tienen el bucket lleno no ocupan lugar
+    print("Capacidad de claves: OK")
+
+
+def probar_validacion():
+    assert presupuestos_desde_texto("select_seat=3/1, undo=4,, mal") == {"select_seat": (3, 1.0), "undo": (4, 4.0)}
+    assert presupuestos_desde_texto(None) == {} and presupuestos_desde_texto("") == {}
+    for texto in ("select_seat=5/0", "select_seat=0/5", "undo=-1", "undo=x/2", "undo=2/nan", "undo="):
+        print("Rechazado:", esperar_error(presupuestos_desde_texto, texto))
+    esperar_error(LimitadorTasa, {"select": (5, 0.0)})
+    esperar_error(LimitadorTasa, {"select": (0, 1.0)})
+    print("Validación de presupuestos: OK")
+
+
+def probar_conexiones():
+    limite = LimiteConexiones(2)
+    assert limite.adquirir("ip:1") and limite.adquirir("ip:1")
+    assert not limite.adquirir("ip:1") and limite.rechazos == 1
+    assert limite.adquirir("ip:2")  # Cada clave tiene su propio tope
+
+    # Al cerrar una conexión se libera su lugar; las claves sin conexiones no se guardan
+    limite.liberar("ip:1")
+    assert limite.adquirir("ip:1")
+    limite.liberar("ip:2")
+    assert len(limite) == 1
+    print("Tope de conexiones simultáneas: OK")
+
+
+def main():
+    probar_conexiones()
+    probar_bucket()
+    probar_varias_claves()
+    probar_capacidad()
+    probar_validacion()
+
+
+if __name__ == "__main__":
+    main()
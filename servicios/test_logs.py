@@ -0,0 +1,43 @@
+# test_logs.py
+
+import io
+import logging
+import os
+import sys
+
+# Permite ejecutarlo como script desde servicios/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from servicios.logs import configurar_logging, detener_logging_asincrono
+
+
+class Mutable:
+    def __init__(self):
+        self.estado = "PENDIENTE"
+
+    def __str__(self):
+        return f"Pedido({self.estado})"
+
+
+def main():
+    salida = io.StringIO()
+    configurar_logging(asincrono=True, formato="texto", stream=salida)
+    logger = logging.getLogger("prueba")
+
+    pedido = Mutable()
+    logger.info("Creado: %s", pedido)
+    pedido.estado = "COMPLETADO"  # Cambia antes de que el listener formatee
+    logger.info("Numeros: %d %s %r", 3, "texto", None)
+    logger.info("Por nombre: %(pedido)s", {"pedido": pedido})
+    detener_logging_asincrono()
+
+    lineas = salida.getvalue().splitlines()
+    print("\n".join(lineas))
+    assert lineas[0].endswith("Creado: Pedido(PENDIENTE)")
+    assert lineas[1].endswith("Numeros: 3 texto None")
+    assert lineas[2].endswith("Por nombre: Pedido(COMPLETADO)")
+    configurar_logging(stream=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
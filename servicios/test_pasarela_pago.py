@@ -0,0 +1,240 @@
+# test_pasarela_pago.py
+
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Permite ejecutarlo como script desde servicios/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller.cadenas import construir_cadena_por_defecto
+from controller.controller import PedidoController
+from models.chain import EstadoPedido
+from servicios.pasarela_pago import PasarelaHTTPAsync
+from servicios.servidor_pago_stub import ServidorPagoStub
+
+
+def probar_reutilizacion():
+    servidor = ServidorPagoStub().iniciar_en_hilo()
+    pasarela = PasarelaHTTPAsync(servidor.url, max_conexiones=4)
+    try:
+        resultados = [pasarela.procesar("Tarjeta", 100.0, f"R{i}") for i in range(20)]
+        assert all(resultado.es_exitoso() for resultado in resultados)
+        assert resultados[7].referencia == "R7"
+        rechazo = pasarela.procesar("Tarjeta rechazada", 100.0, "R-rechazo")
+        assert not rechazo.es_exitoso() and rechazo.mensaje_error() == "Tarjeta rechazada."
+        # Llamadas secuenciales: una sola conexión keep-alive para todas
+        assert servidor.solicitudes_atendidas == 21 and servidor.conexiones_aceptadas == 1
+        print("Reutilización keep-alive: OK")
+    finally:
+        pasarela.cerrar()
+        servidor.detener()
+
+
+def probar_limite_concurrencia():
+    servidor = ServidorPagoStub(latencia_min_ms=30, latencia_max_ms=30).iniciar_en_hilo()
+    pasarela = PasarelaHTTPAsync(servidor.url, max_conexiones=3)
+    try:
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            resultados = list(pool.map(lambda i: pasarela.procesar("Tarjeta", 1.0, f"C{i}"), range(36)))
+        assert all(resultado.es_exitoso() for resultado in resultados)
+        # El semáforo deja como mucho 3 cobros a la vez y el pool no abre más de 3 conexiones
+        assert servidor.max_cobros_en_curso == 3, servidor.max_cobros_en_curso
+        assert servidor.conexiones_aceptadas <= 3, servidor.conexiones_aceptadas
+        print("Límite de concurrencia: OK")
+    finally:
+        pasarela.cerrar()
+        servidor.detener()
+
+
+def probar_timeout():
+    servidor = ServidorPagoStub(latencia_min_ms=300, latencia_max_ms=300).iniciar_en_hilo()
+    pasarela = PasarelaHTTPAsync(servidor.url, max_conexiones=2, timeout_total=0.05)
+    try:
+        resultado = pasarela.procesar("Tarjeta", 1.0, "T1")
+        assert not resultado.es_exitoso() and "Tiempo de espera" in resultado.mensaje_error()
+        assert resultado.referencia == "T1" and "anulado" in resultado.mensaje_error()
+        # El cobro que la pasarela terminó después del timeout queda anulado, no cobrado
+        time.sleep(0.4)
+        assert servidor.cobros[resultado.clave_idempotencia]["aprobado"] is False
+        # La conexión cortada a mitad de respuesta se descarta; la anulación abrió otra y el siguiente cobro la reutiliza
+        servidor.latencia_min_ms = servidor.latencia_max_ms = 0
+        assert pasarela.procesar("Tarjeta", 1.0, "T2").es_exitoso()
+        assert servidor.conexiones_aceptadas == 2
+    finally:
+        pasarela.cerrar()
+        servidor.detener()
+
+    # Sin servidor: error de comunicación, no una excepción
+    pasarela = PasarelaHTTPAsync(servidor.url, timeout_conexion=0.5)
+    try:
+        resultado = pasarela.procesar("Tarjeta", 1.0, "T3")
+        assert not resultado.es_exitoso() and "comunicación" in resultado.mensaje_error()
+    finally:
+        pasarela.cerrar()
+    print("Timeouts y errores de conexión: OK")
+
+
+def probar_idempotencia():
+    servidor = ServidorPagoStub().iniciar_en_hilo()
+    pasarela = PasarelaHTTPAsync(servidor.url)
+    try:
+        # Reintentar con la misma clave no cobra dos veces
+        for _ in range(2):
+            resultado = pasarela.programar(pasarela.procesar_async("Tarjeta", 1.0, "I1", clave_idempotencia="k1")).result()
+            assert resultado.es_exitoso() and resultado.clave_idempotencia == "k1"
+        assert servidor.cobros_procesados == 1 and servidor.solicitudes_atendidas == 2
+        # Cada cobro sin clave explícita lleva una nueva
+        claves = {pasarela.procesar("Tarjeta", 1.0, f"I{i}").clave_idempotencia for i in range(3)}
+        assert len(claves) == 3 and servidor.cobros_procesados == 4
+        print("Idempotencia: OK")
+    finally:
+        pasarela.cerrar()
+        servidor.detener()
+
+
+class ServidorRespuestaFija(socketserver.ThreadingTCPServer):
+    """Responde siempre los mismos bytes (respuestas mal formadas) y cierra la conexión"""
+    daemon_threads = True
+
+    def __init__(self, respuesta: bytes):
+        class Manejador(socketserver.StreamRequestHandler):
+            def handle(self):
+                while self.rfile.readline() not in (b"\r\n", b""):
+                    pass
+                self.wfile.write(respuesta)
+
+        super().__init__(("127.0.0.1", 0), Manejador)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def probar_respuestas_invalidas():
+    respuestas = {
+        "línea de estado": b"HTTP/1.1\r\n\r\n",
+        "JSON inválido": b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nnojsn",
+        "JSON que no es objeto": b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n[]",
+        "cuerpo cortado": b"HTTP/1.1 200 OK\r\nContent-Length: 50\r\n\r\n{\"aprobado\"",
+    }
+    for caso, respuesta in respuestas.items():
+        servidor = ServidorRespuestaFija(respuesta)
+        pasarela = PasarelaHTTPAsync(f"http://127.0.0.1:{servidor.server_address[1]}/pagos", timeout_total=1.0)
+        try:
+            # Se informa como pago fallido, sin que la excepción escape
+            resultado = pasarela.procesar("Tarjeta", 1.0, "M1")
+            assert not resultado.es_exitoso() and "comunicación" in resultado.mensaje_error(), caso
+        finally:
+            pasarela.cerrar()
+            servidor.shutdown()
+            servidor.server_close()
+    print("Respuestas inválidas: OK")
+
+
+def probar_cadena_asincrona():
+    servidor = ServidorPagoStub(latencia_min_ms=200, latencia_max_ms=200).iniciar_en_hilo()
+    pasarela = PasarelaHTTPAsync(servidor.url)
+    try:
+        controlador = PedidoController(cadena=construir_cadena_por_defecto(pasarela))
+        controlador.seleccionar_asiento("A1")
+        pedido = controlador.crear_pedido("Tarjeta", funcion=("1", None))
+        futuro = pasarela.programar(controlador.procesar_pedido_async(pedido))
+        assert controlador.pago_en_curso and not futuro.done()  # El hilo que lo programó no espera
+        assert futuro.result(timeout=5) is pedido and pedido.estado == EstadoPedido.COMPLETADO
+        assert not controlador.pago_en_curso
+
+        # Cancelado mientras la pasarela cobraba: el cobro aprobado se anula
+        pedido = controlador.crear_pedido("Tarjeta", funcion=("1", None))
+        futuro = pasarela.programar(controlador.procesar_pedido_async(pedido))
+        time.sleep(0.1)
+        assert controlador.cancelar_pedido()
+        futuro.result(timeout=5)
+        assert pedido.estado == EstadoPedido.CANCELADO and len(servidor.anulados) == 1
+        assert not any(cobro["aprobado"] for clave, cobro in servidor.cobros.items() if clave in servidor.anulados)
+        print("Cadena asíncrona: OK")
+    finally:
+        pasarela.cerrar()
+        servidor.detener()
+
+
+class PasarelaCancelaAlResponder(PasarelaHTTPAsync):
+    """Cancela el pedido justo después de que la pasarela aprueba y antes de CONFIRMAR_PAGO"""
+
+    def __init__(self, url: str, anulacion_falla: bool = False):
+        super().__init__(url)
+        self.pedido = None
+        self._anulacion_falla = anulacion_falla
+
+    async def procesar_async(self, *args, **kwargs):
+        resultado = await super().procesar_async(*args, **kwargs)
+        assert self.pedido.cancelar()
+        return resultado
+
+    async def anular_async(self, clave_idempotencia: str) -> bool:
+        if self._anulacion_falla:
+            raise ConnectionResetError("conexión cerrada por la pasarela")
+        return await super().anular_async(clave_idempotencia)
+
+
+class RegistrosConciliar(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.mensajes = []
+
+    def emit(self, registro):
+        if registro.getMessage().startswith("CONCILIAR"):
+            self.mensajes.append(registro.getMessage())
+
+
+def probar_cancelacion_durante_cobro():
+    servidor = ServidorPagoStub(latencia_min_ms=50, latencia_max_ms=50).iniciar_en_hilo()
+    conciliar = RegistrosConciliar()
+    logging.getLogger("servicios.pasarela_pago").addHandler(conciliar)
+    pasarelas = []
+    try:
+        # Cancelado entre la respuesta de la pasarela y CONFIRMAR_PAGO (asíncrono y síncrono)
+        for asincrona in (True, False):
+            pasarela = PasarelaCancelaAlResponder(servidor.url)
+            pasarelas.append(pasarela)
+            controlador = PedidoController(cadena=construir_cadena_por_defecto(pasarela))
+            controlador.seleccionar_asiento("A1")
+            pasarela.pedido = controlador.crear_pedido("Tarjeta", funcion=("1", None))
+            if asincrona:
+                pasarela.programar(controlador.procesar_pedido_async(pasarela.pedido)).result(timeout=5)
+            else:
+                controlador.primer_manejador.procesar_pedido(pasarela.pedido)
+            assert pasarela.pedido.estado == EstadoPedido.CANCELADO
+        assert len(servidor.anulados) == 2 and not conciliar.mensajes
+
+        # Cancelado mientras el stub cobra y la anulación falla: queda para conciliar, sin excepción
+        pasarela = PasarelaCancelaAlResponder(servidor.url, anulacion_falla=True)
+        pasarelas.append(pasarela)
+        controlador = PedidoController(cadena=construir_cadena_por_defecto(pasarela))
+        controlador.seleccionar_asiento("A2")
+        pasarela.pedido = controlador.crear_pedido("Tarjeta", funcion=("1", None))
+        futuro = pasarela.programar(controlador.procesar_pedido_async(pasarela.pedido))
+        assert futuro.result(timeout=5) is pasarela.pedido
+        assert pasarela.pedido.estado == EstadoPedido.CANCELADO
+        assert len(conciliar.mensajes) == 1 and pasarela.pedido.id in conciliar.mensajes[0]
+        print("Cancelación durante el cobro: OK")
+    finally:
+        logging.getLogger("servicios.pasarela_pago").removeHandler(conciliar)
+        for pasarela in pasarelas:
+            pasarela.cerrar()
+        servidor.detener()
+
+
+def main():
+    probar_reutilizacion()
+    probar_limite_concurrencia()
+    probar_timeout()
+    probar_idempotencia()
+    probar_respuestas_invalidas()
+    probar_cadena_asincrona()
+    probar_cancelacion_durante_cobro()
+
+
+if __name__ == "__main__":
+    main()
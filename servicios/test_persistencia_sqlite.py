@@ -0,0 +1,154 @@
+# test_persistencia_sqlite.py
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Permite ejecutarlo como script desde servicios/ o desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.chain import EstadoPedido, ItemBoleta, ItemConfiteria, Pedido
+from models.descuentos import ContadorUsos
+from servicios.persistencia_sqlite import EscritorDiferido, RepositorioSQLite
+
+SQL_CREAR = "CREATE TABLE IF NOT EXISTS valores (valor INTEGER)"
+SQL_INSERTAR = "INSERT INTO valores (valor) VALUES (?)"
+
+
+def contar(ruta: str) -> int:
+    conexion = sqlite3.connect(ruta)
+    try:
+        return conexion.execute("SELECT COUNT(*) FROM valores").fetchone()[0]
+    finally:
+        conexion.close()
+
+
+def con_escritor_bloqueado(ruta: str, encolar):
+    """Mantiene la base bloqueada desde otra conexión mientras se encolan escrituras,
+    para que el escritor las acumule en un mismo lote"""
+    bloqueo = sqlite3.connect(ruta, isolation_level=None)
+    bloqueo.execute("BEGIN IMMEDIATE")
+    resultado = encolar()
+    time.sleep(0.2)
+    bloqueo.execute("COMMIT")
+    bloqueo.close()
+    return resultado
+
+
+def probar_agrupacion(directorio: str):
+    ruta = os.path.join(directorio, "agrupacion.db")
+    escritor = EscritorDiferido(ruta)
+    escritor.escribir([(SQL_CREAR, ())], esperar=True)
+    lotes_iniciales = escritor.lotes_confirmados
+
+    hilos = []
+
+    def encolar():
+        escritor.escribir([(SQL_INSERTAR, (0,))])  # Queda esperando el bloqueo
+        time.sleep(0.05)
+        for valor in range(1, 50):
+            hilo = threading.Thread(target=escritor.escribir, args=([(SQL_INSERTAR, (valor,))], True))
+            hilo.start()
+            hilos.append(hilo)
+        time.sleep(0.05)
+
+    con_escritor_bloqueado(ruta, encolar)
+    for hilo in hilos:
+        hilo.join()
+    # 50 escrituras en 2 transacciones: la que esperaba el bloqueo y el resto agrupado
+    assert escritor.lotes_confirmados - lotes_iniciales == 2, escritor.lotes_confirmados
+    assert contar(ruta) == 50
+    escritor.detener()
+    print("Agrupación de escrituras: OK")
+
+
+def probar_lote_fallido(directorio: str):
+    ruta = os.path.join(directorio, "fallido.db")
+    escritor = EscritorDiferido(ruta)
+    escritor.escribir([(SQL_CREAR, ())], esperar=True)
+    errores = {}
+
+    def escribir(nombre, valor):
+        try:
+            escritor.escribir([(SQL_INSERTAR, (valor,))], esperar=True)
+        except Exception as e:
+            errores[nombre] = e
+
+    hilos = []
+
+    def encolar():
+        escritor.escribir([(SQL_INSERTAR, (1,))])
+        time.sleep(0.05)
+        # Un entero que SQLite no puede guardar (OverflowError, no sqlite3.Error) en medio del lote
+        for nombre, valor in (("a", 2), ("desborde", 2 ** 70), ("b", 3), ("nulo", None)):
+            hilo = threading.Thread(target=escribir, args=(nombre, valor))
+            hilo.start()
+            hilos.append(hilo)
+        time.sleep(0.05)
+
+    con_escritor_bloqueado(ruta, encolar)
+    for hilo in hilos:
+        hilo.join(timeout=10)
+        assert not hilo.is_alive(), "Una escritura quedó esperando para siempre"
+    # Solo falla la escritura inválida; las demás del lote se confirman y el hilo sigue vivo
+    assert list(errores) == ["desborde"] and isinstance(errores["desborde"], OverflowError)
+    assert contar(ruta) == 4
+    escritor.escribir([(SQL_INSERTAR, (5,))], esperar=True)
+    assert contar(ruta) == 5
+
+    # Una operación con error de SQL también se informa sin afectar al resto
+    try:
+        escritor.escribir([("INSERT INTO no_existe VALUES (1)", ())], esperar=True)
+        raise AssertionError("Se esperaba sqlite3.Error")
+    except sqlite3.Error:
+        pass
+
+    escritor.detener()
+    try:
+        escritor.escribir([(SQL_INSERTAR, (6,))], esperar=True)
+        raise AssertionError("Se esperaba RuntimeError")
+    except RuntimeError as e:
+        print("Escritor detenido:", e)
+    print("Recuperación de lotes fallidos: OK")
+
+
+def probar_repositorio(directorio: str):
+    ruta = os.path.join(directorio, "cine.db")
+    repositorio = RepositorioSQLite(ruta)
+    pedido = Pedido("PED-1", [ItemBoleta("A1", 120.0), ItemBoleta("A2", 120.0)],
+                    [ItemConfiteria("Palomitas", 2, 5.0)], "Tarjeta", None, ("1", "2026-10-18T19:30"))
+    pedido.subtotal, pedido.total_final = 250.0, 297.5
+    pedido.estado = EstadoPedido.COMPLETADO
+    pedido.canjes_descuento = (ContadorUsos(10, 1, "GRUPO"),)
+    repositorio.registrar_venta(pedido)
+    repositorio.registrar_venta(pedido)  # Guardarla otra vez no repite el uso del cupón
+    repositorio.cerrar()
+
+    repositorio = RepositorioSQLite(ruta)
+    cargado, = repositorio.cargar_pedidos()
+    assert cargado.id == "PED-1" and cargado.estado == EstadoPedido.COMPLETADO
+    assert [(item.asiento_id, item.precio) for item in cargado.items_boletas] == [("A1", 120.0), ("A2", 120.0)]
+    assert cargado.total_final == 297.5 and cargado.funcion == ("1", "2026-10-18T19:30")
+    assert repositorio.cargar_asientos_vendidos() == {("1", "2026-10-18T19:30"): ["A1", "A2"]}
+    assert repositorio.cargar_usos_descuento() == {"GRUPO": 1}
+
+    cargado.estado = EstadoPedido.REEMBOLSO_PROCESADO
+    repositorio.registrar_reembolso(cargado)
+    assert repositorio.cargar_asientos_vendidos() == {}
+    assert repositorio.cargar_pedidos()[0].estado == EstadoPedido.REEMBOLSO_PROCESADO
+    repositorio.cerrar()
+    print("Repositorio: OK")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directorio:
+        probar_agrupacion(directorio)
+        probar_lote_fallido(directorio)
+        probar_repositorio(directorio)
+
+
+if __name__ == "__main__":
+    main()